@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Create loans lookup indexes."""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '2f29c27d5634'
+down_revision = 'e2ace60b8a90'
+branch_labels = ()
+depends_on = '07fb52561c5c'
+
+
+def upgrade():
+    """Upgrade database."""
+    if op._proxy.migration_context.dialect.name == 'postgresql':
+        op.execute(
+            "CREATE INDEX idx_circulation_loans_item_pid_state "
+            "ON records_metadata ("
+            "((json -> 'item_pid') ->> 'value'), "
+            "((json -> 'item_pid') ->> 'type'), "
+            "(json ->> 'state'))"
+        )
+        op.execute(
+            "CREATE INDEX idx_circulation_loans_document_pid_state "
+            "ON records_metadata ("
+            "(json ->> 'document_pid'), "
+            "(json ->> 'state'))"
+        )
+
+
+def downgrade():
+    """Downgrade database."""
+    if op._proxy.migration_context.dialect.name == 'postgresql':
+        op.drop_index(
+            'idx_circulation_loans_document_pid_state',
+            table_name='records_metadata'
+        )
+        op.drop_index(
+            'idx_circulation_loans_item_pid_state',
+            table_name='records_metadata'
+        )
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Create loans archive table."""
+
+import sqlalchemy as sa
+import sqlalchemy_utils
+from alembic import op
+from sqlalchemy.dialects import mysql, postgresql
+
+# revision identifiers, used by Alembic.
+revision = '8d2b4a1f6c3e'
+down_revision = '2f29c27d5634'
+branch_labels = ()
+depends_on = None
+
+
+def upgrade():
+    """Upgrade database."""
+    op.create_table(
+        'circulation_loans_archive',
+        sa.Column('created', sa.DateTime(), nullable=False),
+        sa.Column('updated', sa.DateTime(), nullable=False),
+        sa.Column(
+            'id', sqlalchemy_utils.types.uuid.UUIDType(), nullable=False
+        ),
+        sa.Column('pid_value', sa.String(length=255), nullable=False),
+        sa.Column(
+            'json',
+            sa.JSON().with_variant(
+                sqlalchemy_utils.types.json.JSONType(), 'mysql'
+            ).with_variant(
+                postgresql.JSONB(none_as_null=True), 'postgresql'
+            ).with_variant(
+                sqlalchemy_utils.types.json.JSONType(), 'sqlite'
+            ),
+            nullable=False
+        ),
+        sa.Column('version_id', sa.Integer(), nullable=False),
+        sa.Column(
+            'archived',
+            sa.DateTime().with_variant(mysql.DATETIME(fsp=6), 'mysql'),
+            nullable=False
+        ),
+        sa.PrimaryKeyConstraint(
+            'id', name=op.f('pk_circulation_loans_archive')
+        ),
+        sa.UniqueConstraint(
+            'pid_value', name=op.f('uq_circulation_loans_archive_pid_value')
+        ),
+    )
+    op.create_index(
+        op.f('ix_circulation_loans_archive_archived'),
+        'circulation_loans_archive',
+        ['archived'],
+        unique=False
+    )
+
+
+def downgrade():
+    """Downgrade database."""
+    op.drop_index(
+        op.f('ix_circulation_loans_archive_archived'),
+        table_name='circulation_loans_archive'
+    )
+    op.drop_table('circulation_loans_archive')
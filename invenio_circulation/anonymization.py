@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Anonymization of the patrons of the loans that are over.
+
+The patron fields of the loans completed or cancelled long enough ago are
+removed by chunks, with one update statement per chunk: the records signals
+are not sent and no record versions are created. The fields are removed from
+the stored versions of the loans in the same transaction. The revision of the
+loans is incremented and each chunk is then indexed again.
+"""
+
+import json
+import os
+import time
+from datetime import datetime
+
+import sqlalchemy as sa
+from flask import current_app
+from invenio_db import db
+from invenio_pidstore.models import PersistentIdentifier, PIDStatus
+from invenio_records.models import RecordMetadata
+
+from .cache import invalidate_loans
+from .pidstore.pids import CIRCULATION_LOAN_PID_TYPE
+from .reindex import index_loans_by_id
+from .search.db import json_text
+from .versioning import anonymize_loan_versions
+
+
+def _anonymizable_loans_query(before, fields):
+    """Return a query on the loans over before the given time.
+
+    Only the loans still holding one of the anonymized fields are selected.
+    """
+    config = current_app.config
+    states = config["CIRCULATION_STATES_LOAN_COMPLETED"] + \
+        config["CIRCULATION_STATES_LOAN_CANCELLED"]
+    return db.session.query(
+        RecordMetadata.id, RecordMetadata.json, RecordMetadata.version_id
+    ).join(
+        PersistentIdentifier,
+        db.and_(
+            PersistentIdentifier.object_type == "rec",
+            PersistentIdentifier.object_uuid == RecordMetadata.id,
+        ),
+    ).filter(
+        PersistentIdentifier.pid_type == CIRCULATION_LOAN_PID_TYPE,
+        PersistentIdentifier.status == PIDStatus.REGISTERED,
+        json_text("state").in_(states),
+        db.or_(*[json_text(field) != None for field in fields]),  # noqa
+        RecordMetadata.updated < before,
+    )
+
+
+def _read_checkpoint(path):
+    """Return the id of the last anonymized loan and the loans to index."""
+    with open(path, "r") as fp:
+        checkpoint = json.load(fp)
+    return checkpoint["id"], checkpoint["pending"]
+
+
+def _write_checkpoint(path, loan_id, pending):
+    """Save the id of the last anonymized loan and the loans to index."""
+    tmp_path = "{0}.tmp".format(path)
+    with open(tmp_path, "w") as fp:
+        json.dump(dict(id=loan_id, pending=pending), fp)
+    os.replace(tmp_path, path)
+
+
+def _anonymize_chunk(rows, fields, now):
+    """Remove the patron fields of the loans and of their versions."""
+    table = RecordMetadata.__table__
+    statement = table.update().where(
+        table.c.id == sa.bindparam("loan_id")
+    ).values(
+        json=sa.bindparam("loan_json", type_=table.c.json.type),
+        version_id=sa.bindparam("loan_version_id"),
+        updated=now,
+    )
+    db.session.execute(statement, [
+        dict(
+            loan_id=row.id,
+            loan_json=dict(
+                (field, value) for field, value in row.json.items()
+                if field not in fields
+            ),
+            loan_version_id=row.version_id + 1,
+        )
+        for row in rows
+    ])
+    anonymize_loan_versions(
+        db.session.connection(), [row.id for row in rows], fields
+    )
+
+
+def _index(loan_ids, result):
+    """Index the anonymized loans and account for the errors."""
+    indexed, errors = index_loans_by_id(loan_ids)
+    for error in errors:
+        current_app.logger.error(
+            "Failed to index anonymized loan: {0}".format(error)
+        )
+    result["indexed"] += indexed
+    result["errors"] += len(errors)
+    return indexed, errors
+
+
+def anonymize_loans(before=None, checkpoint=None, chunk_size=1000,
+                    progress=None):
+    """Remove the patron of the loans that are over.
+
+    Each chunk of loans is locked, anonymized and committed, then indexed.
+    When a checkpoint file is given, the last anonymized loan and the loans
+    not indexed yet are saved to it, and the anonymization resumes from it
+    when it exists.
+
+    :param before: anonymize the loans not updated since this time. Defaults
+        to the current time minus `CIRCULATION_LOAN_ANONYMIZATION_AGE`.
+    :param checkpoint: the path of the checkpoint file.
+    :param chunk_size: the number of loans anonymized at once.
+    :param progress: a function called after each chunk with the number of
+        anonymized, indexed and failed loans.
+    :returns: a dict with the number of anonymized, indexed and failed loans
+        and the duration of the anonymization.
+    """
+    config = current_app.config
+    before = before or \
+        datetime.utcnow() - config["CIRCULATION_LOAN_ANONYMIZATION_AGE"]
+    fields = set(config["CIRCULATION_LOAN_ANONYMIZED_FIELDS"])
+    result = dict(anonymized=0, indexed=0, errors=0)
+    started = time.time()
+
+    last_id = None
+    if checkpoint and os.path.exists(checkpoint):
+        last_id, pending = _read_checkpoint(checkpoint)
+        if pending:
+            _index(pending, result)
+            _write_checkpoint(checkpoint, last_id, [])
+
+    while True:
+        query = _anonymizable_loans_query(before, fields)
+        if last_id is not None:
+            query = query.filter(RecordMetadata.id > last_id)
+        rows = query.order_by(RecordMetadata.id).limit(chunk_size) \
+            .with_for_update(of=RecordMetadata).all()
+        if not rows:
+            break
+        loan_ids = [str(row.id) for row in rows]
+        last_id = loan_ids[-1]
+        _anonymize_chunk(rows, fields, datetime.utcnow())
+        invalidate_loans(loan_ids)
+        db.session.commit()
+        result["anonymized"] += len(loan_ids)
+
+        if checkpoint:
+            _write_checkpoint(checkpoint, last_id, loan_ids)
+        indexed, errors = _index(loan_ids, result)
+        if checkpoint:
+            _write_checkpoint(checkpoint, last_id, [])
+        if progress:
+            progress(len(loan_ids), indexed, len(errors))
+
+    result["duration"] = time.time() - started
+    return result
@@ -10,14 +10,25 @@
 
 from elasticsearch import VERSION as ES_VERSION
 from flask import current_app
+from invenio_db import db
 from invenio_jsonschemas import current_jsonschemas
-from invenio_pidstore.resolver import Resolver
+from invenio_pidstore.errors import PIDDoesNotExistError
 from invenio_records.api import Record
-
-from .errors import MissingRequiredParameterError, MultipleLoansOnItemError
-from .pidstore.pids import CIRCULATION_LOAN_PID_TYPE
-from .search.api import search_by_pid
+from invenio_records.errors import MissingModelError
+from jsonschema.exceptions import best_match
+
+from .cache import cache_loan, cache_loan_id, get_cached_loan, \
+    get_cached_loan_id, invalidate_loans
+from .errors import LoanArchivedError, MissingRequiredParameterError, \
+    MultipleLoansOnItemError
+from .models import LoanArchive
+from .pidstore.resolver import LoanResolver
+from .proxies import current_circulation
+from .search.api import search_by_document_pids, search_by_item_pids, \
+    search_by_pid
+from .search.db import db_search_by_pid, db_search_by_pids
 from .utils import str2datetime
+from .versioning import LoanRevisionsIterator
 
 
 class Loan(Record):
@@ -63,6 +74,31 @@ class Loan(Record):
 
         return super().create(data, id_=id_, **kwargs)
 
+    def validate(self, validate_fields=None, **kwargs):
+        """Validate the loan against the loans JSON schema.
+
+        The validator of the loans schema is built once and reused. Custom
+        validation options fall back to the records validation.
+
+        :param validate_fields: validate only these fields, the ones changed
+            by a trusted transition.
+        """
+        schema = current_circulation.loan_record_cls._schema
+        if kwargs or self.get("$schema") != \
+                current_jsonschemas.path_to_url(schema):
+            return super().validate(**kwargs)
+
+        data = self
+        if validate_fields is not None:
+            data = dict(
+                (field, self[field]) for field in validate_fields
+                if field in self
+            )
+        validator = current_circulation.get_loan_validator(validate_fields)
+        error = best_match(validator.iter_errors(dict(data)))
+        if error is not None:
+            raise error
+
     def update(self, *args, **kwargs):
         """Update Loan record."""
         super().update(*args, **kwargs)
@@ -84,16 +120,71 @@ class Loan(Record):
                 self[field] = self[field].isoformat()
 
     @classmethod
-    def get_record_by_pid(cls, pid, with_deleted=False):
-        """Get ils record by pid value."""
-        resolver = Resolver(
-            pid_type=CIRCULATION_LOAN_PID_TYPE,
-            object_type="rec",
-            getter=cls.get_record,
-        )
-        _, record = resolver.resolve(str(pid))
+    def get_record_by_pid(cls, pid, with_deleted=False, with_archived=True):
+        """Get ils record by pid value.
+
+        :param with_archived: look the PID up in the loans archive when it
+            is not registered.
+        """
+        if current_circulation.loan_cache is not None:
+            loan_id = get_cached_loan_id(pid)
+            if loan_id is not None:
+                return cls.get_record(loan_id)
+
+        try:
+            _, record = LoanResolver(cls).resolve(str(pid))
+        except PIDDoesNotExistError:
+            record = with_archived and cls.get_archived_record_by_pid(pid)
+            if not record:
+                raise
+            return record
+
+        if current_circulation.loan_cache is not None:
+            cache_loan_id(pid, str(record.id))
+        return record
+
+    @classmethod
+    def get_record(cls, id_, with_deleted=False):
+        """Get a loan by id, from the loans cache when enabled."""
+        if current_circulation.loan_cache is None or with_deleted:
+            return super().get_record(id_, with_deleted=with_deleted)
+
+        record = get_cached_loan(cls, id_)
+        if record is None:
+            record = super().get_record(id_)
+            cache_loan(record)
+        return record
+
+    def commit(self, **kwargs):
+        """Store changes of the loan and invalidate its cached version."""
+        record = super().commit(**kwargs)
+        invalidate_loans([self.id])
+        return record
+
+    def delete(self, force=False):
+        """Delete the loan and invalidate its cached version."""
+        record = super().delete(force=force)
+        invalidate_loans([self.id], pid_values=[self.get("pid")])
         return record
 
+    @property
+    def revisions(self):
+        """Get revisions iterator, with the versions stored as deltas whole."""
+        if self.model is None:
+            raise MissingModelError()
+        return LoanRevisionsIterator(self.model)
+
+    @classmethod
+    def get_archived_record_by_pid(cls, pid):
+        """Get an archived loan by pid value, or None.
+
+        :returns: a read-only :class:`ArchivedLoan`.
+        """
+        archive = LoanArchive.query.filter_by(pid_value=str(pid)).first()
+        if archive is None:
+            return None
+        return ArchivedLoan(archive.json, archive=archive)
+
     def update_item_ref(self, item_pid):
         """Replace item reference.
 
@@ -108,6 +199,72 @@ class Loan(Record):
         self["item_pid"] = item_pid
 
 
+class ArchivedLoan(Loan):
+    """Loan moved to the loans archive.
+
+    The archived loan has no record in the database: it keeps the id, the
+    revision and the creation and update times of its record, and it cannot
+    be changed until it is restored.
+    """
+
+    def __init__(self, data, archive=None):
+        """Constructor.
+
+        :param archive: the :class:`~invenio_circulation.models.LoanArchive`
+            of the loan.
+        """
+        super().__init__(data)
+        self.archive = archive
+
+    @property
+    def id(self):
+        """Get the record identifier of the loan."""
+        return self.archive.id if self.archive else None
+
+    @property
+    def revision_id(self):
+        """Get the revision of the archived loan."""
+        return self.archive.version_id - 1 if self.archive else None
+
+    @property
+    def created(self):
+        """Get the creation time of the loan record."""
+        return self.archive.created if self.archive else None
+
+    @property
+    def updated(self):
+        """Get the last update time of the loan record."""
+        return self.archive.updated if self.archive else None
+
+    def patch(self, patch):
+        """Archived loans cannot be changed."""
+        raise LoanArchivedError(loan_pid=self.get("pid"))
+
+    def commit(self, **kwargs):
+        """Archived loans cannot be changed."""
+        raise LoanArchivedError(loan_pid=self.get("pid"))
+
+    def delete(self, force=False):
+        """Archived loans cannot be changed."""
+        raise LoanArchivedError(loan_pid=self.get("pid"))
+
+    def revert(self, revision_id):
+        """Archived loans cannot be changed."""
+        raise LoanArchivedError(loan_pid=self.get("pid"))
+
+
+def _use_db_backend(helper):
+    """Return True if the given lookup helper should query the database."""
+    backends = current_app.config["CIRCULATION_LOAN_LOOKUP_BACKENDS"]
+    return backends.get(helper) == "db"
+
+
+def _loans_from_db(query):
+    """Yield the Loan records of the given database query."""
+    for model in query:
+        yield Loan(model.json, model=model)
+
+
 def is_item_available_for_checkout(item_pid):
     """Return True if the given item is available for loan, False otherwise.
 
@@ -121,6 +278,13 @@ def is_item_available_for_checkout(item_pid):
     if not cfg_item_can_circulate(item_pid):
         return False
 
+    if _use_db_backend("is_item_available_for_checkout"):
+        query = db_search_by_pid(
+            item_pid=item_pid,
+            filter_states=config.get("CIRCULATION_STATES_LOAN_ACTIVE"),
+        )
+        return not db.session.query(query.exists()).scalar()
+
     search = search_by_pid(
         item_pid=item_pid,
         filter_states=config.get("CIRCULATION_STATES_LOAN_ACTIVE"),
@@ -147,6 +311,17 @@ def get_pending_loans_by_item_pid(item_pid):
     :param item_pid: a dict containing `value` and `type` fields to
         uniquely identify the item.
     """
+    if _use_db_backend("get_pending_loans_by_item_pid"):
+        query = db_search_by_pid(
+            item_pid=item_pid,
+            filter_states=current_app.config[
+                "CIRCULATION_STATES_LOAN_REQUEST"
+            ],
+        )
+        for loan in _loans_from_db(query):
+            yield loan
+        return
+
     search = search_by_pid(
         item_pid=item_pid,
         filter_states=current_app.config["CIRCULATION_STATES_LOAN_REQUEST"]
@@ -157,6 +332,17 @@ def get_pending_loans_by_item_pid(item_pid):
 
 def get_pending_loans_by_doc_pid(document_pid):
     """Return any pending loans for the given document."""
+    if _use_db_backend("get_pending_loans_by_doc_pid"):
+        query = db_search_by_pid(
+            document_pid=document_pid,
+            filter_states=current_app.config.get(
+                "CIRCULATION_STATES_LOAN_REQUEST"
+            ),
+        )
+        for loan in _loans_from_db(query):
+            yield loan
+        return
+
     search = search_by_pid(
         document_pid=document_pid,
         filter_states=current_app.config.get(
@@ -189,6 +375,73 @@ def get_document_pid_by_item_pid(item_pid):
     )
 
 
+def get_document_pids_by_item_pids(item_pids):
+    """Return the Document PID of each Item PID."""
+    retrieve_all = current_app.config[
+        "CIRCULATION_DOCUMENTS_RETRIEVER_FROM_ITEMS"
+    ]
+    if retrieve_all:
+        return retrieve_all(item_pids)
+
+    retrieve = current_app.config["CIRCULATION_DOCUMENT_RETRIEVER_FROM_ITEM"]
+    document_pids = {}
+    for item_pid in item_pids:
+        key = (item_pid["type"], item_pid["value"])
+        if key not in document_pids:
+            document_pids[key] = retrieve(item_pid)
+    return [
+        document_pids[(item_pid["type"], item_pid["value"])]
+        for item_pid in item_pids
+    ]
+
+
+def get_pending_loans_by_doc_pids(document_pids):
+    """Return the pending loans of any of the given documents."""
+    states = current_app.config["CIRCULATION_STATES_LOAN_REQUEST"]
+    if _use_db_backend("get_pending_loans_by_doc_pid"):
+        query = db_search_by_pids(
+            document_pids=document_pids, filter_states=states
+        )
+        return list(_loans_from_db(query))
+
+    search = search_by_document_pids(document_pids, filter_states=states)
+    loan_ids = [hit.meta.id for hit in search.source(False).scan()]
+    if not loan_ids:
+        return []
+    # the index can be behind the database
+    return [
+        loan for loan in Loan.get_records(loan_ids)
+        if loan["state"] in states
+    ]
+
+
+def get_active_loans_by_item_pids(item_pids):
+    """Return the active loans attached to the given items, with one query.
+
+    :param item_pids: a list of dicts containing `value` and `type` fields
+        to uniquely identify the items.
+    :returns: a dict of the lists of active loans by `(type, value)` of the
+        Item PIDs.
+    """
+    states = current_app.config["CIRCULATION_STATES_LOAN_ACTIVE"]
+    if _use_db_backend("get_active_loans_by_item_pids"):
+        query = db_search_by_pids(item_pids=item_pids, filter_states=states)
+        active_loans = _loans_from_db(query)
+    else:
+        search = search_by_item_pids(item_pids, filter_states=states)
+        loan_ids = [hit.meta.id for hit in search.source(False).scan()]
+        # the index can be behind the database
+        active_loans = [
+            loan for loan in Loan.get_records(loan_ids)
+            if loan["state"] in states
+        ] if loan_ids else []
+    loans = {}
+    for loan in active_loans:
+        key = (loan["item_pid"]["type"], loan["item_pid"]["value"])
+        loans.setdefault(key, []).append(loan)
+    return loans
+
+
 def get_loan_for_item(item_pid):
     """Return the Loan attached to the given item, if any.
 
@@ -198,6 +451,16 @@ def get_loan_for_item(item_pid):
     if not item_pid:
         return
 
+    if _use_db_backend("get_loan_for_item"):
+        query = db_search_by_pid(
+            item_pid=item_pid,
+            filter_states=current_app.config["CIRCULATION_STATES_LOAN_ACTIVE"],
+        )
+        loans = list(_loans_from_db(query.limit(2)))
+        if len(loans) > 1:
+            raise MultipleLoansOnItemError(item_pid=item_pid)
+        return loans[0] if loans else None
+
     search = search_by_pid(
         item_pid=item_pid,
         filter_states=current_app.config["CIRCULATION_STATES_LOAN_ACTIVE"],
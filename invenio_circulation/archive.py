@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Archival of the loans that are over.
+
+The loans that stayed in a terminal state long enough are moved, by chunks,
+from the records metadata and PID tables to the loans archive table, and are
+removed from the loans index. Their PIDs are still resolved by
+:meth:`~invenio_circulation.api.Loan.get_record_by_pid`, and they can be
+restored as they were.
+"""
+
+import time
+from datetime import datetime
+
+from flask import current_app
+from invenio_db import db
+from invenio_pidstore.models import PersistentIdentifier, PIDStatus
+from invenio_records.models import RecordMetadata
+
+from .cache import invalidate_loans
+from .errors import LoansArchiveError
+from .models import LoanArchive
+from .pidstore.pids import CIRCULATION_LOAN_PID_TYPE
+from .reindex import delete_indexed_loans, index_loans_by_id
+from .search.db import json_text
+
+
+def _archivable_loans_query(before):
+    """Return a query on the loans over before the given time."""
+    return db.session.query(
+        RecordMetadata, PersistentIdentifier.pid_value
+    ).join(
+        PersistentIdentifier,
+        db.and_(
+            PersistentIdentifier.object_type == "rec",
+            PersistentIdentifier.object_uuid == RecordMetadata.id,
+        ),
+    ).filter(
+        PersistentIdentifier.pid_type == CIRCULATION_LOAN_PID_TYPE,
+        PersistentIdentifier.status == PIDStatus.REGISTERED,
+        json_text("state").in_(
+            current_app.config["CIRCULATION_LOAN_ARCHIVE_STATES"]
+        ),
+        RecordMetadata.updated < before,
+    )
+
+
+def count_archivable_loans(before=None):
+    """Return the number of loans that can be archived."""
+    before = before or \
+        datetime.utcnow() - current_app.config["CIRCULATION_LOAN_ARCHIVE_AGE"]
+    return _archivable_loans_query(before).count()
+
+
+def _archive_chunk(rows, now):
+    """Move the loans records and PIDs to the archive table."""
+    loan_ids = [record.id for record, _ in rows]
+    db.session.bulk_insert_mappings(LoanArchive, [
+        dict(
+            id=record.id,
+            pid_value=pid_value,
+            json=record.json,
+            version_id=record.version_id,
+            created=record.created,
+            updated=record.updated,
+            archived=now,
+        )
+        for record, pid_value in rows
+    ])
+    PersistentIdentifier.query.filter(
+        PersistentIdentifier.pid_type == CIRCULATION_LOAN_PID_TYPE,
+        PersistentIdentifier.object_type == "rec",
+        PersistentIdentifier.object_uuid.in_(loan_ids),
+    ).delete(synchronize_session=False)
+    RecordMetadata.query.filter(
+        RecordMetadata.id.in_(loan_ids)
+    ).delete(synchronize_session=False)
+
+
+def archive_loans(before=None, chunk_size=1000, index=True, progress=None):
+    """Archive the loans that are over.
+
+    Each chunk of loans is locked, moved to the archive table and committed,
+    then removed from the loans index.
+
+    :param before: archive the loans not updated since this time. Defaults to
+        the current time minus `CIRCULATION_LOAN_ARCHIVE_AGE`.
+    :param chunk_size: the number of loans archived at once.
+    :param index: remove the archived loans from the loans index.
+    :param progress: a function called after each chunk with the number of
+        archived loans, of loans removed from the index and of index errors.
+    :returns: a dict with the number of archived loans, of loans removed from
+        the index and of index errors, and the duration of the archival.
+    """
+    before = before or \
+        datetime.utcnow() - current_app.config["CIRCULATION_LOAN_ARCHIVE_AGE"]
+    result = dict(archived=0, deleted=0, errors=0)
+    started = time.time()
+    last_id = None
+    while True:
+        query = _archivable_loans_query(before)
+        if last_id is not None:
+            query = query.filter(RecordMetadata.id > last_id)
+        rows = query.order_by(RecordMetadata.id).limit(chunk_size) \
+            .with_for_update(of=RecordMetadata).all()
+        if not rows:
+            break
+        last_id = rows[-1][0].id
+        loan_ids = [str(record.id) for record, _ in rows]
+        _archive_chunk(rows, datetime.utcnow())
+        invalidate_loans(
+            loan_ids, pid_values=[pid_value for _, pid_value in rows]
+        )
+        db.session.commit()
+        result["archived"] += len(loan_ids)
+
+        deleted, errors = 0, []
+        if index:
+            deleted, errors = delete_indexed_loans(loan_ids)
+            for error in errors:
+                current_app.logger.error(
+                    "Failed to remove archived loan from the index: "
+                    "{0}".format(error)
+                )
+            result["deleted"] += deleted
+            result["errors"] += len(errors)
+        if progress:
+            progress(len(loan_ids), deleted, len(errors))
+
+    result["duration"] = time.time() - started
+    return result
+
+
+def restore_loans(pid_values, index=True):
+    """Move archived loans back to the records metadata and PID tables.
+
+    :param pid_values: the PIDs of the loans to restore.
+    :param index: index the restored loans.
+    :returns: the list of the ids of the restored loans.
+    """
+    archives = LoanArchive.query.filter(
+        LoanArchive.pid_value.in_([str(value) for value in pid_values])
+    ).with_for_update().all()
+    if len(archives) != len(set(pid_values)):
+        found = set(archive.pid_value for archive in archives)
+        raise LoansArchiveError(
+            description="Archived loans not found: {0}.".format(
+                ", ".join(sorted(
+                    str(value) for value in pid_values
+                    if str(value) not in found
+                ))
+            )
+        )
+
+    now = datetime.utcnow()
+    db.session.bulk_insert_mappings(RecordMetadata, [
+        dict(
+            id=archive.id,
+            json=archive.json,
+            version_id=archive.version_id,
+            created=archive.created,
+            updated=archive.updated,
+        )
+        for archive in archives
+    ])
+    db.session.bulk_insert_mappings(PersistentIdentifier, [
+        dict(
+            pid_type=CIRCULATION_LOAN_PID_TYPE,
+            pid_value=archive.pid_value,
+            pid_provider=None,
+            status=PIDStatus.REGISTERED,
+            object_type="rec",
+            object_uuid=archive.id,
+            created=now,
+            updated=now,
+        )
+        for archive in archives
+    ])
+    loan_ids = [str(archive.id) for archive in archives]
+    LoanArchive.query.filter(
+        LoanArchive.id.in_([archive.id for archive in archives])
+    ).delete(synchronize_session=False)
+    db.session.commit()
+
+    if index and loan_ids:
+        _, errors = index_loans_by_id(loan_ids)
+        for error in errors:
+            current_app.logger.error(
+                "Failed to index restored loan: {0}".format(error)
+            )
+    return loan_ids
@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Batches of loan actions.
+
+The actions of a batch are run in one database transaction, each one in a
+savepoint: a failed action is rolled back alone, or with the whole batch when
+the batch is atomic. The transitions do not commit the transaction during a
+batch, and the loans changed by the batch are indexed in bulk once it is
+committed. The items of a bulk check-in are checked in the same way.
+"""
+
+import json
+from collections import OrderedDict
+from functools import partial
+
+from flask import current_app, g, has_app_context
+from invenio_db import db
+from invenio_pidstore.errors import PersistentIdentifierError, PIDDeletedError
+from invenio_records_rest.errors import JSONSchemaValidationError
+from invenio_rest.errors import RESTException
+from jsonschema.exceptions import ValidationError
+
+from .api import get_active_loans_by_item_pids
+from .errors import InvalidLoanBatchError, MultipleLoansOnItemError, \
+    NoActiveLoanOnItemError
+from .indexer import _get_queue, loans_indexing_batch
+from .pidstore.resolver import LoanResolver, forget_request_loan
+from .proxies import current_circulation
+from .transitions.conditions import item_locations_batch
+
+_BATCH_KEY = "_circulation_loans_batch"
+"""Name of the attribute of `flask.g` set while running a batch."""
+
+_ACTION_ERRORS = (RESTException, ValidationError, PersistentIdentifierError)
+"""Errors failing one action of a batch."""
+
+
+def in_loans_batch():
+    """Return True when running a batch of loan actions."""
+    return has_app_context() and g.get(_BATCH_KEY, False)
+
+
+def commit_loans():
+    """Commit the changed loans, or only flush them during a batch."""
+    if in_loans_batch():
+        db.session.flush()
+    else:
+        db.session.commit()
+
+
+def validate_loan_actions(entries):
+    """Validate the entries of a batch of loan actions.
+
+    :param entries: the list of actions, dicts with the ``pid`` of the loan,
+        the ``action`` to trigger and its optional ``params``.
+    """
+    max_actions = current_app.config["CIRCULATION_LOAN_BATCH_MAX_ACTIONS"]
+    if not isinstance(entries, list) or not entries:
+        raise InvalidLoanBatchError(
+            description="A non-empty list of 'actions' is required."
+        )
+    if len(entries) > max_actions:
+        raise InvalidLoanBatchError(
+            description="A batch is limited to {0} actions.".format(
+                max_actions
+            )
+        )
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict) or not entry.get("pid") or \
+                not entry.get("action") or \
+                not isinstance(entry.get("params", {}), dict):
+            raise InvalidLoanBatchError(
+                description=(
+                    "The action {0} requires a loan 'pid', an 'action' and "
+                    "optional 'params'.".format(index)
+                )
+            )
+
+
+def _get_error_body(error):
+    """Return the status and the message of a failed action."""
+    if isinstance(error, ValidationError):
+        error = JSONSchemaValidationError(error=error)
+    if isinstance(error, RESTException):
+        return json.loads(error.get_body())
+    if isinstance(error, PIDDeletedError):
+        return dict(status=410, message="The loan was deleted.")
+    return dict(status=404, message="The loan does not exist.")
+
+
+def _run_batch(actions, atomic=False, before_commit=None):
+    """Run the actions of a batch in one transaction.
+
+    :param actions: a list of tuples with the result of the action, a dict
+        completed with its outcome, a function running the action and
+        returning the changed loan, and a function forgetting the loans
+        changed in memory by the action, called when the action fails.
+    :param atomic: roll back all the actions when one fails, and stop at the
+        first failure.
+    :param before_commit: a function called with the changed loans before
+        committing the batch. When it fails, the whole batch is rolled back
+        and its error is the result of the actions run.
+    :returns: a tuple with True when the batch is committed, the list of the
+        results of the actions run, and the list of the changed loans.
+    """
+    results, loans, forgets, failed = [], [], [], False
+
+    setattr(g, _BATCH_KEY, True)
+    try:
+        with loans_indexing_batch():
+            queue = _get_queue()
+            # the loans queued before the batch are indexed in any case
+            initial_queue = OrderedDict(queue)
+            for result, action, forget in actions:
+                queued = OrderedDict(queue)
+                try:
+                    with db.session.begin_nested():
+                        loan = action()
+                except _ACTION_ERRORS as error:
+                    # the loans of the failed action are read again from the
+                    # database by the next actions, and not indexed
+                    forget()
+                    queue.clear()
+                    queue.update(queued)
+                    results.append(dict(result, **_get_error_body(error)))
+                    failed = True
+                    if atomic:
+                        break
+                    continue
+                results.append(dict(
+                    result,
+                    status=202,
+                    state=loan["state"],
+                    revision=loan.revision_id,
+                ))
+                loans.append(loan)
+                forgets.append(forget)
+
+            committed = not (atomic and failed)
+            if committed and before_commit:
+                try:
+                    with db.session.begin_nested():
+                        before_commit(loans)
+                except _ACTION_ERRORS as error:
+                    error_body = _get_error_body(error)
+                    results = [
+                        dict(result, **error_body)
+                        if result["status"] == 202 else result
+                        for result in results
+                    ]
+                    committed = False
+            if committed:
+                db.session.commit()
+            else:
+                db.session.rollback()
+                queue.clear()
+                queue.update(initial_queue)
+                for forget in forgets:
+                    forget()
+    finally:
+        g.pop(_BATCH_KEY, None)
+    return committed, results, (loans if committed else [])
+
+
+def run_loan_actions(entries, atomic=False, loader=None):
+    """Run a batch of loan actions in one transaction.
+
+    :param entries: the list of actions, validated by
+        :func:`validate_loan_actions`.
+    :param atomic: roll back all the actions when one fails, and stop at the
+        first failure.
+    :param loader: a function loading the params of an action, called with
+        the params, the PID and the loan.
+    :returns: a tuple with True when the batch is committed, the list of the
+        results of the actions run, and the list of the changed loans.
+    """
+    resolver = LoanResolver(current_circulation.loan_record_cls)
+    resolver.prefetch(entry["pid"] for entry in entries)
+
+    def run(entry):
+        pid, loan = resolver.resolve(entry["pid"])
+        params = entry.get("params", {})
+        if loader:
+            params = loader(params, pid, loan)
+        return current_circulation.circulation.trigger(
+            loan, **dict(params, trigger=entry["action"])
+        )
+
+    return _run_batch(
+        [
+            (
+                dict(pid=str(entry["pid"]), action=entry["action"]),
+                partial(run, entry),
+                partial(forget_request_loan, entry["pid"]),
+            )
+            for entry in entries
+        ],
+        atomic=atomic,
+    )
+
+
+def validate_items_checkin(item_pids):
+    """Validate the items of a bulk check-in.
+
+    :param item_pids: the list of dicts containing `value` and `type` fields
+        to uniquely identify the items.
+    """
+    max_actions = current_app.config["CIRCULATION_LOAN_BATCH_MAX_ACTIONS"]
+    if not isinstance(item_pids, list) or not item_pids:
+        raise InvalidLoanBatchError(
+            description="A non-empty list of 'item_pids' is required."
+        )
+    if len(item_pids) > max_actions:
+        raise InvalidLoanBatchError(
+            description="A batch is limited to {0} items.".format(max_actions)
+        )
+    for index, item_pid in enumerate(item_pids):
+        if not isinstance(item_pid, dict) or not item_pid.get("type") or \
+                not item_pid.get("value"):
+            raise InvalidLoanBatchError(
+                description=(
+                    "The item {0} requires a 'type' and a 'value'.".format(
+                        index
+                    )
+                )
+            )
+
+
+def checkin_items(item_pids, atomic=False, loader=None, **params):
+    """Check in a list of items in one transaction.
+
+    The active loans of the items and the locations of the items are fetched
+    at once, and the pending requests on the documents of the returned items
+    are updated at once, before committing the batch.
+
+    :param item_pids: the list of items, validated by
+        :func:`validate_items_checkin`.
+    :param atomic: roll back all the check-ins when one fails, and stop at
+        the first failure.
+    :param loader: a function loading the params of a check-in, called with
+        the params, no PID and the loan.
+    :param params: the params of the check-ins, e.g. the
+        ``transaction_location_pid`` and the ``transaction_user_pid``.
+    :returns: a tuple with True when the batch is committed, the list of the
+        results of the check-ins run, and the list of the changed loans.
+    """
+    from .transitions.transitions import returned_items_collection, \
+        update_pending_requests_for_items
+
+    loans = get_active_loans_by_item_pids(item_pids)
+    states = current_app.config["CIRCULATION_STATES_LOAN_CHECKIN"]
+
+    def run(item_pid, returned_items):
+        item_loans = loans.get((item_pid["type"], item_pid["value"]), [])
+        if not item_loans:
+            raise NoActiveLoanOnItemError(item_pid=item_pid)
+        if len(item_loans) > 1:
+            raise MultipleLoansOnItemError(item_pid=item_pid)
+        loan = item_loans[0]
+        if loan["state"] not in states:
+            raise NoActiveLoanOnItemError(item_pid=item_pid)
+
+        returned = len(returned_items)
+        try:
+            checkin_params = dict(
+                params,
+                patron_pid=loan["patron_pid"],
+                item_pid=item_pid,
+            )
+            if loader:
+                checkin_params = loader(checkin_params, None, loan)
+            return current_circulation.circulation.trigger(
+                loan, **dict(checkin_params, trigger="next")
+            )
+        except Exception:
+            # the item of a failed check-in is not returned
+            del returned_items[returned:]
+            raise
+
+    def forget(item_pid):
+        key = (item_pid["type"], item_pid["value"])
+        if key in loans:
+            loans[key] = [
+                type(loan)(loan.model.json, model=loan.model)
+                for loan in loans[key]
+            ]
+
+    def result(item_pid):
+        loan = loans.get((item_pid["type"], item_pid["value"]), [None])[0]
+        return dict(item_pid=item_pid, pid=loan["pid"] if loan else None)
+
+    loaned_item_pids = [
+        item_pid for item_pid in item_pids
+        if (item_pid["type"], item_pid["value"]) in loans
+    ]
+    with item_locations_batch(loaned_item_pids), \
+            returned_items_collection() as returned_items:
+        return _run_batch(
+            [
+                (
+                    result(item_pid),
+                    partial(run, item_pid, returned_items),
+                    partial(forget, item_pid),
+                )
+                for item_pid in item_pids
+            ],
+            atomic=atomic,
+            before_commit=lambda _: update_pending_requests_for_items(
+                returned_items
+            ),
+        )
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Read-through cache of the loans records.
+
+When `CIRCULATION_LOAN_CACHE` is set, the loans read by id or by PID are
+cached with their revision, so that the hot loans are served without loading
+their JSON from the database. A cached loan is used only when its revision
+is the current revision of the loan, read with one query on the version of
+the record; otherwise it is read again from the database. A loan is cached
+only over an older revision, so that a stale read never replaces a newer
+cached loan.
+
+The cached loans are invalidated when they are committed, and again when
+the database transaction ends.
+"""
+
+from flask import current_app, has_app_context
+from invenio_db import db
+from invenio_records.models import RecordMetadata
+from sqlalchemy import event
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.util import identity_key
+
+from .proxies import current_circulation
+
+_SESSION_KEY = "circulation_invalidated_loans"
+
+
+def _loan_key(loan_id):
+    """Return the cache key of a loan."""
+    return "circulation:loan:{0}".format(loan_id)
+
+
+def _pid_key(pid_value):
+    """Return the cache key of the id of a loan PID."""
+    return "circulation:loanid:{0}".format(pid_value)
+
+
+def _timeout():
+    """Return the timeout of the cached loans."""
+    return current_app.config["CIRCULATION_LOAN_CACHE_TIMEOUT"]
+
+
+def _get_version_id(loan_id):
+    """Return the current version of the loan record, or None if deleted."""
+    row = db.session.query(
+        RecordMetadata.version_id, RecordMetadata.json.is_(None)
+    ).filter(RecordMetadata.id == loan_id).one_or_none()
+    if row is None or row[1]:
+        return None
+    return row[0]
+
+
+def get_cached_loan(record_cls, loan_id):
+    """Return the cached loan with the given id, or None."""
+    key = identity_key(RecordMetadata, loan_id)
+    model = db.session.identity_map.get(key)
+    if model is not None and model.json is not None:
+        return record_cls(model.json, model=model)
+
+    data = current_circulation.loan_cache.get(_loan_key(loan_id))
+    if data is None:
+        return None
+    if data["version_id"] != _get_version_id(loan_id):
+        # the loan was changed since it was cached
+        current_circulation.loan_cache.delete(_loan_key(loan_id))
+        return None
+    model = RecordMetadata(
+        id=loan_id,
+        json=data["json"],
+        version_id=data["version_id"],
+        created=data["created"],
+        updated=data["updated"],
+    )
+    make_transient_to_detached(model)
+    model = db.session.merge(model, load=False)
+    return record_cls(model.json, model=model)
+
+
+def cache_loan(loan):
+    """Cache a loan read from the database, unless a newer one is cached."""
+    cache = current_circulation.loan_cache
+    key = _loan_key(loan.id)
+    cached = cache.get(key)
+    if cached is not None and cached["version_id"] >= loan.model.version_id:
+        return
+    cache.set(
+        key,
+        dict(
+            json=loan.model.json,
+            version_id=loan.model.version_id,
+            created=loan.model.created,
+            updated=loan.model.updated,
+        ),
+        timeout=_timeout(),
+    )
+
+
+def get_cached_loan_id(pid_value):
+    """Return the cached id of the loan with the given PID, or None."""
+    return current_circulation.loan_cache.get(_pid_key(pid_value))
+
+
+def cache_loan_id(pid_value, loan_id):
+    """Cache the id of the loan with the given PID."""
+    current_circulation.loan_cache.add(
+        _pid_key(pid_value), loan_id, timeout=_timeout()
+    )
+
+
+def invalidate_loans(loan_ids, pid_values=None):
+    """Remove loans from the cache, now and when the transaction ends.
+
+    :param loan_ids: the ids of the loans changed.
+    :param pid_values: the PIDs of the loans deleted or moved.
+    """
+    cache = current_circulation.loan_cache
+    if cache is None:
+        return
+    keys = [_loan_key(loan_id) for loan_id in loan_ids] + \
+        [_pid_key(pid_value) for pid_value in pid_values or []]
+    for key in keys:
+        cache.delete(key)
+    db.session.info.setdefault(_SESSION_KEY, set()).update(keys)
+
+
+def _invalidate_session_loans(session, *args):
+    """Remove from the cache the loans changed in the ended transaction."""
+    keys = session.info.pop(_SESSION_KEY, None)
+    if not keys or not has_app_context():
+        return
+    for key in keys:
+        current_circulation.loan_cache.delete(key)
+
+
+def init_loan_cache():
+    """Listen to the ends of the transactions to invalidate the loans."""
+    for name in ("after_commit", "after_soft_rollback"):
+        if not event.contains(Session, name, _invalidate_session_loans):
+            event.listen(Session, name, _invalidate_session_loans)
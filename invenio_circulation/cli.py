@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Click command-line interface for circulation management."""
+
+import json
+import time
+
+import arrow
+import click
+from flask.cli import with_appcontext
+
+from .anonymization import anonymize_loans
+from .archive import archive_loans, count_archivable_loans, restore_loans
+from .errors import CirculationException
+from .importer import import_loans
+from .reindex import check_loans_index, count_loans, reindex_loans, \
+    reindex_loans_since
+from .versioning import compact_loan_versions
+
+
+def abort_if_false(ctx, param, value):
+    """Abort command is value is False."""
+    if not value:
+        ctx.abort()
+
+
+class ProgressReport(object):
+    """Report the progress and the throughput of an indexing."""
+
+    def __init__(self, total=None, interval=10):
+        """Constructor."""
+        self.total = total
+        self.interval = interval
+        self.processed = self.indexed = self.errors = 0
+        self.started = self.reported = time.time()
+
+    def __call__(self, processed, indexed, errors):
+        """Account for an indexed chunk of loans."""
+        self.processed += processed
+        self.indexed += indexed
+        self.errors += errors
+        now = time.time()
+        if now - self.reported >= self.interval:
+            self.reported = now
+            self.echo()
+
+    def echo(self):
+        """Print the progress."""
+        elapsed = time.time() - self.started
+        processed = self.processed if self.total is None \
+            else "{0}/{1}".format(self.processed, self.total)
+        click.echo(
+            "{0} loans processed, {1} indexed, {2} errors "
+            "({3:.0f} loans/s)".format(
+                processed,
+                self.indexed,
+                self.errors,
+                self.processed / elapsed if elapsed else 0,
+            )
+        )
+
+
+@click.group()
+def circulation():
+    """Circulation commands."""
+
+
+@circulation.command()
+@click.option("--yes-i-know", is_flag=True, callback=abort_if_false,
+              expose_value=False,
+              prompt="Do you really want to rebuild the loans index?")
+@click.option("--mapping", "-m",
+              help="Name of the loans mapping to create the index from.")
+@click.option("--chunk-size", "-s", default=1000, type=int,
+              help="Number of loans of each bulk request.")
+@click.option("--processes", "-p", default=None, type=int,
+              help="Number of indexing processes, the number of CPUs by "
+                   "default.")
+@click.option("--delete-old", is_flag=True,
+              help="Delete the previous loans indices.")
+@with_appcontext
+def reindex(mapping, chunk_size, processes, delete_old):
+    """Rebuild the loans index and switch the searches to it."""
+    report = ProgressReport(count_loans())
+    click.secho(
+        "Reindexing {0} loans...".format(report.total), fg="green"
+    )
+    try:
+        result = reindex_loans(
+            mapping=mapping,
+            chunk_size=chunk_size,
+            processes=processes,
+            delete_old=delete_old,
+            progress=report,
+        )
+    except CirculationException as e:
+        raise click.ClickException(e.description)
+    report.echo()
+    click.secho(
+        "Loans indexed in '{0}' in {1:.0f}s.".format(
+            result["index"], result["duration"]
+        ),
+        fg="red" if result["errors"] else "green",
+    )
+
+
+@circulation.command("reindex-since")
+@click.option("--since", "-t",
+              help="Index the loans updated after this time, in UTC.")
+@click.option("--checkpoint", "-c", type=click.Path(dir_okay=False),
+              help="File saving the last indexed loan, to resume from it.")
+@click.option("--chunk-size", "-s", default=1000, type=int,
+              help="Number of loans of each bulk request.")
+@with_appcontext
+def reindex_since(since, checkpoint, chunk_size):
+    """Index again the loans updated after a given time."""
+    if since:
+        since = arrow.get(since).to("utc").naive
+    report = ProgressReport()
+    click.secho("Reindexing updated loans...", fg="green")
+    try:
+        result = reindex_loans_since(
+            since=since,
+            checkpoint=checkpoint,
+            chunk_size=chunk_size,
+            progress=report,
+        )
+    except CirculationException as e:
+        raise click.ClickException(e.description)
+    report.echo()
+    click.secho(
+        "Loans indexed in {0:.0f}s.".format(result["duration"]),
+        fg="red" if result["errors"] else "green",
+    )
+
+
+@circulation.command("check-index")
+@click.option("--repair", is_flag=True,
+              help="Index again the missing and outdated loans.")
+@click.option("--delete-orphans", is_flag=True,
+              help="Remove from the index the loans missing from the "
+                   "database.")
+@click.option("--chunk-size", "-s", default=1000, type=int,
+              help="Number of loans read at once and of each bulk request.")
+@click.option("--verbose", "-v", is_flag=True,
+              help="Print each loan that differs.")
+@with_appcontext
+def check_index(repair, delete_orphans, chunk_size, verbose):
+    """Compare the loans index with the database."""
+    def report(loan_id, revision, version):
+        click.echo(
+            "{0}: revision {1}, indexed version {2}".format(
+                loan_id, revision, version
+            )
+        )
+
+    result = check_loans_index(
+        chunk_size=chunk_size,
+        repair=repair,
+        delete_orphans=delete_orphans,
+        report=report if verbose else None,
+    )
+    click.echo(
+        "{missing} missing, {outdated} outdated and {orphans} orphan loans "
+        "in the index.".format(**result)
+    )
+    if repair or delete_orphans:
+        click.secho(
+            "{repaired} loans indexed, {deleted} deleted, {errors} "
+            "errors.".format(**result),
+            fg="red" if result["errors"] else "green",
+        )
+
+
+@circulation.command("import")
+@click.argument("source", type=click.File("r"))
+@click.option("--chunk-size", "-s", default=1000, type=int,
+              help="Number of loans created at once.")
+@click.option("--errors", "-e", "errors_file", type=click.File("w"),
+              help="File listing the invalid loans, one JSON per line.")
+@click.option("--index/--no-index", default=True,
+              help="Index the created loans.")
+@with_appcontext
+def import_(source, chunk_size, errors_file, index):
+    """Create the loans of a file with one JSON loan per line."""
+    def on_error(line_number, errors):
+        if errors_file:
+            errors_file.write(
+                json.dumps(dict(line=line_number, errors=errors)) + "\n"
+            )
+
+    report = ProgressReport()
+    click.secho("Importing loans...", fg="green")
+    result = import_loans(
+        source,
+        chunk_size=chunk_size,
+        index=index,
+        on_error=on_error,
+        progress=report,
+    )
+    report.echo()
+    click.secho(
+        "{created} loans created, {invalid} invalid, {indexed} "
+        "indexed.".format(**result),
+        fg="red" if result["invalid"] else "green",
+    )
+
+
+@circulation.command()
+@click.option("--before", "-t",
+              help="Archive the loans not updated since this time, in UTC. "
+                   "Defaults to CIRCULATION_LOAN_ARCHIVE_AGE ago.")
+@click.option("--chunk-size", "-s", default=1000, type=int,
+              help="Number of loans archived at once.")
+@click.option("--index/--no-index", default=True,
+              help="Remove the archived loans from the index.")
+@with_appcontext
+def archive(before, chunk_size, index):
+    """Move the loans that are over to the loans archive."""
+    if before:
+        before = arrow.get(before).to("utc").naive
+    report = ProgressReport(count_archivable_loans(before))
+    click.secho(
+        "Archiving {0} loans...".format(report.total), fg="green"
+    )
+    result = archive_loans(
+        before=before,
+        chunk_size=chunk_size,
+        index=index,
+        progress=report,
+    )
+    click.secho(
+        "{archived} loans archived, {deleted} removed from the index, "
+        "{errors} errors in {duration:.0f}s.".format(**result),
+        fg="red" if result["errors"] else "green",
+    )
+
+
+@circulation.command()
+@click.argument("pids", nargs=-1, required=True)
+@click.option("--index/--no-index", default=True,
+              help="Index the restored loans.")
+@with_appcontext
+def restore(pids, index):
+    """Restore archived loans, given their PIDs."""
+    try:
+        loan_ids = restore_loans(pids, index=index)
+    except CirculationException as e:
+        raise click.ClickException(e.description)
+    click.secho("{0} loans restored.".format(len(loan_ids)), fg="green")
+
+
+@circulation.command("compact-versions")
+@click.option("--yes-i-know", is_flag=True, callback=abort_if_false,
+              expose_value=False,
+              prompt="Do you really want to compact the loans versions?")
+@click.option("--since", "-t",
+              help="Compact the versions of the loans updated after this "
+                   "time, in UTC, e.g. since the previous run.")
+@click.option("--chunk-size", "-s", default=1000, type=int,
+              help="Number of loans compacted at once.")
+@with_appcontext
+def compact_versions(since, chunk_size):
+    """Apply the loans versioning policy to their existing versions.
+
+    Run it periodically with the ``keep`` and ``delta`` policies.
+    """
+    if since:
+        since = arrow.get(since).to("utc").naive
+    click.secho("Compacting the loans versions...", fg="green")
+    result = compact_loan_versions(
+        chunk_size=chunk_size, updated_since=since
+    )
+    click.secho(
+        "{deleted} versions deleted, {compacted} compacted.".format(**result),
+        fg="green",
+    )
+
+
+@circulation.command()
+@click.option("--yes-i-know", is_flag=True, callback=abort_if_false,
+              expose_value=False,
+              prompt="Do you really want to anonymize the loans?")
+@click.option("--before", "-t",
+              help="Anonymize the loans not updated since this time, in UTC. "
+                   "Defaults to CIRCULATION_LOAN_ANONYMIZATION_AGE ago.")
+@click.option("--checkpoint", "-c", type=click.Path(dir_okay=False),
+              help="File saving the last anonymized loan, to resume from it.")
+@click.option("--chunk-size", "-s", default=1000, type=int,
+              help="Number of loans anonymized at once.")
+@with_appcontext
+def anonymize(before, checkpoint, chunk_size):
+    """Remove the patron of the loans that are over."""
+    if before:
+        before = arrow.get(before).to("utc").naive
+    report = ProgressReport()
+    click.secho("Anonymizing loans...", fg="green")
+    result = anonymize_loans(
+        before=before,
+        checkpoint=checkpoint,
+        chunk_size=chunk_size,
+        progress=report,
+    )
+    report.echo()
+    click.secho(
+        "{anonymized} loans anonymized, {indexed} indexed, {errors} errors "
+        "in {duration:.0f}s.".format(**result),
+        fg="red" if result["errors"] else "green",
+    )
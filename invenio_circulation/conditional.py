@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Conditional requests on the loans.
+
+The ETag of a loan is its revision, as set by Invenio-Records-REST on the
+loan responses. The ``If-None-Match`` and ``If-Match`` conditions of the
+requests on a loan are checked against the revision read with a lightweight
+query, before the loan is loaded and serialized: an unchanged loan is
+answered with ``304 Not Modified``, and an action on a loan changed since the
+client read it fails with ``412 Precondition Failed``. The loan is locked by
+the actions once its revision is checked.
+"""
+
+from functools import wraps
+
+from flask import abort, current_app, request
+from invenio_records_rest.proxies import current_records_rest
+from invenio_records_rest.utils import allow_all, obj_or_import_string
+from invenio_rest.errors import SameContentException
+
+from .permissions import check_permission
+from .pidstore.pids import CIRCULATION_LOAN_PID_TYPE
+from .pidstore.resolver import LoanResolver
+from .proxies import current_circulation
+
+
+def _has_conditions():
+    """Return True if the request has ETag conditions."""
+    return bool(request.headers.get("If-Match")) or \
+        bool(request.headers.get("If-None-Match"))
+
+
+def check_etag(etag):
+    """Validate the ETag with the conditions of the current request.
+
+    :param etag: the unquoted ETag of the resource.
+    :raises invenio_rest.errors.SameContentException: if the request is a
+        GET or HEAD and the ETag matches ``If-None-Match``.
+    :raises werkzeug.exceptions.PreconditionFailed: if the ETag does not
+        match ``If-Match``, or matches ``If-None-Match`` on other requests.
+    """
+    if request.if_match.star_tag or request.if_match.as_set():
+        if "*" not in request.if_match and \
+                not request.if_match.contains(etag):
+            abort(412)
+    if request.if_none_match.star_tag or request.if_none_match.as_set():
+        if "*" in request.if_none_match or \
+                request.if_none_match.contains(etag):
+            if request.method in ("GET", "HEAD"):
+                raise SameContentException(etag)
+            abort(412)
+
+
+def check_loan_revision(pid_value, lock=False):
+    """Validate the revision of the loan with the current request conditions.
+
+    The loan is not loaded.
+
+    :param pid_value: the loan PID.
+    :param lock: lock the loan until the end of the transaction, so that it
+        is not changed by concurrent requests once its revision is checked.
+    :returns: False when the revision of the loan cannot be read, and the
+        conditions must be checked against the loaded loan.
+    """
+    if not _has_conditions():
+        return True
+    resolver = LoanResolver(current_circulation.loan_record_cls)
+    revision_id = resolver.get_revision_id(pid_value, lock=lock)
+    if revision_id is None:
+        return False
+    check_etag(str(revision_id))
+    return True
+
+
+def need_loan_revision(f):
+    """View decorator checking the ETag conditions before loading the loan.
+
+    The decorated view receives the lazy loan PID value as ``pid_value``. The
+    loan is locked once its revision is checked, so that a concurrent request
+    cannot change it before the view commits it. The loan is loaded only
+    when its revision cannot be read.
+    """
+    @wraps(f)
+    def decorate(*args, **kwargs):
+        pid_value = kwargs["pid_value"]
+        if not check_loan_revision(pid_value.value, lock=True):
+            _, record = pid_value.data
+            check_etag(str(record.revision_id))
+        return f(*args, **kwargs)
+    return decorate
+
+
+def _can_read_without_record():
+    """Return True if the loans can be read without checking each loan.
+
+    The loans read permission of the REST endpoint is evaluated with the
+    loan: the revision of the loan is checked before loading it only when
+    the permission allows all the reads.
+    """
+    options = current_app.config["RECORDS_REST_ENDPOINTS"].get(
+        CIRCULATION_LOAN_PID_TYPE, {}
+    )
+    factory = obj_or_import_string(
+        options.get("read_permission_factory_imp")
+    ) or current_records_rest.read_permission_factory
+    return factory is allow_all
+
+
+def check_loan_read_preconditions():
+    """Validate the ETag conditions of the loan reads before the view.
+
+    Registered to run before the requests: it answers the reads of unchanged
+    loans of the Invenio-Records-REST loan endpoint without loading them,
+    when the read permission does not depend on the loan.
+    """
+    endpoint = "invenio_records_rest.{0}_item".format(
+        CIRCULATION_LOAN_PID_TYPE
+    )
+    if request.endpoint != endpoint or \
+            request.method not in ("GET", "HEAD") or \
+            not _has_conditions() or not _can_read_without_record():
+        return
+    check_permission(
+        current_app.config["CIRCULATION_VIEWS_PERMISSIONS_FACTORY"](
+            "loan-read-access"
+        )
+    )
+    # otherwise the conditions are checked by the view
+    check_loan_revision(request.view_args["pid_value"].value)
@@ -8,6 +8,8 @@
 
 """Invenio module for the circulation of bibliographic items."""
 
+from datetime import timedelta
+
 from invenio_records_rest.utils import allow_all
 
 from .api import Loan
@@ -15,6 +17,7 @@ from .links import loan_links_factory
 from .permissions import views_permissions_factory
 from .pidstore.pids import _LOANID_CONVERTER, CIRCULATION_LOAN_FETCHER, \
     CIRCULATION_LOAN_MINTER, CIRCULATION_LOAN_PID_TYPE
+from .pidstore.providers import CirculationLoanIdProvider
 from .search.api import LoansSearch
 from .transitions.transitions import CreatedToPending, \
     ItemAtDeskToItemOnLoan, ItemInTransitHouseToItemReturned, \
@@ -34,6 +37,33 @@ CIRCULATION_ITEMS_RETRIEVER_FROM_DOCUMENT = None
 CIRCULATION_DOCUMENT_RETRIEVER_FROM_ITEM = None
 """Function that returns the Document PID of a given Item PID."""
 
+CIRCULATION_DOCUMENTS_RETRIEVER_FROM_ITEMS = None
+"""Function that returns the Document PIDs of a list of Item PIDs.
+
+It is used when importing loans in bulk and returns a list with the Document
+PID of each given Item PID. When not set, the Document PID of each distinct
+Item PID is retrieved with ``CIRCULATION_DOCUMENT_RETRIEVER_FROM_ITEM``."""
+
+CIRCULATION_ITEMS_SUMMARY_RETRIEVER = None
+"""Function that returns the summaries of a list of Item PIDs.
+
+It returns a list with the summary of each given Item PID, a dict of the item
+fields to search and display with the loans, e.g. the barcode, or None. The
+summaries are indexed in the ``item_summary`` field of the loans, and
+retrieved at once for the loans indexed in bulk. Disabled by default."""
+
+CIRCULATION_PATRONS_SUMMARY_RETRIEVER = None
+"""Function that returns the summaries of a list of Patron PIDs.
+
+Same as ``CIRCULATION_ITEMS_SUMMARY_RETRIEVER``, e.g. with the patron name,
+indexed in the ``patron_summary`` field of the loans."""
+
+CIRCULATION_DOCUMENTS_SUMMARY_RETRIEVER = None
+"""Function that returns the summaries of a list of Document PIDs.
+
+Same as ``CIRCULATION_ITEMS_SUMMARY_RETRIEVER``, e.g. with the document
+title, indexed in the ``document_summary`` field of the loans."""
+
 CIRCULATION_STATES_LOAN_REQUEST = ['PENDING']
 """Defines the list of states for which the loan is considered requested."""
 
@@ -47,6 +77,14 @@ CIRCULATION_STATES_LOAN_ACTIVE = ['ITEM_AT_DESK',
 Items that have attached loans with these circulation statuses are
 not available to be loaned by patrons."""
 
+CIRCULATION_STATES_LOAN_CHECKIN = ['ITEM_ON_LOAN',
+                                   'ITEM_IN_TRANSIT_TO_HOUSE',
+                                   ]
+"""Defines the list of states of the loans that a bulk check-in returns.
+
+The bulk check-in of an item triggers the ``next`` transition of its active
+loan, which must be in one of these states."""
+
 CIRCULATION_STATES_LOAN_COMPLETED = ["ITEM_RETURNED"]
 """Defines the list of states that a loan is considered completed.
 
@@ -56,6 +94,21 @@ refer to."""
 CIRCULATION_STATES_LOAN_CANCELLED = ["CANCELLED"]
 """Defines the list of states for which the loan is considered cancelled."""
 
+CIRCULATION_LOAN_LOOKUP_BACKENDS = dict(
+    get_loan_for_item="search",
+    is_item_available_for_checkout="search",
+    get_pending_loans_by_item_pid="search",
+    get_pending_loans_by_doc_pid="search",
+    get_active_loans_by_item_pids="search",
+)
+"""Backend answering each of the circulation lookup helpers.
+
+Use `search` to query Elasticsearch or `db` to query the JSON of the loans
+directly in the database. The `db` backend is strongly consistent and keeps
+working while Elasticsearch is degraded or reindexing: on PostgreSQL, run the
+`invenio_circulation` alembic recipes to create the needed expression indexes.
+"""
+
 CIRCULATION_LOAN_TRANSITIONS_DEFAULT_PERMISSION_FACTORY = allow_all
 """Default permission factory for all Loans transitions."""
 
@@ -120,6 +173,13 @@ CIRCULATION_DOCUMENT_EXISTS = document_exists
 CIRCULATION_ITEM_LOCATION_RETRIEVER = item_location_retriever
 """Function that returns the Location PID of the given Item."""
 
+CIRCULATION_ITEMS_LOCATION_RETRIEVER = None
+"""Function that returns the Location PIDs of a list of Item PIDs.
+
+It is used when checking in items in bulk and returns a list with the
+Location PID of each given Item PID. When not set, the Location PID of each
+Item PID is retrieved with ``CIRCULATION_ITEM_LOCATION_RETRIEVER``."""
+
 CIRCULATION_TRANSACTION_LOCATION_VALIDATOR = transaction_location_validator
 """Function that validates the Location PID of the given transaction."""
 
@@ -154,6 +214,29 @@ CIRCULATION_DOCUMENT_RESOLVING_PATH = ""
 CIRCULATION_DOCUMENT_RESOLVER_ENDPOINT = None
 """Flask endpoint function to handle the document resolving."""
 
+CIRCULATION_ITEMS_BULK_RESOLVER = None
+"""Function that resolves the item references of a list of loans.
+
+It returns a list with the resolved item of each given loan, as the item
+resolver endpoint would. The item references of a list of loans are then
+resolved at once by
+:func:`invenio_circulation.records.jsonresolver.batch.resolve_loans_refs`,
+and served to the item resolver endpoint until the end of the request.
+
+The references of the loans search results are replaced when the
+``search_serializers`` of the loans endpoint use
+``invenio_circulation.records.serializers:json_v1_search_refs``."""
+
+CIRCULATION_PATRONS_BULK_RESOLVER = None
+"""Function that resolves the patron references of a list of loans.
+
+Same as ``CIRCULATION_ITEMS_BULK_RESOLVER``, for the patron references."""
+
+CIRCULATION_DOCUMENTS_BULK_RESOLVER = None
+"""Function that resolves the document references of a list of loans.
+
+Same as ``CIRCULATION_ITEMS_BULK_RESOLVER``, for the document references."""
+
 CIRCULATION_POLICIES = dict(
     checkout=dict(
         duration_default=get_default_loan_duration,
@@ -176,6 +259,9 @@ CIRCULATION_REST_ENDPOINTS = dict(
         pid_fetcher=CIRCULATION_LOAN_FETCHER,
         search_class=LoansSearch,
         search_type=None,
+        search_factory_imp=(
+            "invenio_circulation.search.api:circulation_search_factory"
+        ),
         record_class=Loan,
         record_loaders={
             "application/json": (
@@ -189,7 +275,7 @@ CIRCULATION_REST_ENDPOINTS = dict(
         },
         search_serializers={
             "application/json": (
-                "invenio_records_rest.serializers:json_v1_search"
+                "invenio_circulation.records.serializers:json_v1_search"
             )
         },
         list_route="/circulation/loans/",
@@ -209,3 +295,187 @@ CIRCULATION_LOAN_LINKS_FACTORY = loan_links_factory
 
 CIRCULATION_VIEWS_PERMISSIONS_FACTORY = views_permissions_factory
 """Permissions factory for circulation views to handle actions."""
+
+CIRCULATION_SEARCH_PROFILING_ENABLED = False
+"""Enable the profiling of the loans searches.
+
+When enabled, the query, the Elasticsearch `took`, the client-side wall time
+and the number of hits of each search built by the helpers in
+:mod:`invenio_circulation.search.api` are recorded in per-helper, in-process
+latency histograms."""
+
+CIRCULATION_SEARCH_PROFILING_THRESHOLD = 500
+"""Threshold, in milliseconds, above which a loans search is considered slow.
+
+Slow searches are executed again to capture and log their Elasticsearch
+profile output."""
+
+CIRCULATION_SEARCH_PROFILING_INTERVAL = 60
+"""Minimum seconds between two profiles of the slow searches of a helper.
+
+The slow searches are executed again, during the request, to capture their
+profile: only the first slow search of each helper is profiled during this
+interval, in each process."""
+
+CIRCULATION_SEARCH_PROFILING_BUCKETS = [
+    5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000
+]
+"""Upper bounds, in milliseconds, of the latency histograms buckets."""
+
+CIRCULATION_CONSISTENCY_TOKEN_HEADER = "X-Consistency-Token"
+"""HTTP header used to return and present search consistency tokens.
+
+Loan actions return a token in this header. A loans search request presenting
+it, in the header or in the `consistency_token` query argument, is guaranteed
+to see the loan changed by the action."""
+
+CIRCULATION_CONSISTENCY_TOKEN_MAX_AGE = 60
+"""Seconds after which a consistency token is ignored.
+
+Older tokens refer to changes already made visible by the periodic refresh of
+the index."""
+
+CIRCULATION_CONSISTENCY_STRATEGY = "refresh"
+"""How to make a change visible when a consistency token is presented.
+
+Either `refresh`, to refresh the loans index immediately, or `wait`, to wait
+for the periodic refresh and to refresh the index only after the timeout."""
+
+CIRCULATION_CONSISTENCY_WAIT_TIMEOUT = 1.0
+"""Seconds to wait for a change to be visible with the `wait` strategy."""
+
+CIRCULATION_CONSISTENCY_WAIT_INTERVAL = 0.1
+"""Seconds between two checks with the `wait` strategy."""
+
+CIRCULATION_LOAN_INDEXER_BATCHING = True
+"""Index in bulk the loans changed during a request.
+
+The loans are indexed once each, with one Elasticsearch bulk request, when the
+changes are committed or when the request is torn down. When disabled, each
+loan is indexed immediately."""
+
+CIRCULATION_LOAN_INDEXER_PARTIAL_FIELDS = [
+    "state",
+    "transaction_date",
+    "transaction_location_pid",
+    "transaction_user_pid",
+    "start_date",
+    "end_date",
+    "extension_count",
+]
+"""Loan fields that a transition can update in the index without reindexing.
+
+When a transition changes only these fields, the indexed loan is partially
+updated instead of being fully serialized and indexed again. The loan is fully
+indexed when it is missing from the index or when the indexed document is not
+its previous revision. The partial updates do not send the
+``before_record_index`` signal: the loans are always fully indexed when other
+modules receive it. Set to an empty list to always index the whole loan."""
+
+CIRCULATION_LOAN_PID_PROVIDER = CirculationLoanIdProvider
+"""PID provider used to mint the loans PIDs.
+
+Set it to
+:class:`~invenio_circulation.pidstore.providers.CirculationLoanIdBlockProvider`
+to allocate the PIDs by blocks, per process, when creating loans from many
+parallel workers on PostgreSQL."""
+
+CIRCULATION_LOAN_PID_BLOCK_SIZE = 100
+"""Number of loans PIDs reserved at once by the block PID provider."""
+
+CIRCULATION_LOAN_TRUSTED_TRANSITIONS = False
+"""Validate only the loan fields changed by a transition.
+
+Transitions are then trusted to keep the other fields of the loan valid."""
+
+CIRCULATION_LOAN_ARCHIVE_STATES = ["ITEM_RETURNED", "CANCELLED"]
+"""Terminal states of the loans that can be archived."""
+
+CIRCULATION_LOAN_ARCHIVE_AGE = timedelta(days=365)
+"""Time since their last update after which the loans over are archived.
+
+The archived loans are moved out of the records metadata and PID tables and
+removed from the loans index. Their PIDs are still resolved, and they can be
+restored with the `circulation restore` command."""
+
+CIRCULATION_LOAN_VERSIONING = "full"
+"""Versioning policy of the loans records, when the records are versioned.
+
+- ``full``: every version of the loans is kept.
+- ``off``: no version of the loans is written.
+- ``keep``: only the last ``CIRCULATION_LOAN_VERSIONS_KEPT`` versions of each
+  loan are kept.
+- ``delta``: the previous versions of the loans only store their changed
+  fields.
+
+The ``keep`` and ``delta`` policies are applied by the
+`circulation compact-versions` command: run it periodically, with ``--since``
+the time of its previous run. It also applies a new policy to the existing
+versions."""
+
+CIRCULATION_LOAN_VERSIONS_KEPT = 5
+"""Number of versions kept for each loan, with the ``keep`` policy."""
+
+CIRCULATION_LOAN_ANONYMIZATION_AGE = timedelta(days=365)
+"""Time since their last update after which the loans over are anonymized.
+
+The completed and cancelled loans are anonymized by the
+`circulation anonymize` command."""
+
+CIRCULATION_LOAN_ANONYMIZED_FIELDS = ["patron_pid", "patron"]
+"""Loan fields removed by the anonymization."""
+
+CIRCULATION_LOAN_CACHE = None
+"""Function returning the cache of the loans records, or its import path.
+
+The cache must provide the ``get``, ``set``, ``add`` and ``delete`` methods
+of the `cachelib` caches, for example ``lambda: current_cache`` with
+Invenio-Cache. The loans read by id or PID are then served from the cache
+when their revision is current, and invalidated when they are committed.
+Disabled by default."""
+
+CIRCULATION_LOAN_CACHE_TIMEOUT = 300
+"""Seconds a loan stays in the loans cache."""
+
+CIRCULATION_REPLICA_DATABASE_URI = None
+"""URI of a read replica of the database.
+
+The loans lookups of the ``GET`` and ``HEAD`` requests are run on the replica,
+the transitions and the other requests use the primary database."""
+
+CIRCULATION_REPLICA_ENGINE_OPTIONS = {}
+"""Options of the SQLAlchemy engine of the database replica."""
+
+CIRCULATION_LOAN_BATCH_MAX_ACTIONS = 500
+"""Maximum number of actions of a batch sent to the loan actions endpoint."""
+
+CIRCULATION_LOAN_EXPORT_SERIALIZERS = dict(
+    ndjson="invenio_circulation.records.serializers:ndjson_v1_export",
+    csv="invenio_circulation.records.serializers:csv_v1_export",
+)
+"""Serializers of the loans export endpoint, by value of its `format`."""
+
+CIRCULATION_LOAN_EXPORT_FIELDS = [
+    "pid",
+    "state",
+    "patron_pid",
+    "document_pid",
+    "item_pid.type",
+    "item_pid.value",
+    "transaction_date",
+    "start_date",
+    "end_date",
+    "extension_count",
+]
+"""Loan fields exported when the request does not list the `fields`.
+
+Nested fields are named with dots, e.g. ``item_pid.value``."""
+
+CIRCULATION_LOAN_EXPORT_SCROLL_SIZE = 1000
+"""Number of loans fetched from Elasticsearch by each scroll request.
+
+The export holds at most this number of loans in memory."""
+
+CIRCULATION_LOAN_EXPORT_SCROLL_TIMEOUT = "5m"
+"""Time the Elasticsearch scroll context of an export is kept between two
+scroll requests."""
@@ -143,6 +143,22 @@ class MultipleLoansOnItemError(CirculationException):
         super().__init__(**kwargs)
 
 
+class NoActiveLoanOnItemError(CirculationException):
+    """Exception raised when no loan on an item can be checked in."""
+
+    code = 404
+
+    def __init__(self, item_pid=None, **kwargs):
+        """Initialize exception.
+
+        :param item_pid: a dict containing `value` and `type` fields to
+            uniquely identify the item.
+        """
+        self.description = "No loan to check in on item with PID '{0}:{1}'" \
+            .format(item_pid["type"], item_pid["value"])
+        super().__init__(**kwargs)
+
+
 class LoanMaxExtensionError(CirculationException):
     """Exception raised when reached the max extensions for a loan."""
 
@@ -155,6 +171,51 @@ class LoanMaxExtensionError(CirculationException):
         super().__init__(**kwargs)
 
 
+class InvalidLoanBatchError(CirculationException):
+    """The batch of loan actions is not valid."""
+
+    description = "The batch of loan actions is not valid."
+
+
+# Search
+class InvalidConsistencyTokenError(CirculationException):
+    """Exception raised when a search consistency token is not valid."""
+
+    description = "The consistency token is not valid."
+
+
+class InvalidLoanExportError(CirculationException):
+    """Exception raised when a loans export request is not valid."""
+
+    description = "The loans export request is not valid."
+
+
+class LoansIndexError(CirculationException):
+    """The loans index cannot be rebuilt."""
+
+    description = "The loans index cannot be rebuilt."
+
+
+class LoansArchiveError(CirculationException):
+    """The loans cannot be archived or restored."""
+
+    description = "The loans cannot be archived or restored."
+
+
+class LoanArchivedError(CirculationException):
+    """The archived loans cannot be changed."""
+
+    code = 409
+
+    def __init__(self, loan_pid=None, **kwargs):
+        """Initialize exception."""
+        self.description = (
+            "The loan #'{0}' is archived and cannot be changed. Restore it "
+            "first.".format(loan_pid)
+        )
+        super().__init__(**kwargs)
+
+
 # General
 class RecordCannotBeRequestedError(CirculationException):
     """Exception raised when item can not be requested."""
@@ -11,19 +11,33 @@
 from __future__ import absolute_import, print_function
 
 from copy import deepcopy
+from functools import partial
 
-from flask import current_app
+from flask import _app_ctx_stack, current_app
 from invenio_indexer.api import RecordIndexer
+from invenio_indexer.signals import before_record_index
+from invenio_jsonschemas import current_jsonschemas
 from invenio_records_rest.utils import obj_or_import_string
+from jsonschema.validators import validator_for
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
 from werkzeug.utils import cached_property
 
 from . import config
 from .api import Loan
+from .cache import init_loan_cache
+from .conditional import check_loan_read_preconditions
 from .errors import InvalidLoanStateError, NoValidTransitionAvailableError, \
     TransitionConditionsFailedError
+from .indexer import teardown_loans_indexing
 from .pidstore.pids import CIRCULATION_LOAN_PID_TYPE
+from .pidstore.resolver import init_loan_resolver
+from .replica import primary_session, teardown_replica_session
 from .search.api import LoansSearch
+from .search.profiling import SearchProfiler
+from .summaries import add_loan_summaries
 from .transitions.base import Transition
+from .versioning import init_loan_versioning
 
 
 class InvenioCirculation(object):
@@ -31,6 +45,7 @@ class InvenioCirculation(object):
 
     def __init__(self, app=None):
         """Extension initialization."""
+        self._fields_validators = {}
         if app:
             self.app = app
             self.init_app(app)
@@ -47,6 +62,13 @@ class InvenioCirculation(object):
         app.config["RECORDS_REST_ENDPOINTS"].update(
             app.config["CIRCULATION_REST_ENDPOINTS"]
         )
+        app.teardown_request(teardown_loans_indexing)
+        app.before_request(check_loan_read_preconditions)
+        before_record_index.connect(add_loan_summaries)
+        init_loan_versioning()
+        init_loan_cache()
+        init_loan_resolver(app)
+        app.teardown_appcontext(teardown_replica_session)
         app.extensions["invenio-circulation"] = self
 
     def init_config(self, app):
@@ -96,6 +118,91 @@ class InvenioCirculation(object):
         _cls = circ_endpoint.get('indexer_class', RecordIndexer)
         return obj_or_import_string(_cls)
 
+    @cached_property
+    def loan_pid_provider(self):
+        """Return the Loan PID provider class."""
+        return obj_or_import_string(
+            current_app.config["CIRCULATION_LOAN_PID_PROVIDER"]
+        )
+
+    @cached_property
+    def loan_cache(self):
+        """Return the cache of the loans, or None when disabled."""
+        factory = current_app.config["CIRCULATION_LOAN_CACHE"]
+        return obj_or_import_string(factory)() if factory else None
+
+    @cached_property
+    def replica_session(self):
+        """Return the session of the database replica, or None."""
+        uri = current_app.config["CIRCULATION_REPLICA_DATABASE_URI"]
+        if not uri:
+            return None
+        engine = create_engine(
+            uri, **current_app.config["CIRCULATION_REPLICA_ENGINE_OPTIONS"]
+        )
+        return scoped_session(
+            sessionmaker(bind=engine, autoflush=False),
+            scopefunc=_app_ctx_stack.__ident_func__,
+        )
+
+    @cached_property
+    def _loan_validator_factory(self):
+        """Return the factory of the validators of the loans JSON schema."""
+        schema = current_jsonschemas.get_schema(self.loan_record_cls._schema)
+        validator_cls = validator_for(schema)
+        validator_cls.check_schema(schema)
+        records_state = current_app.extensions["invenio-records"]
+        kwargs = {}
+        types = current_app.config.get("RECORDS_VALIDATION_TYPES")
+        if types:
+            kwargs["types"] = types
+        return partial(
+            validator_cls,
+            resolver=records_state.ref_resolver_cls.from_schema(schema),
+            **kwargs
+        )
+
+    @cached_property
+    def _loan_validator(self):
+        """Return the validator of the loans JSON schema."""
+        return self._loan_validator_factory(
+            current_jsonschemas.get_schema(self.loan_record_cls._schema)
+        )
+
+    def get_loan_validator(self, fields=None):
+        """Return the validator of the loans JSON schema.
+
+        :param fields: validate only these fields of the loans.
+        """
+        if fields is None:
+            return self._loan_validator
+        fields = frozenset(fields)
+        validator = self._fields_validators.get(fields)
+        if validator is None:
+            schema = self._loan_validator.schema
+            fields_schema = dict(
+                schema,
+                properties=dict(
+                    (field, value)
+                    for field, value in schema.get("properties", {}).items()
+                    if field in fields
+                ),
+                required=[
+                    field for field in schema.get("required", [])
+                    if field in fields
+                ],
+            )
+            validator = self._loan_validator_factory(fields_schema)
+            self._fields_validators[fields] = validator
+        return validator
+
+    @cached_property
+    def search_profiler(self):
+        """Return the loans search profiler."""
+        return SearchProfiler(
+            buckets=current_app.config["CIRCULATION_SEARCH_PROFILING_BUCKETS"]
+        )
+
 
 class _Circulation(object):
     """Circulation state sachine."""
@@ -120,12 +227,13 @@ class _Circulation(object):
         current_state = loan.get("state")
         self._validate_current_state(current_state)
 
-        for t in self.transitions[current_state]:
-            try:
-                t.execute(loan, **kwargs)
-                return loan
-            except TransitionConditionsFailedError:
-                pass
+        with primary_session():
+            for t in self.transitions[current_state]:
+                try:
+                    t.execute(loan, **kwargs)
+                    return loan
+                except TransitionConditionsFailedError:
+                    pass
 
         raise NoValidTransitionAvailableError(
             loan_pid=loan["pid"], state=current_state
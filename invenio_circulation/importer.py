@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Bulk import of loans, for migrations from other systems.
+
+The loans are read from a stream of JSON documents, one per line, and are
+created by chunks: the loans are validated, then the PIDs of the valid ones
+are reserved in one query, the Document PIDs of their Items are retrieved in
+one call, and the records and PIDs are inserted with one statement each. The
+records signals are not sent and no record versions are created.
+"""
+
+import json
+import uuid
+from datetime import datetime
+
+from flask import current_app
+from invenio_db import db
+from invenio_jsonschemas import current_jsonschemas
+from invenio_pidstore.models import PersistentIdentifier, PIDStatus
+from invenio_records.models import RecordMetadata
+from invenio_search import current_search_client
+from invenio_search.utils import build_alias_name
+from sqlalchemy.exc import SQLAlchemyError
+
+from .api import get_document_pids_by_item_pids
+from .pidstore.pids import CIRCULATION_LOAN_PID_TYPE
+from .pidstore.providers import CirculationLoanIdProvider
+from .proxies import current_circulation
+from .reindex import index_loans_by_id
+
+_ASSIGNED_FIELDS = ("pid", "item", "patron", "document")
+"""Loan fields assigned on import, once the loan is validated."""
+
+
+def _iter_chunks(stream, chunk_size, on_error):
+    """Yield the loans of the stream by chunks of `(line, data)`."""
+    chunk = []
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError as e:
+            on_error(line_number, [str(e)])
+            continue
+        chunk.append((line_number, data))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _get_import_validator():
+    """Return the validator of the loans without their assigned fields."""
+    schema = current_circulation.get_loan_validator().schema
+    return current_circulation.get_loan_validator(
+        set(schema.get("properties", {})) - set(_ASSIGNED_FIELDS)
+    )
+
+
+def _prepare_loans(chunk, on_error):
+    """Return the valid `(line, data)` of the chunk, ready to be inserted."""
+    record_cls = current_circulation.loan_record_cls
+    validator = _get_import_validator()
+    schema_url = current_jsonschemas.path_to_url(record_cls._schema)
+    initial_state = current_app.config["CIRCULATION_LOAN_INITIAL_STATE"]
+
+    loans = []
+    for line_number, data in chunk:
+        if "pid" in data:
+            on_error(line_number, ["pid: the PID is assigned on import."])
+            continue
+        # the references are built from the PID
+        for field in _ASSIGNED_FIELDS:
+            data.pop(field, None)
+        data.setdefault("state", initial_state)
+        data["$schema"] = schema_url
+
+        errors = [
+            "{0}: {1}".format("/".join(map(str, e.path)), e.message)
+            for e in validator.iter_errors(data)
+        ]
+        if errors:
+            on_error(line_number, errors)
+        else:
+            loans.append((line_number, data))
+    if not loans:
+        return loans
+
+    with_item = [data for _, data in loans if data.get("item_pid")]
+    document_pids = get_document_pids_by_item_pids(
+        [data["item_pid"] for data in with_item]
+    )
+    for data, document_pid in zip(with_item, document_pids):
+        data["document_pid"] = document_pid
+
+    pid_values = CirculationLoanIdProvider.reserve(len(loans))
+    for (_, data), pid_value in zip(loans, pid_values):
+        data["pid"] = str(pid_value)
+        record_cls.build_resolver_fields(data)
+    return loans
+
+
+def _insert_loans(loans):
+    """Insert the records and the PIDs of the loans."""
+    now = datetime.utcnow()
+    records, pids = [], []
+    for _, data in loans:
+        record_uuid = uuid.uuid4()
+        records.append(dict(
+            id=record_uuid, json=data, version_id=1, created=now, updated=now
+        ))
+        pids.append(dict(
+            pid_type=CIRCULATION_LOAN_PID_TYPE,
+            pid_value=data["pid"],
+            pid_provider=None,
+            status=PIDStatus.REGISTERED,
+            object_type="rec",
+            object_uuid=record_uuid,
+            created=now,
+            updated=now,
+        ))
+    db.session.bulk_insert_mappings(RecordMetadata, records)
+    db.session.bulk_insert_mappings(PersistentIdentifier, pids)
+    return [str(record["id"]) for record in records]
+
+
+def _disable_refresh(index):
+    """Disable the refresh of the indices and return their settings."""
+    settings = current_search_client.indices.get_settings(
+        index=index, name="index.refresh_interval"
+    )
+    current_search_client.indices.put_settings(
+        index=index, body=dict(index=dict(refresh_interval="-1"))
+    )
+    return dict(
+        (name, value["settings"].get("index", {}).get("refresh_interval"))
+        for name, value in settings.items()
+    )
+
+
+def _restore_refresh(settings):
+    """Restore the refresh of the indices."""
+    for name, refresh_interval in settings.items():
+        current_search_client.indices.put_settings(
+            index=name,
+            body=dict(index=dict(refresh_interval=refresh_interval)),
+        )
+
+
+def import_loans(stream, chunk_size=1000, index=True, on_error=None,
+                 progress=None):
+    """Create the loans read from a stream of JSON documents.
+
+    Each chunk of loans is committed to the database, then indexed. The
+    refresh of the loans index is disabled during the import.
+
+    :param stream: an iterable of lines, each containing one loan.
+    :param chunk_size: the number of loans created at once.
+    :param index: index the created loans.
+    :param on_error: a function called with the line number and the list
+        of errors of each invalid loan.
+    :param progress: a function called after each chunk with the number
+        of read, indexed and not created loans.
+    :returns: a dict with the number of created, invalid and indexed loans.
+    """
+    result = dict(created=0, invalid=0, indexed=0)
+
+    def report_error(line_number, errors):
+        result["invalid"] += 1
+        if on_error:
+            on_error(line_number, errors)
+
+    alias = build_alias_name(current_circulation.loan_search_cls.Meta.index)
+    refresh_settings = _disable_refresh(alias) if index else {}
+    try:
+        for chunk in _iter_chunks(stream, chunk_size, report_error):
+            loans = _prepare_loans(chunk, report_error)
+            try:
+                loan_ids = _insert_loans(loans)
+                db.session.commit()
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                for line_number, _ in loans:
+                    report_error(line_number, [str(e)])
+                loan_ids = []
+            result["created"] += len(loan_ids)
+
+            indexed = 0
+            if index and loan_ids:
+                indexed, errors = index_loans_by_id(loan_ids)
+                for error in errors:
+                    current_app.logger.error(
+                        "Failed to index loan: {0}".format(error)
+                    )
+                result["indexed"] += indexed
+            if progress:
+                progress(len(chunk), indexed, len(chunk) - len(loan_ids))
+    finally:
+        _restore_refresh(refresh_settings)
+    return result
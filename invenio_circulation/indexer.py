@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Circulation loans indexing.
+
+During a request, the loans indexed by the package are collected, once per
+loan, and sent to Elasticsearch in a single bulk request when the changes are
+committed by the views or, at the latest, when the request is torn down.
+Outside of a request, loans are indexed immediately, unless the indexing is
+made inside :func:`loans_indexing_batch`.
+"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import arrow
+from elasticsearch import VERSION as ES_VERSION
+from elasticsearch.helpers import bulk, streaming_bulk
+from flask import current_app, g, has_app_context, has_request_context
+from invenio_db import db
+from invenio_indexer.api import RecordIndexer
+from invenio_indexer.signals import before_record_index
+
+from .proxies import current_circulation
+from .summaries import add_loan_summaries, loans_summaries_batch
+from .utils import get_changed_fields
+
+_QUEUE_KEY = "_circulation_loans_index_queue"
+"""Name of the attribute of `flask.g` storing the loans to index."""
+
+_PARTIAL_UPDATE_SCRIPT = (
+    "if (ctx._version != params.version - 1) { ctx.op = 'none' } else { "
+    "for (field in params.doc.entrySet()) { "
+    "ctx._source[field.getKey()] = field.getValue() } }"
+)
+"""Apply the changes only on top of the previous revision of the loan."""
+
+
+def _get_queue():
+    """Return the loans to index of the current context, if collecting."""
+    if not has_app_context():
+        return None
+    queue = g.get(_QUEUE_KEY)
+    if queue is None and has_request_context() and \
+            current_app.config["CIRCULATION_LOAN_INDEXER_BATCHING"]:
+        queue = OrderedDict()
+        setattr(g, _QUEUE_KEY, queue)
+    return queue
+
+
+def _has_index_receivers():
+    """Return True if other modules change the indexed loans.
+
+    The partial updates are not sent through the ``before_record_index``
+    signal: only the loans summaries receiver of this module is known not
+    to depend on the updated fields.
+    """
+    app = current_app._get_current_object()
+    return any(
+        receiver is not add_loan_summaries
+        for receiver in before_record_index.receivers_for(app)
+    )
+
+
+def get_partial_update_fields(prev_loan, loan):
+    """Return the fields changed by a transition, if indexable partially.
+
+    :param prev_loan: the loan before the transition.
+    :param loan: the loan after the transition.
+    :returns: the set of the changed fields, or None when the loan has to be
+        fully indexed because a field not listed in
+        ``CIRCULATION_LOAN_INDEXER_PARTIAL_FIELDS`` was changed or removed,
+        or because other receivers of the ``before_record_index`` signal
+        may change the indexed loan.
+    """
+    partial_fields = current_app.config[
+        "CIRCULATION_LOAN_INDEXER_PARTIAL_FIELDS"
+    ]
+    if not partial_fields or set(prev_loan) - set(loan) or \
+            _has_index_receivers():
+        return None
+    fields = get_changed_fields(prev_loan, loan)
+    if not fields or not fields.issubset(partial_fields):
+        return None
+    return fields
+
+
+def get_index_action(indexer, loan):
+    """Return the Elasticsearch bulk action indexing the loan."""
+    index, doc_type = indexer.record_to_index(loan)
+    arguments = {}
+    body = indexer._prepare_record(loan, index, doc_type, arguments)
+    index, doc_type = indexer._prepare_index(index, doc_type)
+
+    action = {
+        "_op_type": "index",
+        "_index": index,
+        "_id": str(loan.id),
+        "_version": loan.revision_id,
+        "_version_type": indexer._version_type,
+        "_source": body,
+    }
+    if ES_VERSION[0] < 7:
+        action["_type"] = doc_type
+    action.update(arguments)
+    return action
+
+
+def _update_action(indexer, loan, fields):
+    """Return the Elasticsearch bulk action updating the fields of the loan.
+
+    The update is a no-op when the indexed loan is not the previous revision.
+    """
+    index, doc_type = indexer.record_to_index(loan)
+    index, doc_type = indexer._prepare_index(index, doc_type)
+
+    doc = dict((field, loan.get(field)) for field in fields)
+    doc["_updated"] = arrow.get(loan.updated).isoformat() \
+        if loan.updated else None
+
+    script_key = "source" if ES_VERSION[0] >= 6 else "inline"
+    action = {
+        "_op_type": "update",
+        "_index": index,
+        "_id": str(loan.id),
+        "script": {
+            script_key: _PARTIAL_UPDATE_SCRIPT,
+            "lang": "painless",
+            "params": {"version": loan.revision_id, "doc": doc},
+        },
+    }
+    if ES_VERSION[0] < 7:
+        action["_type"] = doc_type
+    return action
+
+
+def _log_error(result):
+    """Log a failed bulk operation on a loan."""
+    # a newer version of the loan is already indexed
+    if result.get("status") != 409:
+        current_app.logger.error(
+            "Failed to index loan {0}: {1}".format(
+                result.get("_id"), result.get("error")
+            )
+        )
+
+
+def _bulk_index(entries):
+    """Index or partially update the loans with Elasticsearch bulk requests.
+
+    Partial updates that are not applied, because the loan is missing or
+    is not indexed at its previous revision, are followed by a full index.
+
+    :param entries: the list of `(loan, fields)` to index, where `fields` is
+        the set of the fields to update or None to index the whole loan.
+    """
+    if not entries:
+        return
+    indexer = current_circulation.loan_indexer()
+    with loans_summaries_batch([loan for loan, _ in entries]):
+        if isinstance(indexer, RecordIndexer):
+            _send_bulk_actions(indexer, entries)
+        else:
+            for loan, _ in entries:
+                indexer.index(loan)
+
+
+def _send_bulk_actions(indexer, entries):
+    """Index or partially update the loans with the bulk API."""
+    loans = dict((str(loan.id), loan) for loan, _ in entries)
+    actions = [
+        get_index_action(indexer, loan) if fields is None
+        else _update_action(indexer, loan, fields)
+        for loan, fields in entries
+    ]
+    timeout = current_app.config["INDEXER_BULK_REQUEST_TIMEOUT"]
+
+    fallback = []
+    for ok, item in streaming_bulk(
+        indexer.client,
+        actions,
+        raise_on_error=False,
+        request_timeout=timeout,
+    ):
+        op_type, result = next(iter(item.items()))
+        if op_type != "update":
+            if not ok:
+                _log_error(result)
+        elif not ok and result.get("status") != 404:
+            _log_error(result)
+        elif not ok or result.get("result") == "noop":
+            fallback.append(get_index_action(indexer, loans[result["_id"]]))
+
+    if fallback:
+        _, errors = bulk(
+            indexer.client,
+            fallback,
+            raise_on_error=False,
+            request_timeout=timeout,
+        )
+        for error in errors:
+            _log_error(next(iter(error.values())))
+
+
+def bulk_index_loans(loans):
+    """Index the loans with one Elasticsearch bulk request.
+
+    Indexers that are not a :class:`invenio_indexer.api.RecordIndexer` index
+    the loans one by one.
+
+    :param loans: the list of loans to index.
+    """
+    _bulk_index([(loan, None) for loan in loans])
+
+
+def index_loan(loan, fields=None):
+    """Index the loan, or collect it when indexing in bulk.
+
+    :param loan: the committed loan to index.
+    :param fields: the fields changed since the previous revision of the
+        loan, as returned by :func:`get_partial_update_fields`, to update
+        only them in the index. The whole loan is indexed when None.
+    """
+    queue = _get_queue()
+    if queue is None:
+        _bulk_index([(loan, fields)])
+        return
+
+    loan_id = str(loan.id)
+    if loan_id in queue:
+        # a partial update applies only on top of the previous revision
+        queue.pop(loan_id)
+        fields = None
+    queue[loan_id] = (loan, fields)
+
+
+def index_loans(loans):
+    """Index the loans, or collect them when indexing in bulk.
+
+    :param loans: the committed loans to index.
+    """
+    for loan in loans:
+        index_loan(loan)
+
+
+def flush_loans_indexing():
+    """Index in bulk the loans collected in the current context."""
+    if not has_app_context():
+        return
+    queue = g.pop(_QUEUE_KEY, None)
+    if queue:
+        _bulk_index(list(queue.values()))
+
+
+@contextmanager
+def loans_indexing_batch():
+    """Collect the loans indexed in the block and index them in bulk at exit.
+
+    Within a request, the loans are added to the request queue instead.
+    """
+    if _get_queue() is not None:
+        yield
+        return
+
+    setattr(g, _QUEUE_KEY, OrderedDict())
+    try:
+        yield
+    finally:
+        flush_loans_indexing()
+
+
+def teardown_loans_indexing(exception=None):
+    """Index the loans still collected when the request is torn down.
+
+    When the request failed, the loans are indexed as they are stored in the
+    database, so that the changes already committed are not lost.
+    """
+    queue = g.pop(_QUEUE_KEY, None)
+    if not queue:
+        return
+    try:
+        if exception is None:
+            _bulk_index(list(queue.values()))
+        else:
+            db.session.rollback()
+            record_cls = current_circulation.loan_record_cls
+            bulk_index_loans(record_cls.get_records(list(queue.keys())))
+    except Exception:
+        current_app.logger.exception("Failed to index the loans in bulk.")
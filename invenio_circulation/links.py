@@ -10,7 +10,7 @@
 
 from flask import current_app
 
-from .api import Loan
+from .api import ArchivedLoan, Loan
 from .views import build_url_action_for_pid
 
 
@@ -22,7 +22,10 @@ def loan_links_factory(pid, record=None):
     transitions_config = current_app.config.get(
         'CIRCULATION_LOAN_TRANSITIONS', {}
     )
-    for transition in transitions_config.get(record['state']):
+    # the archived loans are read-only
+    transitions = [] if isinstance(record, ArchivedLoan) else \
+        transitions_config.get(record['state'])
+    for transition in transitions:
         action = transition.get('trigger', 'next')
         actions[action] = build_url_action_for_pid(pid, action)
     links.setdefault('actions', actions)
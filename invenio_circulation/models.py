@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Circulation models."""
+
+from datetime import datetime
+
+from invenio_db import db
+from sqlalchemy.dialects import mysql, postgresql
+from sqlalchemy_utils.models import Timestamp
+from sqlalchemy_utils.types import JSONType, UUIDType
+
+
+class LoanArchive(db.Model, Timestamp):
+    """Archived loan, moved out of the records metadata table.
+
+    The loan keeps the id, the creation and update times and the revision
+    of its record, so that it can be restored as it was.
+    """
+
+    __tablename__ = "circulation_loans_archive"
+
+    id = db.Column(UUIDType, primary_key=True)
+    """Record identifier of the loan."""
+
+    pid_value = db.Column(db.String(255), nullable=False, unique=True)
+    """PID of the loan."""
+
+    json = db.Column(
+        db.JSON().with_variant(
+            postgresql.JSONB(none_as_null=True),
+            "postgresql",
+        ).with_variant(
+            JSONType(),
+            "sqlite",
+        ).with_variant(
+            JSONType(),
+            "mysql",
+        ),
+        nullable=False,
+    )
+    """Loan metadata."""
+
+    version_id = db.Column(db.Integer, nullable=False)
+    """Version of the loan record."""
+
+    archived = db.Column(
+        db.DateTime().with_variant(mysql.DATETIME(fsp=6), "mysql"),
+        default=datetime.utcnow,
+        nullable=False,
+        index=True,
+    )
+    """Archival time."""
+
+
+__all__ = (
+    "LoanArchive",
+)
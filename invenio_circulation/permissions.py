@@ -14,7 +14,7 @@ from functools import wraps
 from flask import abort, current_app
 from flask_login import current_user
 from invenio_access import action_factory
-from invenio_access.permissions import Permission
+from invenio_access.permissions import Permission, superuser_access
 from invenio_records_rest.utils import allow_all
 
 loan_read_access = action_factory('loan-read-access')
@@ -44,6 +44,10 @@ def views_permissions_factory(action):
         return allow_all()
     elif action == 'loan-actions':
         return allow_all()
+    elif action == 'loan-search-stats':
+        return Permission(superuser_access)
+    elif action == 'loan-export':
+        return Permission(superuser_access)
 
 
 def need_permissions(action):
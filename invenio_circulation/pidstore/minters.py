@@ -9,13 +9,13 @@
 """Circulation minters."""
 
 from ..api import Loan
-from .providers import CirculationLoanIdProvider
+from ..proxies import current_circulation
 
 
 def loan_pid_minter(record_uuid, data):
     """Mint loan identifiers."""
     assert "pid" not in data
-    provider = CirculationLoanIdProvider.create(
+    provider = current_circulation.loan_pid_provider.create(
         object_type='rec',
         object_uuid=record_uuid,
     )
@@ -17,5 +17,7 @@ CIRCULATION_LOAN_MINTER = 'loanid'
 CIRCULATION_LOAN_FETCHER = 'loanid'
 """Fetcher PID for Loans."""
 
-_LOANID_CONVERTER = 'pid(loanid,record_class="invenio_circulation.api:Loan")'
+_LOANID_CONVERTER = (
+    'loanpid(loanid,record_class="invenio_circulation.api:Loan")'
+)
 """Loan PID url converter."""
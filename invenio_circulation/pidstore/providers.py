@@ -8,7 +8,13 @@
 
 """Circulation PID providers."""
 
-from invenio_pidstore.models import PIDStatus
+import os
+import threading
+from collections import deque
+
+from flask import current_app
+from invenio_db import db
+from invenio_pidstore.models import PIDStatus, RecordIdentifier
 from invenio_pidstore.providers.recordid import RecordIdProvider
 
 from .pids import CIRCULATION_LOAN_PID_TYPE
@@ -29,3 +35,68 @@ class CirculationLoanIdProvider(RecordIdProvider):
 
     default_status = PIDStatus.REGISTERED
     """Record IDs are by default registered immediately."""
+
+    @classmethod
+    def reserve(cls, count):
+        """Reserve a block of record identifiers.
+
+        On PostgreSQL, the identifiers are taken from the sequence in one
+        query, without inserting them in the identifiers table.
+
+        :param count: the number of identifiers to reserve.
+        :returns: the list of the reserved identifiers.
+        """
+        if db.engine.dialect.name == "postgresql":
+            rows = db.session.execute(
+                "SELECT nextval(pg_get_serial_sequence('{0}', 'recid')) "
+                "FROM generate_series(1, :count)".format(
+                    RecordIdentifier.__tablename__
+                ),
+                dict(count=count),
+            )
+            return [row[0] for row in rows]
+        return [RecordIdentifier.next() for _ in range(count)]
+
+
+class CirculationLoanIdBlockProvider(CirculationLoanIdProvider):
+    """Loan identifier provider allocating the identifiers by blocks.
+
+    Each process reserves ``CIRCULATION_LOAN_PID_BLOCK_SIZE`` identifiers at
+    once from the PostgreSQL sequence and assigns them to the loans it
+    creates, so that parallel workers do not insert a row in the identifiers
+    table for each loan. The identifiers are unique but, across processes,
+    not in the order of creation of the loans. Unused identifiers of a block
+    are lost when the process exits.
+
+    On other databases, the identifiers are allocated one by one.
+    """
+
+    _blocks = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def next(cls):
+        """Return the next identifier of the block of the process."""
+        if db.engine.dialect.name != "postgresql":
+            return RecordIdentifier.next()
+        with cls._lock:
+            # a forked process must not reuse the block of its parent
+            block = cls._blocks.get(os.getpid())
+            if not block:
+                block = deque(cls.reserve(
+                    current_app.config["CIRCULATION_LOAN_PID_BLOCK_SIZE"]
+                ))
+                cls._blocks = {os.getpid(): block}
+            return block.popleft()
+
+    @classmethod
+    def create(cls, object_type=None, object_uuid=None, **kwargs):
+        """Create a new loan identifier."""
+        assert "pid_value" not in kwargs
+        kwargs["pid_value"] = str(cls.next())
+        kwargs.setdefault("status", cls.default_status)
+        if object_type and object_uuid:
+            kwargs["status"] = PIDStatus.REGISTERED
+        return super(RecordIdProvider, cls).create(
+            object_type=object_type, object_uuid=object_uuid, **kwargs
+        )
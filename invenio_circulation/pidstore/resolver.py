@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Circulation PID resolver."""
+
+from functools import partial
+
+from flask import g, has_request_context
+from invenio_db import db
+from invenio_pidstore.errors import PIDDoesNotExistError
+from invenio_pidstore.models import PersistentIdentifier, PIDStatus
+from invenio_pidstore.resolver import Resolver
+from invenio_records_rest.utils import PIDConverter, obj_or_import_string
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import NoResultFound
+from werkzeug.utils import cached_property
+
+from ..proxies import current_circulation
+from ..replica import read_session
+from .pids import CIRCULATION_LOAN_PID_TYPE
+
+_REQUEST_LOANS_KEY = "_circulation_resolved_loans"
+
+
+def _get_request_loans():
+    """Return the loans resolved during the current request."""
+    if not has_request_context():
+        return None
+    if not hasattr(g, _REQUEST_LOANS_KEY):
+        setattr(g, _REQUEST_LOANS_KEY, {})
+    return getattr(g, _REQUEST_LOANS_KEY)
+
+
+def clear_request_loans(*args):
+    """Forget the loans resolved during the current request."""
+    if has_request_context():
+        g.pop(_REQUEST_LOANS_KEY, None)
+
+
+def forget_request_loan(pid_value):
+    """Forget the loan of the PID resolved during the current request.
+
+    The loan is resolved again from the database, e.g. after the changes made
+    to the loan in memory were rolled back in the database.
+    """
+    loans = _get_request_loans()
+    if loans is not None:
+        for primary in (True, False):
+            loans.pop((primary, str(pid_value)), None)
+
+
+class LoanResolver(Resolver):
+    """Loan PID resolver.
+
+    The PID and the record of the loan are fetched with one query. The loans
+    resolved during a request are kept, so that the URL converter, the views,
+    the links factory and the transitions share the same loan.
+    """
+
+    def __init__(self, record_cls, getter=None,
+                 pid_type=CIRCULATION_LOAN_PID_TYPE, object_type="rec",
+                 with_archived=False):
+        """Initialize resolver.
+
+        :param record_cls: the class of the loans records.
+        :param getter: the callable fetching the loan record, when it cannot
+            be read with the PID.
+        :param with_archived: resolve the PIDs of the archived loans to
+            their read-only archived loan.
+        """
+        super().__init__(
+            pid_type=pid_type,
+            object_type=object_type,
+            getter=getter or record_cls.get_record,
+        )
+        self.record_cls = record_cls
+        self.with_archived = with_archived
+
+    def _query(self):
+        """Return a query on the PIDs joined with their loans."""
+        model_cls = self.record_cls.model_cls
+        query = read_session().query(PersistentIdentifier, model_cls)
+        return query.outerjoin(
+            model_cls,
+            db.and_(
+                PersistentIdentifier.object_type == self.object_type,
+                PersistentIdentifier.object_uuid == model_cls.id,
+            ),
+        ).filter(PersistentIdentifier.pid_type == self.pid_type)
+
+    def _is_resolved(self, pid, model):
+        """Return True if the PID resolves to the loan without error."""
+        return pid.is_registered() and model is not None and \
+            model.json is not None
+
+    def _resolve(self, pid_value):
+        """Resolve the PID and the loan."""
+        if current_circulation.loan_cache is not None:
+            # the loan record is served from the loans cache
+            return super().resolve(pid_value)
+
+        row = self._query().filter(
+            PersistentIdentifier.pid_value == pid_value
+        ).one_or_none()
+        if row is None:
+            raise PIDDoesNotExistError(self.pid_type, pid_value)
+
+        pid, model = row
+        if not self._is_resolved(pid, model):
+            # let the default resolution raise the appropriate error
+            return super().resolve(pid_value)
+        return pid, self.record_cls(model.json, model=model)
+
+    def _resolve_archived(self, pid_value):
+        """Resolve the PID of an archived loan to an unsaved PID and the loan.
+
+        :raises invenio_pidstore.errors.PIDDoesNotExistError: if the loan is
+            not archived.
+        """
+        record = self.record_cls.get_archived_record_by_pid(pid_value)
+        if record is None:
+            raise PIDDoesNotExistError(self.pid_type, pid_value)
+        pid = PersistentIdentifier(
+            pid_type=self.pid_type,
+            pid_value=pid_value,
+            object_type=self.object_type,
+            object_uuid=record.id,
+            status=PIDStatus.REGISTERED,
+        )
+        return pid, record
+
+    def prefetch(self, pid_values):
+        """Resolve at once the loans of the PIDs, for the current request.
+
+        The PIDs that do not resolve to a loan are left to :meth:`resolve`,
+        which raises the appropriate error.
+
+        :param pid_values: the loans PIDs.
+        """
+        loans = _get_request_loans()
+        if loans is None or current_circulation.loan_cache is not None:
+            return
+        primary = read_session() is db.session
+        pid_values = set(str(pid_value) for pid_value in pid_values) - \
+            set(pid_value for is_primary, pid_value in loans
+                if is_primary == primary)
+        if not pid_values:
+            return
+        rows = self._query().filter(
+            PersistentIdentifier.pid_value.in_(pid_values)
+        )
+        for pid, model in rows:
+            if self._is_resolved(pid, model):
+                loans[(primary, pid.pid_value)] = \
+                    pid, self.record_cls(model.json, model=model)
+
+    def get_revision_id(self, pid_value, lock=False):
+        """Return the revision of the loan of the PID, without loading it.
+
+        :param pid_value: the loan PID.
+        :param lock: lock the loan until the end of the transaction, so that
+            the revision does not change before the loan is committed.
+        :returns: the revision of the loan, or None when the PID does not
+            resolve to a loan or when the loans are served from the cache.
+        """
+        pid_value = str(pid_value)
+        model_cls = self.record_cls.model_cls
+        if lock:
+            version_id = db.session.query(model_cls.version_id).join(
+                PersistentIdentifier,
+                db.and_(
+                    PersistentIdentifier.object_type == self.object_type,
+                    PersistentIdentifier.object_uuid == model_cls.id,
+                ),
+            ).filter(
+                PersistentIdentifier.pid_type == self.pid_type,
+                PersistentIdentifier.pid_value == pid_value,
+                PersistentIdentifier.status == PIDStatus.REGISTERED,
+                model_cls.json.isnot(None),
+            ).with_for_update(of=model_cls).scalar()
+            return None if version_id is None else version_id - 1
+
+        loans = _get_request_loans()
+        key = (read_session() is db.session, pid_value)
+        if loans is not None and key in loans:
+            return loans[key][1].revision_id
+        if current_circulation.loan_cache is not None:
+            return None
+
+        row = self._query().with_entities(
+            PersistentIdentifier,
+            model_cls.version_id,
+            model_cls.json.is_(None),
+        ).filter(
+            PersistentIdentifier.pid_value == pid_value
+        ).one_or_none()
+        if row is None:
+            return None
+        pid, version_id, deleted = row
+        if not pid.is_registered() or version_id is None or deleted:
+            return None
+        return version_id - 1
+
+    def resolve(self, pid_value):
+        """Resolve a loan PID to its PID and record.
+
+        :param pid_value: the loan PID.
+        :returns: a tuple containing the PID and the loan.
+        """
+        pid_value = str(pid_value)
+        key = (read_session() is db.session, pid_value)
+        loans = _get_request_loans()
+        if loans is not None and key in loans:
+            return loans[key]
+        try:
+            result = self._resolve(pid_value)
+        except PIDDoesNotExistError:
+            if not self.with_archived:
+                raise
+            # not kept for the request, the other resolvers ignore it
+            return self._resolve_archived(pid_value)
+        if loans is not None:
+            loans[key] = result
+        return result
+
+
+def _get_loan_or_deleted(record_cls, id_):
+    """Get a loan by id, or the deleted loan.
+
+    The live loans are read with :meth:`Loan.get_record`, i.e. from the loans
+    cache when enabled; only the deleted loans are read with ``with_deleted``.
+    """
+    try:
+        return record_cls.get_record(id_)
+    except NoResultFound:
+        return record_cls.get_record(id_, with_deleted=True)
+
+
+class LoanPIDConverter(PIDConverter):
+    """Converter for the loans PIDs in the route mapping.
+
+    Use ``loanpid`` as a type in the route pattern, with the arguments of the
+    ``pid`` converter of Invenio-Records-REST. The archived loans are
+    resolved too, and read-only.
+    """
+
+    @cached_property
+    def resolver(self):
+        """Loan PID resolver."""
+        record_cls = obj_or_import_string(
+            self.record_class, default=current_circulation.loan_record_cls
+        )
+        getter = obj_or_import_string(
+            self.getter,
+            default=partial(_get_loan_or_deleted, record_cls),
+        )
+        return LoanResolver(
+            record_cls,
+            getter=getter,
+            pid_type=self.pid_type,
+            object_type=self.object_type,
+            with_archived=True,
+        )
+
+
+def init_loan_resolver(app):
+    """Register the loans PID converter.
+
+    The loans resolved during a request are forgotten when the database
+    transaction is rolled back.
+    """
+    app.url_map.converters["loanpid"] = LoanPIDConverter
+    if not event.contains(Session, "after_soft_rollback", clear_request_loans):
+        event.listen(Session, "after_soft_rollback", clear_request_loans)
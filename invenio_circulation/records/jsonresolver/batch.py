@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Batched resolution of the item, patron and document references.
+
+The references of the loans are resolved one by one by the endpoints of the
+``CIRCULATION_*_RESOLVER_ENDPOINT`` configuration. When the matching
+``CIRCULATION_*_BULK_RESOLVER`` is set, :func:`resolve_loans_refs` resolves
+the references of a list of loans, e.g. a page of search results, with one
+call per kind of reference. The resolved references are kept until the end
+of the request, and the resolver endpoints return them instead of resolving
+each reference again.
+"""
+
+from collections import OrderedDict
+from copy import deepcopy
+from functools import wraps
+from urllib.parse import urlsplit
+
+from flask import current_app, g, has_request_context
+from invenio_records_rest.utils import obj_or_import_string
+from werkzeug.exceptions import NotFound
+from werkzeug.routing import Map, Rule
+
+_REQUEST_REFS_KEY = "_circulation_resolved_refs"
+"""Name of the attribute of `flask.g` storing the resolved references."""
+
+_REFS = dict(
+    item=("CIRCULATION_ITEM_RESOLVING_PATH",
+          "CIRCULATION_ITEMS_BULK_RESOLVER"),
+    patron=("CIRCULATION_PATRON_RESOLVING_PATH",
+            "CIRCULATION_PATRONS_BULK_RESOLVER"),
+    document=("CIRCULATION_DOCUMENT_RESOLVING_PATH",
+              "CIRCULATION_DOCUMENTS_BULK_RESOLVER"),
+)
+"""Resolving path and bulk resolver of each kind of reference."""
+
+
+def _get_resolved_refs(kind):
+    """Return the references of a kind resolved during the current request."""
+    if not has_request_context():
+        return None
+    if not hasattr(g, _REQUEST_REFS_KEY):
+        setattr(g, _REQUEST_REFS_KEY, {})
+    return getattr(g, _REQUEST_REFS_KEY).setdefault(kind, {})
+
+
+def _args_key(args):
+    """Return a hashable key of the arguments of a resolver endpoint."""
+    return tuple(sorted(args.items()))
+
+
+def _get_ref_url(loan, kind):
+    """Return the URL of the reference of a loan, if any."""
+    ref = loan.get(kind)
+    if not isinstance(ref, dict):
+        return None
+    return ref.get("$ref") or ref.get("ref")
+
+
+def _ref_matcher(kind):
+    """Return a function returning the endpoint arguments of a reference."""
+    path = current_app.config.get(_REFS[kind][0]) or "/"
+    url_map = Map(host_matching=True)
+    url_map.add(Rule(
+        path, endpoint=kind, host=current_app.config.get("JSONSCHEMAS_HOST")
+    ))
+
+    def match(url):
+        parts = urlsplit(url)
+        try:
+            _, args = url_map.bind(parts.netloc).match(parts.path)
+        except NotFound:
+            return None
+        return args
+
+    return match
+
+
+def resolve_loans_refs(loans):
+    """Resolve at once the references of the loans, for the current request.
+
+    Nothing is resolved outside of a request, or for the kinds of references
+    without bulk resolver.
+
+    :param loans: the loans, records or search hits, whose references will
+        be resolved.
+    """
+    for kind, (_, bulk_key) in _REFS.items():
+        bulk_resolver = current_app.config.get(bulk_key)
+        refs = _get_resolved_refs(kind)
+        if not bulk_resolver or refs is None:
+            continue
+
+        match = _ref_matcher(kind)
+        pending = OrderedDict()
+        for loan in loans:
+            url = _get_ref_url(loan, kind)
+            args = match(url) if url else None
+            if args is not None and _args_key(args) not in refs:
+                pending.setdefault(_args_key(args), loan)
+        if pending:
+            resolved = obj_or_import_string(bulk_resolver)(
+                list(pending.values())
+            )
+            refs.update(zip(pending.keys(), resolved))
+
+
+def cached_resolver(kind, endpoint):
+    """Return the resolver endpoint serving the references already resolved.
+
+    :param kind: the kind of reference, ``item``, ``patron`` or ``document``.
+    :param endpoint: the endpoint resolving one reference.
+    """
+    if endpoint is None:
+        return None
+
+    @wraps(endpoint)
+    def resolve(**kwargs):
+        refs = _get_resolved_refs(kind)
+        if refs is None:
+            return endpoint(**kwargs)
+        key = _args_key(kwargs)
+        if key not in refs:
+            refs[key] = endpoint(**kwargs)
+        # the resolved reference is replaced in each loan
+        return deepcopy(refs[key])
+
+    return resolve
@@ -11,6 +11,8 @@
 import jsonresolver
 from werkzeug.routing import Rule
 
+from .batch import cached_resolver
+
 
 @jsonresolver.hookimpl
 def jsonresolver_loader(url_map):
@@ -20,5 +22,8 @@ def jsonresolver_loader(url_map):
         "CIRCULATION_DOCUMENT_RESOLVING_PATH") or "/"
     url_map.add(Rule(
         resolving_path,
-        endpoint=app.config.get('CIRCULATION_DOCUMENT_RESOLVER_ENDPOINT'),
+        endpoint=cached_resolver(
+            "document",
+            app.config.get("CIRCULATION_DOCUMENT_RESOLVER_ENDPOINT"),
+        ),
         host=app.config.get('JSONSCHEMAS_HOST')))
@@ -11,6 +11,8 @@
 import jsonresolver
 from werkzeug.routing import Rule
 
+from .batch import cached_resolver
+
 
 @jsonresolver.hookimpl
 def jsonresolver_loader(url_map):
@@ -20,5 +22,8 @@ def jsonresolver_loader(url_map):
         "CIRCULATION_ITEM_RESOLVING_PATH") or "/"
     url_map.add(Rule(
         resolving_path,
-        endpoint=current_app.config.get('CIRCULATION_ITEM_RESOLVER_ENDPOINT'),
+        endpoint=cached_resolver(
+            "item",
+            current_app.config.get("CIRCULATION_ITEM_RESOLVER_ENDPOINT"),
+        ),
         host=current_app.config.get('JSONSCHEMAS_HOST')))
@@ -11,6 +11,8 @@
 import jsonresolver
 from werkzeug.routing import Rule
 
+from .batch import cached_resolver
+
 
 @jsonresolver.hookimpl
 def jsonresolver_loader(url_map):
@@ -19,5 +21,8 @@ def jsonresolver_loader(url_map):
     resolving_path = app.config.get("CIRCULATION_PATRON_RESOLVING_PATH") or "/"
     url_map.add(Rule(
         resolving_path,
-        endpoint=app.config.get('CIRCULATION_PATRON_RESOLVER_ENDPOINT'),
+        endpoint=cached_resolver(
+            "patron",
+            app.config.get("CIRCULATION_PATRON_RESOLVER_ENDPOINT"),
+        ),
         host=app.config.get('JSONSCHEMAS_HOST')))
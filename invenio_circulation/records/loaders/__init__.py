@@ -9,8 +9,30 @@
 """Circulation record loaders module."""
 
 from invenio_records_rest.loaders import marshmallow_loader
+from invenio_records_rest.loaders.marshmallow import MarshmallowErrors
+from marshmallow import ValidationError
+from marshmallow import __version_info__ as marshmallow_version
 
 from .schemas.json import LoanReplaceItemSchemaV1, LoanSchemaV1
 
+
+def marshmallow_params_loader(schema_class):
+    """Marshmallow loader for the params of an action of a batch."""
+    def params_loader(params, pid, record):
+        context = dict(pid=pid, record=record)
+        if marshmallow_version[0] < 3:
+            result = schema_class(context=context).load(params)
+            if result.errors:
+                raise MarshmallowErrors(result.errors)
+        else:
+            try:
+                result = schema_class(context=context).load(params)
+            except ValidationError as error:
+                raise MarshmallowErrors(error.messages)
+        return result.data
+    return params_loader
+
+
 loan_loader = marshmallow_loader(LoanSchemaV1)
+loan_params_loader = marshmallow_params_loader(LoanSchemaV1)
 loan_replace_item_loader = marshmallow_loader(LoanReplaceItemSchemaV1)
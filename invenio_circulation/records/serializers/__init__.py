@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# invenio-circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Circulation record serializers module."""
+
+from invenio_records_rest.schemas import RecordSchemaJSONV1
+from invenio_records_rest.serializers import json_v1
+
+from .export import csv_export, export_responsify, ndjson_export
+from .json import LoanJSONSerializer
+from .response import search_etag_responsify
+
+loan_json_v1 = LoanJSONSerializer(RecordSchemaJSONV1, replace_refs=True)
+"""JSON loans serializer, replacing the references of the loans."""
+
+json_v1_search = search_etag_responsify(json_v1, "application/json")
+"""JSON search results serializer, with the ETag of the page."""
+
+json_v1_search_refs = search_etag_responsify(loan_json_v1, "application/json")
+"""JSON search results serializer, replacing the references of the loans.
+
+The references of a page are resolved at once by the configured
+``CIRCULATION_*_BULK_RESOLVER``, and one by one otherwise."""
+
+ndjson_v1_export = export_responsify(
+    ndjson_export, "application/x-ndjson", "ndjson"
+)
+"""Newline-delimited JSON loans export serializer."""
+
+csv_v1_export = export_responsify(csv_export, "text/csv", "csv")
+"""CSV loans export serializer."""
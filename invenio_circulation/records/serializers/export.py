@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# invenio-circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Circulation loans export serializers.
+
+The serializers turn the hits of a loans search into a generator of rows, one
+row per loan holding the exported fields only, so that the export is streamed
+without keeping the loans in memory.
+"""
+
+import csv
+import json
+from io import StringIO
+
+from flask import current_app, stream_with_context
+
+
+def get_field(data, field):
+    """Return the value of a field of the loan, or None.
+
+    :param data: the loan, as a dict.
+    :param field: the name of the field, with dots for the nested fields,
+        e.g. ``item_pid.value``.
+    """
+    for key in field.split("."):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+
+def ndjson_export(hits, fields):
+    """Serialize the loans as newline-delimited JSON.
+
+    :param hits: the iterable of the loans, as dicts.
+    :param fields: the list of the exported fields.
+    """
+    for hit in hits:
+        row = {}
+        for field in fields:
+            value = get_field(hit, field)
+            if value is not None:
+                row[field] = value
+        yield json.dumps(row) + "\n"
+
+
+def _csv_value(value):
+    """Return the CSV cell of a field value."""
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+def csv_export(hits, fields):
+    """Serialize the loans as CSV, with a header row.
+
+    :param hits: the iterable of the loans, as dicts.
+    :param fields: the list of the exported fields, one column each.
+    """
+    line = StringIO()
+    writer = csv.writer(line)
+
+    def write(row):
+        line.seek(0)
+        line.truncate()
+        writer.writerow(row)
+        return line.getvalue()
+
+    yield write(fields)
+    for hit in hits:
+        yield write([_csv_value(get_field(hit, field)) for field in fields])
+
+
+def export_responsify(serializer, mimetype, extension):
+    """Create a streaming export response serializer.
+
+    :param serializer: the function serializing the loans.
+    :param mimetype: MIME type of response.
+    :param extension: the extension of the name of the exported file.
+    """
+    def view(hits, fields):
+        response = current_app.response_class(
+            stream_with_context(serializer(hits, fields)), mimetype=mimetype
+        )
+        response.headers["Content-Disposition"] = \
+            "attachment; filename=loans.{0}".format(extension)
+        return response
+
+    return view
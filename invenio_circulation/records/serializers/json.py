@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# invenio-circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Circulation JSON serializers."""
+
+from copy import deepcopy
+
+from invenio_records.api import Record
+from invenio_records_rest.serializers.json import JSONSerializer
+
+from ..jsonresolver.batch import resolve_loans_refs
+
+
+class LoanJSONSerializer(JSONSerializer):
+    """JSON serializer of the loans, replacing the references of the hits.
+
+    The item, patron and document references of a page of search results are
+    resolved at once with :func:`resolve_loans_refs`, before being replaced
+    in each hit.
+    """
+
+    def serialize_search(self, pid_fetcher, search_result, links=None,
+                         item_links_factory=None, **kwargs):
+        """Serialize a search result, resolving the references of the page."""
+        if self.replace_refs:
+            resolve_loans_refs(
+                [hit["_source"] for hit in search_result["hits"]["hits"]]
+            )
+        return super().serialize_search(
+            pid_fetcher,
+            search_result,
+            links=links,
+            item_links_factory=item_links_factory,
+            **kwargs
+        )
+
+    def preprocess_search_hit(self, pid, record_hit, links_factory=None,
+                              **kwargs):
+        """Prepare a loan hit, with its references replaced."""
+        record = super().preprocess_search_hit(
+            pid, record_hit, links_factory=links_factory, **kwargs
+        )
+        if self.replace_refs:
+            record["metadata"] = deepcopy(
+                Record(record["metadata"]).replace_refs()
+            )
+        return record
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# invenio-circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Circulation serializers responses."""
+
+import hashlib
+import json
+
+from flask import request
+from invenio_records_rest.serializers.response import search_responsify
+from invenio_rest.errors import SameContentException
+
+
+def search_etag(search_result):
+    """Return the ETag of a page of search results.
+
+    The ETag is computed from the total, the aggregations and the PID and
+    the revision of each hit, read from the version of the indexed loan.
+
+    :param search_result: the search results, as a dict.
+    """
+    hits = search_result.get("hits", {})
+    total = hits.get("total")
+    data = dict(
+        total=total.get("value") if isinstance(total, dict) else total,
+        hits=[
+            (hit.get("_id"), hit.get("_version", hit.get("_source")))
+            for hit in hits.get("hits", [])
+        ],
+        aggregations=search_result.get("aggregations"),
+    )
+    payload = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def search_etag_responsify(serializer, mimetype):
+    """Create a search results response serializer setting the ETag.
+
+    The page is not serialized when it matches the ``If-None-Match`` of the
+    request: ``304 Not Modified`` is returned instead.
+
+    :param serializer: Serializer instance.
+    :param mimetype: MIME type of response.
+    """
+    responsify = search_responsify(serializer, mimetype)
+
+    def view(pid_fetcher, search_result, code=200, headers=None, links=None,
+             item_links_factory=None):
+        etag = search_etag(search_result)
+        if request.if_none_match.contains(etag):
+            raise SameContentException(etag)
+        response = responsify(
+            pid_fetcher,
+            search_result,
+            code=code,
+            headers=headers,
+            links=links,
+            item_links_factory=item_links_factory,
+        )
+        response.set_etag(etag)
+        return response
+
+    return view
@@ -0,0 +1,641 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Rebuild of the loans index.
+
+The loans are indexed from the database into a new index, by a pool of worker
+processes, while the current index keeps serving searches. The index aliases
+are swapped to the new index once it is complete.
+
+After an incident, the loans updated since a given time can instead be
+indexed again in the current index, and the index can be compared with the
+database to find and repair the loans that are not up to date.
+"""
+
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+import arrow
+from elasticsearch.helpers import bulk, scan
+from flask import current_app
+from invenio_db import db
+from invenio_pidstore.models import PersistentIdentifier, PIDStatus
+from invenio_records.models import RecordMetadata
+from invenio_search import current_search, current_search_client
+from invenio_search.utils import build_alias_name, build_index_name, \
+    timestamp_suffix
+
+from .errors import LoansIndexError
+from .indexer import get_index_action
+from .pidstore.pids import CIRCULATION_LOAN_PID_TYPE
+from .proxies import current_circulation
+from .search.api import search_by_patron_pid, search_by_pid
+from .summaries import loans_summaries_batch
+
+
+def _loans_query(updated_since=None):
+    """Return a query on the existing loans."""
+    query = db.session.query(RecordMetadata.id).join(
+        PersistentIdentifier,
+        db.and_(
+            PersistentIdentifier.object_type == "rec",
+            PersistentIdentifier.object_uuid == RecordMetadata.id,
+        ),
+    ).filter(
+        PersistentIdentifier.pid_type == CIRCULATION_LOAN_PID_TYPE,
+        PersistentIdentifier.status == PIDStatus.REGISTERED,
+        RecordMetadata.json != None,  # noqa
+    )
+    if updated_since:
+        query = query.filter(RecordMetadata.updated >= updated_since)
+    return query
+
+
+def count_loans(updated_since=None):
+    """Return the number of loans updated after the given time."""
+    return _loans_query(updated_since=updated_since).count()
+
+
+def _iter_chunks_by_id(query, chunk_size):
+    """Yield the rows of the query by chunks, paginated on the loans ids."""
+    last_id = None
+    while True:
+        chunk_query = query
+        if last_id is not None:
+            chunk_query = chunk_query.filter(RecordMetadata.id > last_id)
+        rows = chunk_query.order_by(RecordMetadata.id).limit(chunk_size).all()
+        if not rows:
+            return
+        last_id = rows[-1].id
+        yield rows
+
+
+def iter_loan_ids(chunk_size=1000, updated_since=None):
+    """Yield the ids of the loans, by chunks, ordered by id.
+
+    The loans are paginated on their id, so that each chunk is read with an
+    index range scan, whatever the number of loans.
+
+    :param chunk_size: the maximum number of ids of each chunk.
+    :param updated_since: keep only the loans updated after this time.
+    """
+    query = _loans_query(updated_since=updated_since)
+    for rows in _iter_chunks_by_id(query, chunk_size):
+        yield [str(row.id) for row in rows]
+
+
+def index_loans_by_id(loan_ids, index=None):
+    """Index the loans with one Elasticsearch bulk request.
+
+    :param loan_ids: the ids of the loans to index.
+    :param index: the index to write to, instead of the loans write alias.
+    :returns: the number of indexed loans and the list of errors.
+    """
+    indexer = current_circulation.loan_indexer()
+    record_cls = current_circulation.loan_record_cls
+    loans = record_cls.get_records(loan_ids)
+    actions = []
+    with loans_summaries_batch(loans):
+        for loan in loans:
+            action = get_index_action(indexer, loan)
+            if index:
+                action["_index"] = index
+            actions.append(action)
+
+    indexed, errors = bulk(
+        indexer.client,
+        actions,
+        raise_on_error=False,
+        request_timeout=current_app.config["INDEXER_BULK_REQUEST_TIMEOUT"],
+    )
+    # a newer version of the loan is already indexed
+    errors = [
+        error for error in errors
+        if next(iter(error.values())).get("status") != 409
+    ]
+    return indexed, errors
+
+
+def reindex_loans_of(item_pid=None, document_pid=None, patron_pid=None,
+                     chunk_size=1000):
+    """Index again the loans of an item, a document or a patron.
+
+    To be called when the item, document or patron changed, so that the
+    summaries indexed with its loans are up to date.
+
+    :param item_pid: the PID of the changed item.
+    :param document_pid: the PID of the changed document.
+    :param patron_pid: the PID of the changed patron.
+    :param chunk_size: the number of loans of each bulk request.
+    :returns: the number of indexed loans and the list of errors.
+    """
+    if patron_pid:
+        search = search_by_patron_pid(patron_pid)
+    else:
+        search = search_by_pid(item_pid=item_pid, document_pid=document_pid)
+
+    indexed, errors, loan_ids = 0, [], []
+    for hit in search.source(False).scan():
+        loan_ids.append(hit.meta.id)
+        if len(loan_ids) >= chunk_size:
+            chunk_indexed, chunk_errors = index_loans_by_id(loan_ids)
+            indexed, errors = indexed + chunk_indexed, errors + chunk_errors
+            loan_ids = []
+    if loan_ids:
+        chunk_indexed, chunk_errors = index_loans_by_id(loan_ids)
+        indexed, errors = indexed + chunk_indexed, errors + chunk_errors
+    return indexed, errors
+
+
+def iter_loans_updated_since(since, chunk_size=1000, after_id=None):
+    """Yield the loans updated after a given time, by chunks.
+
+    The loans are ordered and paginated on their update time and id, so that
+    a loan updated meanwhile is yielded again in a later chunk.
+
+    :param since: the update time of the first loan.
+    :param chunk_size: the maximum number of loans of each chunk.
+    :param after_id: the id of the last loan already processed, updated at
+        `since`.
+    :returns: lists of `(id, updated)` tuples.
+    """
+    query = _loans_query().add_columns(RecordMetadata.updated)
+    last_updated, last_id = since, after_id
+    while True:
+        if last_id is None:
+            chunk_query = query.filter(RecordMetadata.updated >= last_updated)
+        else:
+            chunk_query = query.filter(db.or_(
+                RecordMetadata.updated > last_updated,
+                db.and_(
+                    RecordMetadata.updated == last_updated,
+                    RecordMetadata.id > last_id,
+                ),
+            ))
+        rows = chunk_query.order_by(
+            RecordMetadata.updated, RecordMetadata.id
+        ).limit(chunk_size).all()
+        if not rows:
+            return
+        last_id, last_updated = rows[-1]
+        yield [(str(row.id), row.updated) for row in rows]
+
+
+def _read_checkpoint(path):
+    """Return the update time and the id of the last indexed loan."""
+    with open(path, "r") as fp:
+        checkpoint = json.load(fp)
+    return arrow.get(checkpoint["updated"]).naive, checkpoint["id"]
+
+
+def _write_checkpoint(path, updated, loan_id):
+    """Save the update time and the id of the last indexed loan."""
+    tmp_path = "{0}.tmp".format(path)
+    with open(tmp_path, "w") as fp:
+        json.dump(dict(updated=updated.isoformat(), id=loan_id), fp)
+    os.replace(tmp_path, path)
+
+
+def reindex_loans_since(since=None, checkpoint=None, chunk_size=1000,
+                        progress=None):
+    """Index the loans updated after a given time.
+
+    The loans are indexed by chunks, in the order of their update time. When
+    a checkpoint file is given, the last indexed loan is saved to it after
+    each chunk, and the indexing resumes from it when it exists.
+
+    :param since: the update time, in UTC, of the first loan to index.
+    :param checkpoint: the path of the checkpoint file.
+    :param chunk_size: the number of loans of each bulk request.
+    :param progress: a function called after each chunk with the number
+        of processed, indexed and failed loans.
+    :returns: a dict with the number of indexed and failed loans and the
+        duration of the indexing.
+    """
+    after_id = None
+    if checkpoint and os.path.exists(checkpoint):
+        since, after_id = _read_checkpoint(checkpoint)
+    if since is None:
+        raise LoansIndexError(
+            description="A start time or an existing checkpoint is required."
+        )
+
+    started = time.time()
+    indexed = errors = 0
+    for chunk in iter_loans_updated_since(
+        since, chunk_size=chunk_size, after_id=after_id
+    ):
+        chunk_indexed, chunk_errors = index_loans_by_id(
+            [loan_id for loan_id, _ in chunk]
+        )
+        for error in chunk_errors:
+            current_app.logger.error("Failed to index loan: {0}".format(error))
+        indexed, errors = indexed + chunk_indexed, errors + len(chunk_errors)
+        if checkpoint:
+            loan_id, updated = chunk[-1]
+            _write_checkpoint(checkpoint, updated, loan_id)
+        if progress:
+            progress(len(chunk), chunk_indexed, len(chunk_errors))
+
+    return dict(
+        indexed=indexed, errors=errors, duration=time.time() - started
+    )
+
+
+def _iter_db_revisions(chunk_size):
+    """Yield chunks of the ids and the revisions of the loans."""
+    query = _loans_query().add_columns(RecordMetadata.version_id)
+    for rows in _iter_chunks_by_id(query, chunk_size):
+        yield [(str(row.id), row.version_id - 1) for row in rows]
+
+
+def _get_index_versions(loan_ids):
+    """Return the versions of the indexed loans, by id.
+
+    The loans are read in real time, so that the loans indexed since the
+    last refresh of the index are found.
+    """
+    index = build_alias_name(current_circulation.loan_search_cls.Meta.index)
+    docs = current_search_client.mget(
+        index=index, body=dict(ids=loan_ids), _source=False
+    )["docs"]
+    return dict(
+        (doc["_id"], doc["_version"]) for doc in docs if doc.get("found")
+    )
+
+
+def _iter_index_versions(chunk_size, index=None):
+    """Yield chunks of the ids and the versions of the indexed loans.
+
+    The index is scrolled in the `_doc` order, the most efficient one.
+
+    :param index: the loans index, the loans alias by default.
+    """
+    index = index or build_alias_name(
+        current_circulation.loan_search_cls.Meta.index
+    )
+    hits = scan(
+        current_search_client,
+        index=index,
+        query=dict(version=True, _source=False),
+        size=chunk_size,
+    )
+    chunk = []
+    for hit in hits:
+        chunk.append((hit["_id"], hit["_version"]))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _get_existing_loan_ids(loan_ids):
+    """Return the ids of the given loans that exist in the database."""
+    query = _loans_query().filter(RecordMetadata.id.in_(loan_ids))
+    return set(str(row.id) for row in query)
+
+
+def iter_loans_index_drift(chunk_size=1000):
+    """Yield the loans that differ between the database and the index.
+
+    The loans of the database are read by chunks and looked up in the index,
+    then the indexed loans are scrolled by chunks and looked up in the
+    database, so that the memory used does not depend on the number of
+    loans.
+
+    :param chunk_size: the number of loans read at once from each side.
+    :returns: `(id, revision, version)` tuples, where `revision` is the
+        revision of the loan in the database and `version` the version of the
+        indexed loan, None when the loan is missing from that side.
+    """
+    for chunk in _iter_db_revisions(chunk_size):
+        versions = _get_index_versions([loan_id for loan_id, _ in chunk])
+        for loan_id, revision in chunk:
+            version = versions.get(loan_id)
+            if version != revision:
+                yield loan_id, revision, version
+
+    for chunk in _iter_index_versions(chunk_size):
+        existing = _get_existing_loan_ids([loan_id for loan_id, _ in chunk])
+        for loan_id, version in chunk:
+            if loan_id not in existing:
+                yield loan_id, None, version
+
+
+def delete_indexed_loans(loan_ids, index=None):
+    """Remove the loans from the index.
+
+    :param loan_ids: the ids of the loans, e.g. missing from the database.
+    :param index: the loans index, the loans alias by default.
+    :returns: the number of removed loans and the list of failures.
+    """
+    index = index or build_alias_name(
+        current_circulation.loan_search_cls.Meta.index
+    )
+    response = current_search_client.delete_by_query(
+        index=index,
+        body=dict(query=dict(ids=dict(values=loan_ids))),
+        conflicts="proceed",
+    )
+    return response["deleted"], response["failures"]
+
+
+def check_loans_index(chunk_size=1000, repair=False, delete_orphans=False,
+                      report=None):
+    """Compare the indexed loans with the database and repair the drift.
+
+    :param chunk_size: the number of loans read at once and of each bulk
+        request.
+    :param repair: index again the loans missing from the index or whose
+        indexed version is not their revision in the database.
+    :param delete_orphans: remove from the index the loans missing from the
+        database.
+    :param report: a function called with each `(id, revision, version)`
+        drift, as yielded by :func:`iter_loans_index_drift`.
+    :returns: a dict with the number of missing, outdated, orphan, repaired
+        and deleted loans, and of repair errors.
+    """
+    result = dict(
+        missing=0, outdated=0, orphans=0, repaired=0, deleted=0, errors=0
+    )
+    to_repair, to_delete = [], []
+
+    def flush(force=False):
+        if to_repair and (force or len(to_repair) >= chunk_size):
+            indexed, errors = index_loans_by_id(to_repair)
+            result["repaired"] += indexed
+            result["errors"] += len(errors)
+            del to_repair[:]
+        if to_delete and (force or len(to_delete) >= chunk_size):
+            deleted, errors = delete_indexed_loans(to_delete)
+            result["deleted"] += deleted
+            result["errors"] += len(errors)
+            del to_delete[:]
+
+    for loan_id, revision, version in iter_loans_index_drift(chunk_size):
+        if report:
+            report(loan_id, revision, version)
+        if revision is None:
+            result["orphans"] += 1
+            if delete_orphans:
+                to_delete.append(loan_id)
+        else:
+            result["missing" if version is None else "outdated"] += 1
+            if repair:
+                to_repair.append(loan_id)
+        flush()
+    flush(force=True)
+    return result
+
+
+_CLOCK_SKEW = timedelta(minutes=1)
+"""Margin for the clocks of the servers writing loans when catching up."""
+
+_worker_context = None
+"""Application context of the current worker process."""
+
+
+def _init_worker(app):
+    """Initialize a worker process forked from the reindexing process."""
+    global _worker_context
+    _worker_context = app.app_context()
+    _worker_context.push()
+    # do not share the Elasticsearch connections of the parent process
+    current_search._client = None
+
+
+def _index_chunk(args):
+    """Index a chunk of loans in a worker process."""
+    index, loan_ids = args
+    try:
+        indexed, errors = index_loans_by_id(loan_ids, index=index)
+    finally:
+        db.session.remove()
+    return len(loan_ids), indexed, errors
+
+
+def _delete_orphans(index, chunk_size):
+    """Remove from the index the loans missing from the database.
+
+    :returns: the number of removed loans and of failures.
+    """
+    deleted = errors = 0
+    for chunk in _iter_index_versions(chunk_size, index=index):
+        existing = _get_existing_loan_ids([loan_id for loan_id, _ in chunk])
+        orphans = [
+            loan_id for loan_id, _ in chunk if loan_id not in existing
+        ]
+        if orphans:
+            chunk_deleted, failures = delete_indexed_loans(
+                orphans, index=index
+            )
+            for failure in failures:
+                current_app.logger.error(
+                    "Failed to remove loan: {0}".format(failure)
+                )
+            deleted, errors = deleted + chunk_deleted, errors + len(failures)
+    return deleted, errors
+
+
+def _get_mapping(mapping=None):
+    """Return the name and the path of the loans index mapping."""
+    alias = current_circulation.loan_search_cls.Meta.index
+    mappings = current_search.aliases.get(alias, {})
+    if mapping is None:
+        if len(mappings) != 1:
+            raise LoansIndexError(
+                description="Choose one of the loans mappings: {0}".format(
+                    ", ".join(sorted(mappings))
+                )
+            )
+        mapping = next(iter(mappings))
+    if mapping not in mappings:
+        raise LoansIndexError(
+            description="Unknown loans mapping '{0}'.".format(mapping)
+        )
+    return mapping, mappings[mapping]
+
+
+def _get_swap_actions(alias, index, delete_old):
+    """Return the actions moving the alias to the index."""
+    client = current_search_client
+    if client.indices.exists_alias(name=alias):
+        old_indices = list(client.indices.get_alias(name=alias).keys())
+        actions = [
+            dict(remove=dict(index=old_index, alias=alias))
+            for old_index in old_indices
+        ]
+    elif client.indices.exists(index=alias):
+        # index created without suffix, named like the alias
+        if not delete_old:
+            raise LoansIndexError(
+                description=(
+                    "The index '{0}' has to be deleted to be replaced by an "
+                    "alias.".format(alias)
+                )
+            )
+        old_indices = []
+        actions = [dict(remove_index=dict(index=alias))]
+    else:
+        old_indices = []
+        actions = []
+    actions.append(dict(add=dict(index=index, alias=alias)))
+    return old_indices, actions
+
+
+def _run_pool(pool, processes, index, chunks, progress):
+    """Index the chunks of loans with the pool of workers.
+
+    The chunks are read in this process, a few ahead of the workers, so that
+    the memory used does not depend on the number of loans.
+    """
+    indexed = errors = 0
+    pending = deque()
+
+    def collect():
+        count, chunk_indexed, chunk_errors = pending.popleft().get()
+        for error in chunk_errors:
+            current_app.logger.error("Failed to index loan: {0}".format(error))
+        if progress:
+            progress(count, chunk_indexed, len(chunk_errors))
+        return chunk_indexed, len(chunk_errors)
+
+    for chunk in chunks:
+        pending.append(pool.apply_async(_index_chunk, ((index, chunk),)))
+        if len(pending) >= 2 * processes:
+            chunk_indexed, chunk_errors = collect()
+            indexed, errors = indexed + chunk_indexed, errors + chunk_errors
+    while pending:
+        chunk_indexed, chunk_errors = collect()
+        indexed, errors = indexed + chunk_indexed, errors + chunk_errors
+    return indexed, errors
+
+
+def reindex_loans(mapping=None, chunk_size=1000, processes=None,
+                  delete_old=False, progress=None):
+    """Rebuild the loans index without interrupting the searches.
+
+    A new index is created from the loans mapping, with its refresh disabled,
+    and the loans are indexed into it from the database by a pool of worker
+    processes. The loans changed meanwhile are indexed again, before and
+    after the loans aliases are atomically moved to the new index, and the
+    loans deleted or archived meanwhile are removed from it before the move.
+
+    :param mapping: the name of the loans mapping to use, required when
+        there are several mappings for the loans index.
+    :param chunk_size: the number of loans of each bulk request.
+    :param processes: the number of worker processes, the number of CPUs by
+        default.
+    :param delete_old: delete the previous loans indices.
+    :param progress: a function called after each chunk with the number
+        of processed, indexed and failed loans.
+    :returns: a dict with the name of the new index, the number of indexed,
+        removed and failed loans and the duration of the reindex.
+    """
+    client = current_search_client
+    mapping, mapping_path = _get_mapping(mapping)
+    search_alias = build_alias_name(
+        current_circulation.loan_search_cls.Meta.index
+    )
+    write_alias = build_alias_name(mapping)
+    index = build_index_name(mapping, suffix=timestamp_suffix())
+
+    with open(mapping_path, "r") as fp:
+        body = json.load(fp)
+    index_settings = body.setdefault("settings", {}).setdefault("index", {})
+    refresh_interval = index_settings.get("refresh_interval")
+    index_settings["refresh_interval"] = "-1"
+
+    # fail before loading the loans if the aliases cannot be swapped
+    for alias in (search_alias, write_alias):
+        _get_swap_actions(alias, index, delete_old)
+
+    started = time.time()
+    since = datetime.utcnow() - _CLOCK_SKEW
+    client.indices.create(index=index, body=body)
+
+    # forked workers must not share the database connections
+    db.session.remove()
+    db.engine.dispose()
+    app = current_app._get_current_object()
+    processes = processes or multiprocessing.cpu_count()
+    pool = multiprocessing.get_context("fork").Pool(
+        processes=processes, initializer=_init_worker, initargs=(app,)
+    )
+    swapped = False
+    try:
+        indexed, errors = _run_pool(
+            pool, processes, index, iter_loan_ids(chunk_size), progress
+        )
+
+        # loans changed while loading, until the swap
+        catch_up_since, since = since, datetime.utcnow() - _CLOCK_SKEW
+        result = _run_pool(
+            pool,
+            processes,
+            index,
+            iter_loan_ids(chunk_size, updated_since=catch_up_since),
+            progress,
+        )
+        indexed, errors = indexed + result[0], errors + result[1]
+
+        client.indices.put_settings(
+            index=index,
+            body=dict(index=dict(refresh_interval=refresh_interval)),
+        )
+        client.indices.refresh(index=index)
+
+        # loans deleted or archived while loading
+        deleted, delete_errors = _delete_orphans(index, chunk_size)
+        errors += delete_errors
+
+        old_indices, actions = set(), []
+        for alias in (search_alias, write_alias):
+            alias_indices, alias_actions = _get_swap_actions(
+                alias, index, delete_old
+            )
+            old_indices.update(alias_indices)
+            actions.extend(alias_actions)
+        client.indices.update_aliases(body=dict(actions=actions))
+        swapped = True
+
+        # loans changed between the catch up and the swap
+        result = _run_pool(
+            pool,
+            processes,
+            index,
+            iter_loan_ids(chunk_size, updated_since=since),
+            progress,
+        )
+        indexed, errors = indexed + result[0], errors + result[1]
+    except BaseException:
+        pool.terminate()
+        if not swapped:
+            client.indices.delete(index=index, ignore=[404])
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+
+    if delete_old:
+        for old_index in old_indices - {index}:
+            client.indices.delete(index=old_index)
+
+    return dict(
+        index=index,
+        indexed=indexed,
+        deleted=deleted,
+        errors=errors,
+        duration=time.time() - started,
+    )
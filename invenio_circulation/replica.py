@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Routing of the loans reads to a database replica.
+
+When `CIRCULATION_REPLICA_DATABASE_URI` is set, the loans lookups of the
+requests that only read, ``GET`` and ``HEAD``, are run on a session of the
+replica: the PID resolution of the REST endpoints and of the links factory,
+and the loans lookups of the database search backend. The other requests, and
+the code run in :func:`primary_session`, read from the primary database.
+
+The loans read from the replica must not be committed.
+"""
+
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from invenio_db import db
+
+from .proxies import current_circulation
+
+_PRIMARY_KEY = "_circulation_primary_session"
+
+READ_METHODS = ("GET", "HEAD")
+"""Methods of the requests reading from the replica."""
+
+
+def read_session():
+    """Return the session to read the loans from."""
+    if not has_request_context() or request.method not in READ_METHODS \
+            or g.get(_PRIMARY_KEY):
+        return db.session
+    replica_session = current_circulation.replica_session
+    return replica_session if replica_session is not None else db.session
+
+
+@contextmanager
+def primary_session():
+    """Read the loans from the primary database, before writing them."""
+    if not has_request_context():
+        yield
+        return
+    previous = g.get(_PRIMARY_KEY)
+    setattr(g, _PRIMARY_KEY, True)
+    try:
+        yield
+    finally:
+        setattr(g, _PRIMARY_KEY, previous)
+
+
+def teardown_replica_session(exception=None):
+    """Close the replica session of the application context."""
+    ext = current_circulation._get_current_object()
+    replica_session = ext.__dict__.get("replica_session")
+    if replica_session is not None:
+        replica_session.remove()
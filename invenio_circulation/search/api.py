@@ -8,12 +8,19 @@
 
 """Circulation search API."""
 
+import time
+
 from elasticsearch_dsl import VERSION as ES_VERSION
+from elasticsearch_dsl import Q
+from flask import current_app
+from invenio_records_rest.query import default_search_factory
 from invenio_search.api import RecordsSearch
 
 from invenio_circulation.errors import MissingRequiredParameterError
 
 from ..proxies import current_circulation
+from .consistency import ensure_consistency, get_request_consistency_token
+from .profiling import get_hits_total
 
 
 class LoansSearch(RecordsSearch):
@@ -25,6 +32,8 @@ class LoansSearch(RecordsSearch):
         index = "loans"
         doc_types = None
 
+    _helper = None
+
     def exclude(self, *args, **kwargs):
         """Add method `exclude` to old elastic search versions."""
         if ES_VERSION[0] == 2:
@@ -34,6 +43,93 @@ class LoansSearch(RecordsSearch):
         else:
             return super().exclude(*args, **kwargs)
 
+    def _clone(self):
+        """Clone the search keeping the name of the helper that built it."""
+        s = super()._clone()
+        s._helper = self._helper
+        return s
+
+    def with_helper(self, name):
+        """Return a copy of the search labelled with the given helper name.
+
+        The name is used to group the profiling statistics.
+        """
+        s = self._clone()
+        s._helper = name
+        return s
+
+    @property
+    def helper_name(self):
+        """Return the name of the helper that built the search."""
+        return self._helper or type(self).__name__
+
+    def _profile_slow_search(self, query, wall, took, hits):
+        """Execute again the search to log its Elasticsearch profile."""
+        profiled = self.extra(profile=True, size=0)
+        response = super(LoansSearch, profiled).execute(ignore_cache=True)
+        current_circulation.search_profiler.log_slow_search(
+            self.helper_name, query, wall, took, hits,
+            response.to_dict().get("profile")
+        )
+
+    def execute(self, ignore_cache=False):
+        """Execute the search, recording it when profiling is enabled."""
+        profiler = current_circulation.search_profiler
+        cached = not ignore_cache and hasattr(self, "_response")
+        if not profiler.enabled or cached:
+            return super().execute(ignore_cache=ignore_cache)
+
+        start = time.monotonic()
+        response = super().execute(ignore_cache=ignore_cache)
+        wall = (time.monotonic() - start) * 1000
+
+        query = self.to_dict()
+        hits = get_hits_total(response)
+        profiler.record(
+            self.helper_name, query, wall, took=response.took, hits=hits
+        )
+        if profiler.is_slow(wall, took=response.took) and \
+                profiler.should_profile(self.helper_name):
+            self._profile_slow_search(query, wall, response.took, hits)
+        return response
+
+    def scan(self):
+        """Scan the search, recording it when profiling is enabled."""
+        profiler = current_circulation.search_profiler
+        if not profiler.enabled:
+            for hit in super().scan():
+                yield hit
+            return
+
+        # measure only the time spent in Elasticsearch and not the time
+        # spent by the caller consuming the results
+        wall = 0
+        hits = 0
+        results = super().scan()
+        while True:
+            start = time.monotonic()
+            try:
+                hit = next(results)
+            except StopIteration:
+                wall += (time.monotonic() - start) * 1000
+                break
+            wall += (time.monotonic() - start) * 1000
+            hits += 1
+            yield hit
+
+        query = self.to_dict()
+        profiler.record(self.helper_name, query, wall, hits=hits)
+        if profiler.is_slow(wall) and \
+                profiler.should_profile(self.helper_name):
+            self._profile_slow_search(query, wall, None, hits)
+
+
+def _with_helper(search, name):
+    """Label the search with the helper name, if supported."""
+    if isinstance(search, LoansSearch):
+        return search.with_helper(name)
+    return search
+
 
 def search_by_pid(
     item_pid=None,
@@ -45,7 +141,7 @@ def search_by_pid(
 ):
     """Retrieve loans attached to the given item or document."""
     search_cls = current_circulation.loan_search_cls
-    search = search_cls()
+    search = _with_helper(search_cls(), "search_by_pid")
 
     if document_pid:
         search = search.filter("term", document_pid=document_pid)
@@ -72,12 +168,46 @@ def search_by_pid(
     return search
 
 
+def search_by_document_pids(document_pids, filter_states=None):
+    """Retrieve loans attached to any of the given documents."""
+    search_cls = current_circulation.loan_search_cls
+    search = search_cls().filter("terms", document_pid=list(document_pids))
+    search = _with_helper(search, "search_by_document_pids")
+
+    if filter_states:
+        search = search.filter("terms", state=filter_states)
+
+    return search
+
+
+def search_by_item_pids(item_pids, filter_states=None):
+    """Retrieve loans attached to any of the given items."""
+    values_by_type = {}
+    for item_pid in item_pids:
+        values_by_type.setdefault(item_pid["type"], set()).add(
+            item_pid["value"]
+        )
+    search_cls = current_circulation.loan_search_cls
+    search = search_cls().filter("bool", should=[
+        Q("term", item_pid__type=pid_type) &
+        Q("terms", item_pid__value=sorted(values))
+        for pid_type, values in values_by_type.items()
+    ], minimum_should_match=1)
+    search = _with_helper(search, "search_by_item_pids")
+
+    if filter_states:
+        search = search.filter("terms", state=filter_states)
+
+    return search
+
+
 def search_by_patron_item_or_document(
     patron_pid, item_pid=None, document_pid=None, filter_states=None
 ):
     """Retrieve loans for patron given an item."""
     search_cls = current_circulation.loan_search_cls
     search = search_cls().filter("term", patron_pid=patron_pid)
+    search = _with_helper(search, "search_by_patron_item_or_document")
 
     if item_pid:
         search = search \
@@ -96,4 +226,39 @@ def search_by_patron_pid(patron_pid):
     """Retrieve loans of a patron."""
     search_cls = current_circulation.loan_search_cls
     search = search_cls().filter("term", patron_pid=patron_pid)
+    search = _with_helper(search, "search_by_patron_pid")
     return search
+
+
+def scan_loans(search, fields):
+    """Scroll through the loans of the search, holding the given fields only.
+
+    The loans are fetched by ``CIRCULATION_LOAN_EXPORT_SCROLL_SIZE``, so that
+    scanning holds bounded memory whatever the number of loans.
+
+    :param search: the loans search.
+    :param fields: the list of the fields to fetch, with dots for the nested
+        fields.
+    :returns: a generator of the loans, as dicts.
+    """
+    search = _with_helper(search, "scan_loans").source(includes=fields)
+    search = search.params(
+        scroll=current_app.config["CIRCULATION_LOAN_EXPORT_SCROLL_TIMEOUT"],
+        size=current_app.config["CIRCULATION_LOAN_EXPORT_SCROLL_SIZE"],
+    )
+    for hit in search.scan():
+        yield hit.to_dict()
+
+
+def circulation_search_factory(self, search):
+    """Loans REST search factory.
+
+    When the request presents a consistency token returned by a loan action,
+    the loans index is made fresh before searching. The version of the hits,
+    i.e. the revision of the loans, is returned for the ETag of the page.
+    """
+    token = get_request_consistency_token()
+    if token:
+        ensure_consistency(token)
+    search, urlkwargs = default_search_factory(self, search)
+    return search.extra(version=True), urlkwargs
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Read-your-writes consistency tokens for loans searches.
+
+An action performed on a loan returns a signed token identifying the indexed
+loan revision. When a search request presents the token, the loans index is
+made fresh before searching, so that only the callers that need to read their
+own writes pay for it. The index is not refreshed when the revision of the
+loan, the version of its document, is already visible, or when this process
+started a refresh after receiving the token.
+"""
+
+import time
+
+from flask import current_app, request
+from invenio_search import current_search_client
+from invenio_search.utils import build_alias_name
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+
+from ..errors import InvalidConsistencyTokenError
+from ..proxies import current_circulation
+
+_last_refresh = {}
+"""Monotonic time of the latest refresh of each index started by this
+process."""
+
+
+def _get_serializer():
+    """Return the serializer used to sign the tokens."""
+    return URLSafeTimedSerializer(
+        current_app.config["SECRET_KEY"],
+        salt="invenio-circulation-consistency-token",
+    )
+
+
+def _get_loans_index():
+    """Return the name of the loans index alias."""
+    return build_alias_name(current_circulation.loan_search_cls.Meta.index)
+
+
+def create_consistency_token(record):
+    """Return a token identifying the given revision of an indexed loan."""
+    return _get_serializer().dumps(
+        dict(id=str(record.id), rev=record.revision_id)
+    )
+
+
+def get_request_consistency_token():
+    """Return the consistency token presented by the current request."""
+    header = current_app.config["CIRCULATION_CONSISTENCY_TOKEN_HEADER"]
+    return request.headers.get(header) or request.args.get(
+        "consistency_token"
+    )
+
+
+def _is_visible(loan_id, revision):
+    """Return True if the revision of the loan is visible to searches."""
+    search_cls = current_circulation.loan_search_cls
+    search = search_cls().filter("ids", values=[loan_id]).extra(version=True)
+    for hit in search[0:1].execute().hits:
+        return hit.meta.version >= revision
+    return False
+
+
+def _refresh(index, since):
+    """Refresh the index unless a refresh started after the given time.
+
+    :param since: the monotonic time of this process after which the change
+        to make visible was indexed.
+    """
+    if _last_refresh.get(index, since) > since:
+        return
+    started = time.monotonic()
+    current_search_client.indices.refresh(index=index)
+    _last_refresh[index] = started
+
+
+def ensure_consistency(token):
+    """Make the loan identified by the token visible to searches.
+
+    Nothing is done when the revision of the loan is already visible.
+    Otherwise, depending on ``CIRCULATION_CONSISTENCY_STRATEGY``, either the
+    loans index is refreshed right away (``refresh``), or the loan is polled
+    until the periodic refresh makes it visible and the index is refreshed
+    only if it is not visible after the configured timeout (``wait``).
+
+    :param token: a token created by :func:`create_consistency_token`.
+    """
+    # the loan is indexed before the token is returned
+    received = time.monotonic()
+    config = current_app.config
+    try:
+        payload = _get_serializer().loads(
+            token, max_age=config["CIRCULATION_CONSISTENCY_TOKEN_MAX_AGE"]
+        )
+    except SignatureExpired:
+        # old enough to be visible after the periodic index refresh
+        return
+    except BadSignature:
+        raise InvalidConsistencyTokenError()
+
+    if _is_visible(payload["id"], payload["rev"]):
+        return
+    if config["CIRCULATION_CONSISTENCY_STRATEGY"] == "wait":
+        deadline = time.monotonic() + \
+            config["CIRCULATION_CONSISTENCY_WAIT_TIMEOUT"]
+        while time.monotonic() < deadline:
+            time.sleep(config["CIRCULATION_CONSISTENCY_WAIT_INTERVAL"])
+            if _is_visible(payload["id"], payload["rev"]):
+                return
+    _refresh(_get_loans_index(), received)
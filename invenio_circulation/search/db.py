@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Circulation database search API.
+
+Answers the loans lookups directly from the JSON of the records metadata,
+so that they are strongly consistent and do not depend on Elasticsearch.
+On PostgreSQL, the lookups are served by the expression indexes created by
+the `invenio_circulation` alembic recipes.
+"""
+
+from invenio_db import db
+from invenio_pidstore.models import PersistentIdentifier, PIDStatus
+from invenio_records.models import RecordMetadata
+
+from invenio_circulation.errors import MissingRequiredParameterError
+
+from ..pidstore.pids import CIRCULATION_LOAN_PID_TYPE
+from ..replica import read_session
+
+
+def json_text(*path):
+    """Return the text value at the given path of the records JSON.
+
+    The expression matches the one of the lookup indexes.
+    """
+    expression = RecordMetadata.json
+    if db.engine.dialect.name == "mysql":
+        # MySQL only extracts the values of JSON paths
+        return expression.op("->>", return_type=db.String)(
+            "$.{0}".format(".".join(path))
+        )
+    for key in path[:-1]:
+        expression = expression.op("->")(key)
+    return expression.op("->>", return_type=db.String)(path[-1])
+
+
+def _loans_query():
+    """Return a query on the registered loans."""
+    return read_session().query(RecordMetadata).join(
+        PersistentIdentifier,
+        db.and_(
+            PersistentIdentifier.object_type == "rec",
+            PersistentIdentifier.object_uuid == RecordMetadata.id,
+        ),
+    ).filter(
+        PersistentIdentifier.pid_type == CIRCULATION_LOAN_PID_TYPE,
+        PersistentIdentifier.status == PIDStatus.REGISTERED,
+    )
+
+
+def db_search_by_pid(item_pid=None, document_pid=None, filter_states=None):
+    """Return a query on the loans attached to the given item or document.
+
+    :param item_pid: a dict containing `value` and `type` fields to
+        uniquely identify the item.
+    :param document_pid: the document PID.
+    :param filter_states: the list of loan states to keep.
+    """
+    query = _loans_query()
+    if document_pid:
+        query = query.filter(json_text("document_pid") == document_pid)
+    elif item_pid:
+        query = query.filter(
+            json_text("item_pid", "value") == item_pid["value"],
+            json_text("item_pid", "type") == item_pid["type"],
+        )
+    else:
+        raise MissingRequiredParameterError(
+            description=(
+                "One of the parameters 'item_pid' "
+                "or 'document_pid' is required."
+            )
+        )
+
+    if filter_states:
+        query = query.filter(json_text("state").in_(filter_states))
+
+    return query.order_by(RecordMetadata.created)
+
+
+def db_search_by_pids(item_pids=None, document_pids=None,
+                      filter_states=None):
+    """Return a query on the loans attached to any of the items or documents.
+
+    :param item_pids: a list of dicts containing `value` and `type` fields
+        to uniquely identify the items.
+    :param document_pids: the list of document PIDs.
+    :param filter_states: the list of loan states to keep.
+    """
+    query = _loans_query()
+    if document_pids:
+        query = query.filter(
+            json_text("document_pid").in_(list(document_pids))
+        )
+    elif item_pids:
+        values_by_type = {}
+        for item_pid in item_pids:
+            values_by_type.setdefault(item_pid["type"], set()).add(
+                item_pid["value"]
+            )
+        query = query.filter(db.or_(*[
+            db.and_(
+                json_text("item_pid", "type") == pid_type,
+                json_text("item_pid", "value").in_(sorted(values)),
+            )
+            for pid_type, values in values_by_type.items()
+        ]))
+    else:
+        raise MissingRequiredParameterError(
+            description=(
+                "One of the parameters 'item_pids' "
+                "or 'document_pids' is required."
+            )
+        )
+
+    if filter_states:
+        query = query.filter(json_text("state").in_(filter_states))
+
+    return query.order_by(RecordMetadata.created)
@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""In-memory loans search, for tests and single-node development.
+
+It implements the subset of :class:`~.api.LoansSearch` used by this package
+(`term`, `terms`, `ids` and `bool` filters, exclude, sort, source, scan,
+count and execute) on top of an in-process store fed by
+:class:`InMemoryLoansIndexer`. Enable it
+in the `loanid` endpoint of ``CIRCULATION_REST_ENDPOINTS``:
+
+.. code-block:: python
+
+    search_class="invenio_circulation.search.memory:InMemoryLoansSearch",
+    indexer_class="invenio_circulation.search.memory:InMemoryLoansIndexer",
+
+Free text queries, aggregations and the REST search endpoint are not
+supported.
+"""
+
+import threading
+from copy import deepcopy
+
+from elasticsearch import VERSION as ES_VERSION
+from elasticsearch_dsl import Q
+from elasticsearch_dsl.query import Query
+from elasticsearch_dsl.utils import AttrDict, AttrList
+from flask import current_app
+
+from ..proxies import current_circulation
+
+
+class InMemoryLoansStore(object):
+    """Thread-safe store of the indexed loans documents."""
+
+    def __init__(self):
+        """Constructor."""
+        self._docs = {}
+        self._lock = threading.Lock()
+
+    def index(self, doc_id, version, source):
+        """Store a document, unless a newer version is already stored."""
+        with self._lock:
+            current = self._docs.get(doc_id)
+            if current is None or current[0] <= version:
+                self._docs[doc_id] = (version, deepcopy(source))
+
+    def delete(self, doc_id):
+        """Remove a document."""
+        with self._lock:
+            self._docs.pop(doc_id, None)
+
+    def clear(self):
+        """Remove all documents."""
+        with self._lock:
+            self._docs = {}
+
+    def documents(self):
+        """Return a snapshot of the stored documents."""
+        with self._lock:
+            return [
+                (doc_id, version, source)
+                for doc_id, (version, source) in self._docs.items()
+            ]
+
+
+def get_store():
+    """Return the in-memory loans store of the current application."""
+    store = current_app.extensions.get("invenio-circulation-memory-store")
+    if store is None:
+        store = InMemoryLoansStore()
+        current_app.extensions["invenio-circulation-memory-store"] = store
+    return store
+
+
+class InMemoryLoansIndexer(object):
+    """Indexer feeding the in-memory loans store."""
+
+    def index(self, record, **kwargs):
+        """Index a loan."""
+        source = record.dumps()
+        if record.model is not None:
+            source["_created"] = record.created.isoformat()
+            source["_updated"] = record.updated.isoformat()
+        get_store().index(str(record.id), record.revision_id, source)
+
+    def index_by_id(self, record_uuid, **kwargs):
+        """Index a loan given its id."""
+        record_cls = current_circulation.loan_record_cls
+        self.index(record_cls.get_record(record_uuid))
+
+    def bulk_index(self, record_id_iterator):
+        """Index the loans given their ids."""
+        for record_uuid in record_id_iterator:
+            self.index_by_id(record_uuid)
+
+    def delete(self, record, **kwargs):
+        """Remove a loan from the index."""
+        self.delete_by_id(record.id)
+
+    def delete_by_id(self, record_uuid, **kwargs):
+        """Remove a loan from the index given its id."""
+        get_store().delete(str(record_uuid))
+
+    def bulk_delete(self, record_id_iterator):
+        """Remove the loans from the index given their ids."""
+        for record_uuid in record_id_iterator:
+            self.delete_by_id(record_uuid)
+
+
+def _get_values(source, path):
+    """Return the list of values at the dotted path of a document."""
+    values = [source]
+    for key in path.split("."):
+        found = []
+        for value in values:
+            if isinstance(value, list):
+                found.extend(v.get(key) for v in value if isinstance(v, dict))
+            elif isinstance(value, dict) and key in value:
+                found.append(value[key])
+        values = [v for v in found if v is not None]
+    flat = []
+    for value in values:
+        flat.extend(value if isinstance(value, list) else [value])
+    return flat
+
+
+def _build_query_condition(query):
+    """Return a function matching documents for a query, as a dict."""
+    name, params = next(iter(query.items()))
+    if name == "ids":
+        ids = set(str(v) for v in params["values"])
+        return lambda doc_id, source: doc_id in ids
+
+    if name == "bool":
+        musts = [
+            _build_query_condition(q)
+            for key in ("must", "filter") for q in params.get(key, [])
+        ]
+        must_nots = [
+            _build_query_condition(q) for q in params.get("must_not", [])
+        ]
+        shoulds = [
+            _build_query_condition(q) for q in params.get("should", [])
+        ]
+        minimum = params.get(
+            "minimum_should_match", 0 if musts or not shoulds else 1
+        )
+        return lambda doc_id, source: \
+            all(c(doc_id, source) for c in musts) and \
+            not any(c(doc_id, source) for c in must_nots) and \
+            sum(1 for c in shoulds if c(doc_id, source)) >= minimum
+
+    if name not in ("term", "terms") or len(params) != 1:
+        raise NotImplementedError(
+            "In-memory loans search supports only `term`, `terms`, `ids` "
+            "and `bool` filters, on one field."
+        )
+    path, expected = next(iter(params.items()))
+    if name == "term" and isinstance(expected, dict):
+        expected = expected["value"]
+    expected = set(expected) if name == "terms" else {expected}
+    return lambda doc_id, source: any(
+        v in expected for v in _get_values(source, path)
+    )
+
+
+def _to_query(name_or_query, **kwargs):
+    """Return the query, as a dict, of the arguments of a filter."""
+    if not isinstance(name_or_query, Query):
+        name_or_query = Q(name_or_query, **kwargs)
+    return name_or_query.to_dict()
+
+
+class InMemoryHit(AttrDict):
+    """Search hit with the document metadata in `meta`."""
+
+    meta = None
+
+    def __init__(self, doc_id, version, source):
+        """Constructor."""
+        super().__init__(source)
+        self.meta = AttrDict(dict(id=doc_id, version=version))
+
+
+class InMemoryResponse(object):
+    """Search response with the hits and their total in `hits`."""
+
+    took = 0
+    timed_out = False
+
+    def __init__(self, hits, total):
+        """Constructor."""
+        self.hits = AttrList(hits)
+        self.hits.total = total
+
+    def __iter__(self):
+        """Iterate over the hits."""
+        return iter(self.hits)
+
+    def __len__(self):
+        """Return the number of returned hits."""
+        return len(self.hits)
+
+
+class InMemoryLoansSearch(object):
+    """In-memory implementation of the loans search."""
+
+    class Meta:
+        """Search only on loans index."""
+
+        index = "loans"
+        doc_types = None
+
+    def __init__(self, **kwargs):
+        """Constructor."""
+        self._filters = []
+        self._excludes = []
+        self._sort = []
+        self._slice = slice(None)
+        self._repr = dict(filter=[], must_not=[])
+
+    def _clone(self):
+        """Return a copy of the search."""
+        s = self.__class__()
+        s._filters = list(self._filters)
+        s._excludes = list(self._excludes)
+        s._sort = list(self._sort)
+        s._slice = self._slice
+        s._repr = deepcopy(self._repr)
+        return s
+
+    def filter(self, name_or_query, **kwargs):
+        """Keep only the documents matching the query."""
+        query = _to_query(name_or_query, **kwargs)
+        s = self._clone()
+        s._filters.append(_build_query_condition(query))
+        s._repr["filter"].append(query)
+        return s
+
+    def exclude(self, name_or_query, **kwargs):
+        """Remove the documents matching the query."""
+        query = _to_query(name_or_query, **kwargs)
+        s = self._clone()
+        s._excludes.append(_build_query_condition(query))
+        s._repr["must_not"].append(query)
+        return s
+
+    def sort(self, *keys):
+        """Sort the documents by the given fields.
+
+        Fields are given as `field`, `-field` or `{field: {order: asc}}`.
+        """
+        s = self._clone()
+        s._sort = []
+        for key in keys:
+            if isinstance(key, dict):
+                field, options = next(iter(key.items()))
+                order = options.get("order", "asc") \
+                    if isinstance(options, dict) else options
+                s._sort.append((field, order == "desc"))
+            elif key.startswith("-"):
+                s._sort.append((key[1:], True))
+            else:
+                s._sort.append((key, False))
+        return s
+
+    def extra(self, **kwargs):
+        """Accept and ignore extra search parameters."""
+        return self._clone()
+
+    def params(self, **kwargs):
+        """Accept and ignore search parameters."""
+        return self._clone()
+
+    def source(self, fields=None, **kwargs):
+        """Accept and ignore the selection of the returned fields."""
+        return self._clone()
+
+    def __getitem__(self, key):
+        """Slice the search results."""
+        if not isinstance(key, slice):
+            raise NotImplementedError("Only slices are supported.")
+        s = self._clone()
+        s._slice = key
+        return s
+
+    def _matches(self):
+        """Return the sorted list of matching documents."""
+        docs = [
+            (doc_id, version, source)
+            for doc_id, version, source in get_store().documents()
+            if all(f(doc_id, source) for f in self._filters) and
+            not any(e(doc_id, source) for e in self._excludes)
+        ]
+        # stable sorts, from the least significant field, missing last
+        for field, reverse in reversed(self._sort):
+            path = field.replace("__", ".")
+            with_value, without_value = [], []
+            for doc in docs:
+                if _get_values(doc[2], path):
+                    with_value.append(doc)
+                else:
+                    without_value.append(doc)
+            with_value.sort(
+                key=lambda doc: _get_values(doc[2], path)[0], reverse=reverse
+            )
+            docs = with_value + without_value
+        return docs
+
+    def count(self):
+        """Return the number of matching documents."""
+        return len(self._matches())
+
+    def scan(self):
+        """Iterate over all the matching documents."""
+        for doc_id, version, source in self._matches():
+            yield InMemoryHit(doc_id, version, source)
+
+    def execute(self, ignore_cache=False):
+        """Execute the search and return an Elasticsearch-like response."""
+        docs = self._matches()
+        total = len(docs)
+        if ES_VERSION[0] >= 7:
+            total = AttrDict(dict(value=total, relation="eq"))
+        hits = [InMemoryHit(*doc) for doc in docs[self._slice]]
+        return InMemoryResponse(hits, total)
+
+    def to_dict(self):
+        """Return a representation of the search."""
+        body = dict(query=dict(bool=self._repr))
+        if self._sort:
+            body["sort"] = [
+                {field: {"order": "desc" if reverse else "asc"}}
+                for field, reverse in self._sort
+            ]
+        return body
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Circulation search profiling."""
+
+import json
+import threading
+import time
+from bisect import bisect_left
+
+from elasticsearch import VERSION as ES_VERSION
+from flask import current_app
+
+
+def get_hits_total(response):
+    """Return the total number of hits of a search response."""
+    if ES_VERSION[0] >= 7:
+        return response.hits.total.value
+    return response.hits.total
+
+
+class LatencyHistogram(object):
+    """Latency histogram with fixed buckets, in milliseconds."""
+
+    def __init__(self, buckets):
+        """Constructor."""
+        self.buckets = sorted(buckets)
+        # the last counter holds the values above the biggest bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        """Record a latency value."""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def to_dict(self):
+        """Return a dictionary representation of the histogram."""
+        labels = ["<={}".format(b) for b in self.buckets]
+        labels.append(">{}".format(self.buckets[-1]) if self.buckets else "*")
+        return dict(
+            count=self.count,
+            total=self.total,
+            max=self.max,
+            avg=self.total / self.count if self.count else 0.0,
+            buckets=dict(zip(labels, self.counts)),
+        )
+
+
+class HelperStats(object):
+    """Profiling statistics of the searches performed by a helper."""
+
+    def __init__(self, buckets):
+        """Constructor."""
+        self.wall = LatencyHistogram(buckets)
+        self.took = LatencyHistogram(buckets)
+        self.hits = 0
+        self.slowest = None
+
+    def record(self, query, wall, took=None, hits=None):
+        """Record a search execution."""
+        self.wall.record(wall)
+        if took is not None:
+            self.took.record(took)
+        self.hits += hits or 0
+        if self.slowest is None or wall > self.slowest["wall"]:
+            self.slowest = dict(query=query, wall=wall, took=took, hits=hits)
+
+    def to_dict(self):
+        """Return a dictionary representation of the statistics."""
+        return dict(
+            wall=self.wall.to_dict(),
+            took=self.took.to_dict(),
+            hits=self.hits,
+            slowest=self.slowest,
+        )
+
+
+class SearchProfiler(object):
+    """In-process profiler of the loans searches.
+
+    Statistics are kept per helper, i.e. the function of
+    :mod:`invenio_circulation.search.api` that built the search, and are
+    local to the current process.
+    """
+
+    def __init__(self, buckets=None):
+        """Constructor."""
+        self.buckets = buckets or []
+        self._stats = {}
+        self._profiled = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        """Return True if the profiling mode is enabled."""
+        return current_app.config["CIRCULATION_SEARCH_PROFILING_ENABLED"]
+
+    @property
+    def threshold(self):
+        """Return the threshold, in ms, above which a search is slow."""
+        return current_app.config["CIRCULATION_SEARCH_PROFILING_THRESHOLD"]
+
+    def record(self, helper, query, wall, took=None, hits=None):
+        """Record a search execution performed by the given helper.
+
+        :param helper: the name of the helper that built the search.
+        :param query: the query body sent to Elasticsearch.
+        :param wall: the client-side wall time, in ms.
+        :param took: the time, in ms, reported by Elasticsearch.
+        :param hits: the number of hits.
+        """
+        with self._lock:
+            stats = self._stats.get(helper)
+            if stats is None:
+                stats = self._stats[helper] = HelperStats(self.buckets)
+            stats.record(query, wall, took=took, hits=hits)
+
+        current_app.logger.debug(
+            "Loans search by '%s': took %sms, wall time %.2fms, %s hits. "
+            "Query: %s", helper, took, wall, hits, json.dumps(query)
+        )
+
+    def is_slow(self, wall, took=None):
+        """Return True if the search is above the configured threshold."""
+        return (took if took is not None else wall) > self.threshold
+
+    def should_profile(self, helper):
+        """Return True if a slow search of the helper can be profiled now.
+
+        The slow searches are executed again to be profiled: only one search
+        per helper is profiled during each
+        ``CIRCULATION_SEARCH_PROFILING_INTERVAL``, in each process.
+        """
+        interval = current_app.config["CIRCULATION_SEARCH_PROFILING_INTERVAL"]
+        now = time.monotonic()
+        with self._lock:
+            last = self._profiled.get(helper)
+            if last is not None and now - last < interval:
+                return False
+            self._profiled[helper] = now
+        return True
+
+    def log_slow_search(self, helper, query, wall, took, hits, profile):
+        """Log a slow search with its Elasticsearch profile output."""
+        current_app.logger.warning(
+            "Slow loans search by '%s': took %sms, wall time %.2fms, %s hits. "
+            "Query: %s Profile: %s", helper, took, wall, hits,
+            json.dumps(query), json.dumps(profile)
+        )
+
+    def dump(self):
+        """Return the statistics of all helpers."""
+        with self._lock:
+            return {
+                helper: stats.to_dict()
+                for helper, stats in self._stats.items()
+            }
+
+    def reset(self):
+        """Clear all statistics."""
+        with self._lock:
+            self._stats = {}
+            self._profiled = {}
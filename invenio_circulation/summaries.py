@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Summaries of the items, patrons and documents of the indexed loans.
+
+When the ``CIRCULATION_*_SUMMARY_RETRIEVER`` functions are set, the summaries
+they return, e.g. the barcode of the item, the name of the patron or the title
+of the document, are indexed with the loans, so that a list of loans can be
+displayed from the search results only.
+
+The summaries of the loans indexed in bulk are retrieved at once, and kept
+until the end of the bulk operation. The loans of a changed item, patron or
+document are indexed again with :func:`invenio_circulation.reindex.\
+reindex_loans_of`.
+"""
+
+from contextlib import contextmanager
+
+from flask import current_app, g, has_app_context
+from invenio_records_rest.utils import obj_or_import_string
+
+from .proxies import current_circulation
+
+_BATCH_KEY = "_circulation_loans_summaries"
+"""Name of the attribute of `flask.g` storing the retrieved summaries."""
+
+_SUMMARIES = (
+    ("item_pid", "item_summary", "CIRCULATION_ITEMS_SUMMARY_RETRIEVER"),
+    ("patron_pid", "patron_summary", "CIRCULATION_PATRONS_SUMMARY_RETRIEVER"),
+    ("document_pid", "document_summary",
+     "CIRCULATION_DOCUMENTS_SUMMARY_RETRIEVER"),
+)
+"""PID field, summary field and retriever of each summary of the loans."""
+
+
+def _pid_key(pid):
+    """Return a hashable key of a PID, the item PIDs being dicts."""
+    if isinstance(pid, dict):
+        return pid.get("type"), pid.get("value")
+    return pid
+
+
+def _get_retrievers():
+    """Return the PID field, summary field and retriever of each summary."""
+    config = current_app.config
+    return [
+        (pid_field, summary_field, obj_or_import_string(config[name]))
+        for pid_field, summary_field, name in _SUMMARIES
+        if config.get(name)
+    ]
+
+
+def _retrieve(retrievers, loans, summaries):
+    """Retrieve at once the summaries of the loans not retrieved yet.
+
+    :param summaries: the retrieved summaries by PID field and PID key,
+        updated with the retrieved ones.
+    """
+    for pid_field, _, retriever in retrievers:
+        retrieved = summaries.setdefault(pid_field, {})
+        pids = {}
+        for loan in loans:
+            pid = loan.get(pid_field)
+            if pid and _pid_key(pid) not in retrieved:
+                pids.setdefault(_pid_key(pid), pid)
+        if pids:
+            retrieved.update(zip(pids.keys(), retriever(list(pids.values()))))
+    return summaries
+
+
+@contextmanager
+def loans_summaries_batch(loans):
+    """Retrieve at once the summaries of the loans indexed in the block.
+
+    :param loans: the loans to index.
+    """
+    retrievers = _get_retrievers() if has_app_context() else []
+    if not retrievers:
+        yield
+        return
+
+    summaries = g.get(_BATCH_KEY)
+    if summaries is not None:
+        _retrieve(retrievers, loans, summaries)
+        yield
+        return
+
+    setattr(g, _BATCH_KEY, _retrieve(retrievers, loans, {}))
+    try:
+        yield
+    finally:
+        g.pop(_BATCH_KEY, None)
+
+
+def add_loan_summaries(sender, json=None, record=None, **kwargs):
+    """Add the summaries of the item, patron and document to a loan.
+
+    Receiver of the `before_record_index` signal of Invenio-Indexer.
+    """
+    if not isinstance(record, current_circulation.loan_record_cls):
+        return
+    retrievers = _get_retrievers()
+    if not retrievers:
+        return
+
+    summaries = _retrieve(retrievers, [record], g.get(_BATCH_KEY, {}))
+    for pid_field, summary_field, _ in retrievers:
+        pid = record.get(pid_field)
+        summary = summaries[pid_field].get(_pid_key(pid)) if pid else None
+        if summary is not None:
+            json[summary_field] = summary
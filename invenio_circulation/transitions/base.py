@@ -13,16 +13,16 @@ from datetime import datetime
 
 import arrow
 from flask import current_app
-from invenio_db import db
 
 from ..api import Loan, is_item_available_for_checkout
+from ..batch import commit_loans
 from ..errors import DocumentDoNotMatchError, DocumentNotAvailableError, \
     InvalidLoanStateError, InvalidPermissionError, ItemNotAvailableError, \
     MissingRequiredParameterError, TransitionConditionsFailedError, \
     TransitionConstraintsViolationError
-from ..proxies import current_circulation
+from ..indexer import get_partial_update_fields, index_loan
 from ..signals import loan_state_changed
-from ..utils import str2datetime
+from ..utils import get_changed_fields, str2datetime
 
 
 def ensure_same_patron(f):
@@ -187,9 +187,16 @@ class Transition(object):
         self.prev_loan.date_fields2str()
         loan.date_fields2str()
 
-        loan.commit()
-        db.session.commit()
-        current_circulation.loan_indexer().index(loan)
+        commit_kwargs = {}
+        if current_app.config["CIRCULATION_LOAN_TRUSTED_TRANSITIONS"]:
+            commit_kwargs["validate_fields"] = get_changed_fields(
+                self.prev_loan, loan
+            )
+        loan.commit(**commit_kwargs)
+        commit_loans()
+        index_loan(
+            loan, fields=get_partial_update_fields(self.prev_loan, loan)
+        )
 
         loan_state_changed.send(
             self, prev_loan=self.prev_loan, loan=loan, trigger=self.trigger
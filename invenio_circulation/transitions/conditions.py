@@ -8,7 +8,63 @@
 
 """Invenio Circulation transitions conditions."""
 
-from flask import current_app
+from contextlib import contextmanager
+
+from flask import current_app, g, has_app_context
+
+_LOCATIONS_KEY = "_circulation_items_locations"
+"""Name of the attribute of `flask.g` storing the retrieved locations."""
+
+
+def _item_key(item_pid):
+    """Return a hashable key of an item PID."""
+    return item_pid["type"], item_pid["value"]
+
+
+def _retrieve_item_locations(item_pids):
+    """Return the Location PID of each Item PID."""
+    retrieve_all = current_app.config["CIRCULATION_ITEMS_LOCATION_RETRIEVER"]
+    if retrieve_all:
+        return retrieve_all(item_pids)
+    retrieve = current_app.config["CIRCULATION_ITEM_LOCATION_RETRIEVER"]
+    return [retrieve(item_pid) for item_pid in item_pids]
+
+
+@contextmanager
+def item_locations_batch(item_pids):
+    """Retrieve at once the locations of the items handled in the block.
+
+    :param item_pids: a list of dicts containing `value` and `type` fields to
+        uniquely identify the items.
+    """
+    if g.get(_LOCATIONS_KEY) is not None:
+        yield
+        return
+
+    item_pids = list(dict(
+        (_item_key(item_pid), item_pid) for item_pid in item_pids
+    ).values())
+    locations = dict(zip(
+        [_item_key(item_pid) for item_pid in item_pids],
+        _retrieve_item_locations(item_pids) if item_pids else [],
+    ))
+    setattr(g, _LOCATIONS_KEY, locations)
+    try:
+        yield
+    finally:
+        g.pop(_LOCATIONS_KEY, None)
+
+
+def get_item_location(item_pid):
+    """Return the Location PID of the item.
+
+    :param item_pid: a dict containing `value` and `type` fields to
+        uniquely identify the item.
+    """
+    locations = g.get(_LOCATIONS_KEY) if has_app_context() else None
+    if locations is not None and _item_key(item_pid) in locations:
+        return locations[_item_key(item_pid)]
+    return current_app.config["CIRCULATION_ITEM_LOCATION_RETRIEVER"](item_pid)
 
 
 def is_same_location(item_pid, input_location_pid):
@@ -17,7 +73,4 @@ def is_same_location(item_pid, input_location_pid):
     :param item_pid: a dict containing `value` and `type` fields to
         uniquely identify the item.
     """
-    item_location_pid = current_app.config[
-        "CIRCULATION_ITEM_LOCATION_RETRIEVER"
-    ](item_pid)
-    return input_location_pid == item_location_pid
+    return input_location_pid == get_item_location(item_pid)
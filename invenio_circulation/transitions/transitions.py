@@ -8,18 +8,23 @@
 
 """Invenio Circulation custom transitions."""
 
-from flask import current_app
-from invenio_db import db
+from contextlib import contextmanager
 
-from invenio_circulation.proxies import current_circulation
+from flask import current_app, g, has_app_context
 
 from ..api import can_be_requested, get_available_item_by_doc_pid, \
-    get_document_pid_by_item_pid, get_pending_loans_by_doc_pid
+    get_document_pid_by_item_pid, get_document_pids_by_item_pids, \
+    get_pending_loans_by_doc_pid, get_pending_loans_by_doc_pids
+from ..batch import commit_loans
 from ..errors import ItemDoNotMatchError, ItemNotAvailableError, \
     LoanMaxExtensionError, RecordCannotBeRequestedError, \
     TransitionConditionsFailedError, TransitionConstraintsViolationError
+from ..indexer import index_loans, loans_indexing_batch
 from ..transitions.base import Transition
-from ..transitions.conditions import is_same_location
+from ..transitions.conditions import get_item_location, is_same_location
+
+_RETURNED_ITEMS_KEY = "_circulation_returned_items"
+"""Name of the attribute of `flask.g` collecting the returned items."""
 
 
 def _ensure_valid_loan_duration(loan):
@@ -83,12 +88,64 @@ def _update_document_pending_request_for_item(item_pid, **kwargs):
     :param item_pid: a dict containing `value` and `type` fields to
         uniquely identify the item.
     """
+    returned_items = g.get(_RETURNED_ITEMS_KEY) if has_app_context() else None
+    if returned_items is not None:
+        # updated by the caller, with the other returned items
+        returned_items.append(item_pid)
+        return
+
     document_pid = get_document_pid_by_item_pid(item_pid)
-    for pending_loan in get_pending_loans_by_doc_pid(document_pid):
+    pending_loans = list(get_pending_loans_by_doc_pid(document_pid))
+    for pending_loan in pending_loans:
         pending_loan["item_pid"] = item_pid
         pending_loan.commit()
-        db.session.commit()
-        current_circulation.loan_indexer().index(pending_loan)
+    commit_loans()
+    index_loans(pending_loans)
+
+
+def update_pending_requests_for_items(item_pids):
+    """Update at once the pending loans on the Documents of the Items.
+
+    The pending loans of a Document get the last of its given Items, as
+    when the Items are returned one after the other.
+
+    :param item_pids: a list of dicts containing `value` and `type` fields
+        to uniquely identify the returned items.
+    """
+    document_pids = get_document_pids_by_item_pids(item_pids)
+    items_by_document = dict(
+        (document_pid, item_pid)
+        for document_pid, item_pid in zip(document_pids, item_pids)
+        if document_pid
+    )
+    if not items_by_document:
+        return
+    pending_loans = get_pending_loans_by_doc_pids(list(items_by_document))
+    for pending_loan in pending_loans:
+        pending_loan["item_pid"] = items_by_document[
+            pending_loan["document_pid"]
+        ]
+        pending_loan.commit()
+    commit_loans()
+    index_loans(pending_loans)
+
+
+@contextmanager
+def returned_items_collection():
+    """Collect the Items returned in the block instead of updating requests.
+
+    The pending loans on the Documents of the returned Items are not updated
+    by the check-in transitions: the caller updates them at once with
+    :func:`update_pending_requests_for_items`.
+
+    :returns: the list of the returned items, filled during the block.
+    """
+    item_pids = []
+    setattr(g, _RETURNED_ITEMS_KEY, item_pids)
+    try:
+        yield item_pids
+    finally:
+        g.pop(_RETURNED_ITEMS_KEY, None)
 
 
 def _ensure_valid_extension(loan):
@@ -137,7 +194,7 @@ def _ensure_not_same_location(item_pid, location_pid, destination, error_msg):
 
 def _get_item_location(item_pid):
     """Retrieve Item location based on PID."""
-    return current_app.config["CIRCULATION_ITEM_LOCATION_RETRIEVER"](item_pid)
+    return get_item_location(item_pid)
 
 
 class ToItemOnLoan(Transition):
@@ -316,9 +373,10 @@ class ItemOnLoanToItemReturned(Transition):
 
     def after(self, loan):
         """Check for pending requests on this item after check-in."""
-        super().after(loan)
-        if self.assign_item:
-            _update_document_pending_request_for_item(loan["item_pid"])
+        with loans_indexing_batch():
+            super().after(loan)
+            if self.assign_item:
+                _update_document_pending_request_for_item(loan["item_pid"])
 
 
 class ItemInTransitHouseToItemReturned(Transition):
@@ -351,9 +409,10 @@ class ItemInTransitHouseToItemReturned(Transition):
 
     def after(self, loan):
         """Check for pending requests on this item after check-in."""
-        super().after(loan)
-        if self.assign_item:
-            _update_document_pending_request_for_item(loan["item_pid"])
+        with loans_indexing_batch():
+            super().after(loan)
+            if self.assign_item:
+                _update_document_pending_request_for_item(loan["item_pid"])
 
 
 class ToCancelled(Transition):
@@ -145,3 +145,11 @@ def transaction_user_validator(transaction_user_pid):
 def str2datetime(str_date):
     """Parse string date with timezone and return a datetime object."""
     return arrow.get(str_date).to('utc')
+
+
+def get_changed_fields(prev_data, data):
+    """Return the set of the fields added, changed or removed in the data."""
+    return set(
+        field for field in set(prev_data) | set(data)
+        if prev_data.get(field) != data.get(field)
+    )
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Versioning policy of the loans records.
+
+With the records versioning of Invenio-DB enabled, each commit of a loan
+writes a copy of its JSON in the records versions table. The
+`CIRCULATION_LOAN_VERSIONING` policy limits this history for the loans only:
+
+- ``full``: every version of the loans is kept, as for the other records.
+- ``off``: no version of the loans is written.
+- ``keep``: only the last `CIRCULATION_LOAN_VERSIONS_KEPT` versions of each
+  loan are kept.
+- ``delta``: the last version of each loan is kept whole, the previous ones
+  only store the fields that differ from the version following them. The
+  whole versions are rebuilt by :func:`iter_loan_versions`, and by the
+  revisions of the loans, so that a loan is reverted to a whole version.
+
+The ``off`` policy is applied when the loans are flushed to the database.
+The ``keep`` and ``delta`` policies are applied to the history of the loans
+by :func:`compact_loan_versions`, run periodically on the loans updated since
+its previous run, e.g. with the `circulation compact-versions` command.
+"""
+
+import sqlalchemy as sa
+from flask import current_app, has_app_context
+from invenio_db import db
+from invenio_records.api import RecordRevision, RevisionsIterator
+from invenio_records.models import RecordMetadata
+
+from .proxies import current_circulation
+from .reindex import iter_loan_ids
+
+_DELTA_KEY = "$delta"
+
+_SESSION_KEY = "circulation_unversioned_loans"
+
+
+def _get_policy():
+    """Return the loans versioning policy of the current application."""
+    if not has_app_context() or not current_app.config.get("DB_VERSIONING"):
+        return "full"
+    return current_app.config["CIRCULATION_LOAN_VERSIONING"]
+
+
+def _version_table():
+    """Return the table of the records versions."""
+    from sqlalchemy_continuum import version_class
+    return version_class(RecordMetadata).__table__
+
+
+def _is_loan(obj):
+    """Return True if the object is the metadata of a loan."""
+    if not isinstance(obj, RecordMetadata) or not obj.json:
+        return False
+    schema = current_circulation.loan_record_cls._schema
+    return str(obj.json.get("$schema", "")).endswith(schema)
+
+
+def is_delta(data):
+    """Return True if the JSON of a loan version is a delta."""
+    return isinstance(data, dict) and _DELTA_KEY in data
+
+
+def make_delta(data, prev_data):
+    """Return the delta to apply to `data` to get `prev_data`."""
+    return {_DELTA_KEY: dict(
+        set=dict(
+            (field, value) for field, value in prev_data.items()
+            if data.get(field) != value
+        ),
+        unset=sorted(field for field in data if field not in prev_data),
+    )}
+
+
+def apply_delta(data, delta):
+    """Return the loan data with the delta applied."""
+    changes = delta[_DELTA_KEY]
+    prev_data = dict(
+        (field, value) for field, value in data.items()
+        if field not in changes["unset"]
+    )
+    prev_data.update(changes["set"])
+    return prev_data
+
+
+def _get_versions(conn, loan_id, limit=None):
+    """Return the `(transaction_id, json)` of the versions, latest first."""
+    table = _version_table()
+    query = sa.select(
+        [table.c.transaction_id, table.c.json]
+    ).where(table.c.id == loan_id).order_by(table.c.transaction_id.desc())
+    if limit:
+        query = query.limit(limit)
+    return conn.execute(query).fetchall()
+
+
+def _prune_versions(conn, loan_ids, keep):
+    """Delete the versions of the loans but the last `keep` ones.
+
+    :returns: the number of deleted versions.
+    """
+    table = _version_table()
+    deleted = 0
+    for loan_id in loan_ids:
+        if keep:
+            versions = _get_versions(conn, loan_id, limit=keep + 1)
+            if len(versions) <= keep:
+                continue
+            oldest_kept = versions[keep - 1].transaction_id
+            condition = table.c.transaction_id < oldest_kept
+        else:
+            condition = sa.true()
+        deleted += conn.execute(
+            table.delete().where(sa.and_(table.c.id == loan_id, condition))
+        ).rowcount
+    return deleted
+
+
+def _compact_versions(conn, loan_ids, limit=None):
+    """Store the versions of the loans but the last one as deltas.
+
+    :param limit: the number of the latest versions to compact.
+    :returns: the number of compacted versions.
+    """
+    table = _version_table()
+    compacted = 0
+    for loan_id in loan_ids:
+        versions = _get_versions(conn, loan_id, limit=limit)
+        if not versions or is_delta(versions[0].json):
+            continue
+        data = versions[0].json
+        for transaction_id, version_data in versions[1:]:
+            if is_delta(version_data):
+                data = apply_delta(data, version_data)
+                continue
+            conn.execute(
+                table.update().where(sa.and_(
+                    table.c.id == loan_id,
+                    table.c.transaction_id == transaction_id,
+                )).values(json=make_delta(data, version_data))
+            )
+            data = version_data
+            compacted += 1
+    return compacted
+
+
+def _anonymize_version(data, fields):
+    """Return the JSON of a loan version without the fields."""
+    if not is_delta(data):
+        return dict(
+            (field, value) for field, value in data.items()
+            if field not in fields
+        )
+    changes = data[_DELTA_KEY]
+    return {_DELTA_KEY: dict(
+        set=dict(
+            (field, value) for field, value in changes["set"].items()
+            if field not in fields
+        ),
+        unset=[field for field in changes["unset"] if field not in fields],
+    )}
+
+
+def anonymize_loan_versions(conn, loan_ids, fields):
+    """Remove the fields from all the stored versions of the loans.
+
+    :param conn: the connection of the transaction updating the loans.
+    :param loan_ids: the ids of the loans.
+    :param fields: the names of the fields to remove.
+    :returns: the number of updated versions.
+    """
+    if not current_app.config.get("DB_VERSIONING") or not loan_ids:
+        return 0
+    table = _version_table()
+    versions = conn.execute(sa.select(
+        [table.c.id, table.c.transaction_id, table.c.json]
+    ).where(table.c.id.in_(loan_ids))).fetchall()
+    updated = 0
+    for loan_id, transaction_id, data in versions:
+        if not data:
+            continue
+        anonymized = _anonymize_version(data, fields)
+        if anonymized == data:
+            continue
+        conn.execute(
+            table.update().where(sa.and_(
+                table.c.id == loan_id,
+                table.c.transaction_id == transaction_id,
+            )).values(json=anonymized)
+        )
+        updated += 1
+    return updated
+
+
+def iter_loan_versions(loan_id):
+    """Yield the `(transaction_id, json)` of the loan versions, latest first.
+
+    The versions stored as deltas are rebuilt whole.
+    """
+    data = None
+    for transaction_id, version_data in _get_versions(
+        db.session.connection(), loan_id
+    ):
+        if data is not None and is_delta(version_data):
+            data = apply_delta(data, version_data)
+        else:
+            data = version_data
+        yield transaction_id, data
+
+
+class LoanRevisionsIterator(RevisionsIterator):
+    """Revisions iterator rebuilding the loan versions stored as deltas."""
+
+    def __init__(self, model):
+        """Initialize instance with the SQLAlchemy model."""
+        super().__init__(model)
+        self._versions = None
+
+    def _get_revision(self, version):
+        """Return the whole revision of a loan version."""
+        revision = RecordRevision(version)
+        if is_delta(version.json):
+            if self._versions is None:
+                self._versions = dict(iter_loan_versions(self.model.id))
+            revision.clear()
+            revision.update(self._versions[version.transaction_id])
+        return revision
+
+    def __next__(self):
+        """Get next revision item."""
+        return self._get_revision(next(self._it))
+
+    def __getitem__(self, revision_id):
+        """Get a specific revision."""
+        return self._get_revision(super().__getitem__(revision_id).model)
+
+    def __reversed__(self):
+        """Allows to use reversed operator."""
+        for revision in super().__reversed__():
+            yield self._get_revision(revision.model)
+
+
+def _restore_versioning(session):
+    """Restore the versioning of the loans disabled for a flush."""
+    for obj in session.info.pop(_SESSION_KEY, ()):
+        obj.__dict__.pop("__versioned__", None)
+
+
+def before_flush(session, flush_context, instances):
+    """Disable the versioning of the flushed loans, for this flush only."""
+    # left by a failed flush
+    _restore_versioning(session)
+    if _get_policy() != "off":
+        return
+    loans = set(obj for obj in session.new | session.dirty if _is_loan(obj))
+    for obj in loans:
+        obj.__versioned__ = dict(
+            RecordMetadata.__versioned__, versioning=False
+        )
+    session.info[_SESSION_KEY] = loans
+
+
+def after_flush_postexec(session, flush_context):
+    """Restore the versioning of the flushed loans."""
+    _restore_versioning(session)
+
+
+def init_loan_versioning():
+    """Listen to the flushes of the sessions to apply the policy."""
+    for name, listener in (("before_flush", before_flush),
+                           ("after_flush_postexec", after_flush_postexec)):
+        if not sa.event.contains(sa.orm.Session, name, listener):
+            # run before the versioning of SQLAlchemy-Continuum
+            sa.event.listen(sa.orm.Session, name, listener, insert=True)
+
+
+def compact_loan_versions(chunk_size=1000, updated_since=None,
+                          progress=None):
+    """Apply the versioning policy to the existing versions of the loans.
+
+    :param chunk_size: the number of loans compacted at once.
+    :param updated_since: apply the policy only to the loans updated after
+        this time, e.g. since the previous run.
+    :param progress: a function called after each chunk with the number of
+        loans and of deleted and compacted versions.
+    :returns: a dict with the number of deleted and compacted versions.
+    """
+    policy = _get_policy()
+    result = dict(deleted=0, compacted=0)
+    if policy == "full":
+        return result
+
+    for loan_ids in iter_loan_ids(
+        chunk_size=chunk_size, updated_since=updated_since
+    ):
+        conn = db.session.connection()
+        deleted = compacted = 0
+        if policy == "off":
+            deleted = _prune_versions(conn, loan_ids, 0)
+        elif policy == "keep":
+            deleted = _prune_versions(
+                conn,
+                loan_ids,
+                current_app.config["CIRCULATION_LOAN_VERSIONS_KEPT"],
+            )
+        elif policy == "delta":
+            compacted = _compact_versions(conn, loan_ids)
+        db.session.commit()
+        result["deleted"] += deleted
+        result["compacted"] += compacted
+        if progress:
+            progress(len(loan_ids), deleted, compacted)
+    return result
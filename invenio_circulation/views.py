@@ -10,19 +10,29 @@
 
 from copy import deepcopy
 
-from flask import Blueprint, current_app, request, url_for
+from flask import Blueprint, current_app, jsonify, request, url_for
+from flask.views import MethodView
 from invenio_db import db
+from invenio_records_rest.query import default_search_factory
 from invenio_records_rest.utils import obj_or_import_string
 from invenio_records_rest.views import pass_record
 from invenio_rest import ContentNegotiatedMethodView
 
-from .errors import InvalidLoanStateError, ItemNotAvailableError, \
-    MissingRequiredParameterError
+from .batch import checkin_items, run_loan_actions, validate_items_checkin, \
+    validate_loan_actions
+from .conditional import need_loan_revision
+from .errors import InvalidLoanExportError, InvalidLoanStateError, \
+    ItemNotAvailableError, MissingRequiredParameterError
+from .indexer import flush_loans_indexing, index_loan
 from .permissions import need_permissions
 from .pidstore.pids import _LOANID_CONVERTER, CIRCULATION_LOAN_PID_TYPE
 from .proxies import current_circulation
-from .records.loaders import loan_loader, loan_replace_item_loader
+from .records.loaders import loan_loader, loan_params_loader, \
+    loan_replace_item_loader
+from .search.api import scan_loans
+from .search.consistency import create_consistency_token
 from .signals import loan_replace_item
+from .utils import get_changed_fields
 
 
 def extract_transitions_from_app(app):
@@ -65,6 +75,50 @@ def _get_loan_endpoint_options(app):
     )
 
 
+def _set_consistency_token(response, record):
+    """Set the search consistency token of the changed loan."""
+    header = current_app.config["CIRCULATION_CONSISTENCY_TOKEN_HEADER"]
+    response.headers[header] = create_consistency_token(record)
+    return response
+
+
+def _prefers_minimal_response():
+    """Return True if the request asks for a minimal response.
+
+    The minimal response is requested with the ``Prefer: return=minimal``
+    header, or with the ``return=minimal`` query argument.
+    """
+    if request.args.get("return") == "minimal":
+        return True
+    preferences = request.headers.get("Prefer", "")
+    for preference in preferences.split(","):
+        name, _, value = preference.split(";")[0].partition("=")
+        if name.strip().lower() == "return" and \
+                value.strip().strip('"').lower() == "minimal":
+            return True
+    return False
+
+
+def _make_minimal_response(prev_record, record, code):
+    """Return the PID, the state, the revision and the changed fields.
+
+    The loan is neither serialized nor given its links. The removed fields
+    are returned as null.
+    """
+    body = {
+        field: record.get(field)
+        for field in get_changed_fields(prev_record, record)
+    }
+    body.update(
+        pid=record["pid"], state=record["state"], revision=record.revision_id
+    )
+    response = jsonify(body)
+    response.status_code = code
+    response.set_etag(str(record.revision_id))
+    response.headers["Preference-Applied"] = "return=minimal"
+    return response
+
+
 def create_loan_actions_blueprint(app):
     """Create a blueprint for Loan actions."""
     blueprint = Blueprint(
@@ -99,15 +153,27 @@ class LoanActionResource(ContentNegotiatedMethodView):
             setattr(self, key, value)
 
     @need_permissions("loan-actions")
+    @need_loan_revision
     @pass_record
     def post(self, pid, record, action, **kwargs):
-        """Handle loan action."""
+        """Handle loan action.
+
+        With the ``Prefer: return=minimal`` header, or the ``return=minimal``
+        query argument, only the PID, the state, the revision and the fields
+        changed by the action are returned.
+        """
         data = self.loader()
+        minimal = _prefers_minimal_response()
+        prev_record = deepcopy(dict(record)) if minimal else None
         record = current_circulation.circulation.trigger(
             record, **dict(data, trigger=action)
         )
         db.session.commit()
-        return self.make_response(
+        flush_loans_indexing()
+        if minimal:
+            response = _make_minimal_response(prev_record, record, 202)
+            return _set_consistency_token(response, record)
+        response = self.make_response(
             pid,
             record,
             202,
@@ -115,6 +181,98 @@ class LoanActionResource(ContentNegotiatedMethodView):
                 "CIRCULATION_LOAN_LINKS_FACTORY"
             ),
         )
+        return _set_consistency_token(response, record)
+
+
+def create_loan_batch_actions_blueprint(app):
+    """Create a blueprint for batches of Loan actions."""
+    blueprint = Blueprint(
+        "invenio_circulation_loan_batch_actions", __name__, url_prefix=""
+    )
+
+    batch_actions_view = LoanBatchActionsResource.as_view(
+        LoanBatchActionsResource.view_name
+    )
+    blueprint.add_url_rule(
+        "/circulation/loans/actions",
+        view_func=batch_actions_view,
+        methods=["POST"],
+    )
+    return blueprint
+
+
+class LoanBatchActionsResource(MethodView):
+    """Batch of Loan actions resource."""
+
+    view_name = "loan_batch_actions_resource"
+
+    @need_permissions("loan-actions")
+    def post(self):
+        """Run a batch of loan actions in one transaction.
+
+        The request body contains the ``actions``, a list of dicts with the
+        ``pid`` of the loan, the ``action`` to trigger and its ``params``.
+        When ``atomic`` is true, no action is committed if one fails.
+        """
+        data = request.get_json() or {}
+        entries = data.get("actions")
+        validate_loan_actions(entries)
+        committed, results, loans = run_loan_actions(
+            entries, atomic=bool(data.get("atomic")), loader=loan_params_loader
+        )
+        flush_loans_indexing()
+
+        response = jsonify(committed=committed, results=results)
+        response.status_code = 202 if committed else 400
+        if loans:
+            _set_consistency_token(response, loans[-1])
+        return response
+
+
+def create_loan_checkin_blueprint(app):
+    """Create a blueprint for the bulk check-in of Items."""
+    blueprint = Blueprint(
+        "invenio_circulation_loan_checkin", __name__, url_prefix=""
+    )
+
+    checkin_view = LoanCheckinResource.as_view(LoanCheckinResource.view_name)
+    blueprint.add_url_rule(
+        "/circulation/loans/checkin",
+        view_func=checkin_view,
+        methods=["POST"],
+    )
+    return blueprint
+
+
+class LoanCheckinResource(MethodView):
+    """Bulk check-in of Items resource."""
+
+    view_name = "loan_checkin_resource"
+
+    @need_permissions("loan-actions")
+    def post(self):
+        """Check in a list of items in one transaction.
+
+        The request body contains the ``item_pids``, a list of dicts with the
+        ``type`` and the ``value`` of the items, and the params of the
+        check-ins, e.g. the ``transaction_location_pid`` and the
+        ``transaction_user_pid``. When ``atomic`` is true, no check-in is
+        committed if one fails.
+        """
+        params = dict(request.get_json() or {})
+        item_pids = params.pop("item_pids", None)
+        atomic = bool(params.pop("atomic", False))
+        validate_items_checkin(item_pids)
+        committed, results, loans = checkin_items(
+            item_pids, atomic=atomic, loader=loan_params_loader, **params
+        )
+        flush_loans_indexing()
+
+        response = jsonify(committed=committed, results=results)
+        response.status_code = 202 if committed else 400
+        if loans:
+            _set_consistency_token(response, loans[-1])
+        return response
 
 
 def create_loan_replace_item_blueprint(app):
@@ -175,6 +333,7 @@ class LoanReplaceItemResource(ContentNegotiatedMethodView):
             setattr(self, key, value)
 
     @need_permissions("loan-actions")
+    @need_loan_revision
     @pass_record
     def post(self, pid, record, *args, **kwargs):
         """Handle POST request to update loan with new item."""
@@ -187,13 +346,14 @@ class LoanReplaceItemResource(ContentNegotiatedMethodView):
 
         record.commit()
         db.session.commit()
-        current_circulation.loan_indexer().index(record)
+        index_loan(record)
+        flush_loans_indexing()
 
         if old_item_pid:
             loan_replace_item.send(self, old_item_pid=old_item_pid,
                                    new_item_pid=new_item_pid)
 
-        return self.make_response(
+        response = self.make_response(
             pid,
             record,
             202,
@@ -201,3 +361,105 @@ class LoanReplaceItemResource(ContentNegotiatedMethodView):
                 "CIRCULATION_LOAN_LINKS_FACTORY"
             ),
         )
+        return _set_consistency_token(response, record)
+
+
+def create_loan_search_stats_blueprint(app):
+    """Create a blueprint to dump the loans search profiling statistics."""
+    blueprint = Blueprint(
+        "invenio_circulation_loan_search_stats", __name__, url_prefix=""
+    )
+
+    search_stats_view = LoanSearchStatsResource.as_view(
+        LoanSearchStatsResource.view_name
+    )
+    blueprint.add_url_rule(
+        "/circulation/loans/search-stats",
+        view_func=search_stats_view,
+        methods=["GET", "DELETE"],
+    )
+    return blueprint
+
+
+class LoanSearchStatsResource(MethodView):
+    """Loans search profiling statistics resource."""
+
+    view_name = "loan_search_stats_resource"
+
+    @need_permissions("loan-search-stats")
+    def get(self):
+        """Return the per-helper latency histograms of this process."""
+        profiler = current_circulation.search_profiler
+        return jsonify(
+            enabled=profiler.enabled,
+            threshold=profiler.threshold,
+            helpers=profiler.dump(),
+        )
+
+    @need_permissions("loan-search-stats")
+    def delete(self):
+        """Reset the statistics of this process."""
+        current_circulation.search_profiler.reset()
+        return "", 204
+
+
+def create_loan_export_blueprint(app):
+    """Create a blueprint to export the loans of a search."""
+    blueprint = Blueprint(
+        "invenio_circulation_loan_export", __name__, url_prefix=""
+    )
+
+    options, _ = _get_loan_endpoint_options(app)
+    export_view = LoanExportResource.as_view(
+        LoanExportResource.view_name,
+        search_factory=obj_or_import_string(
+            options.get("search_factory_imp"),
+            default=default_search_factory,
+        ),
+    )
+    blueprint.add_url_rule(
+        "/circulation/loans/export",
+        view_func=export_view,
+        methods=["GET"],
+    )
+    return blueprint
+
+
+class LoanExportResource(MethodView):
+    """Loans search export resource."""
+
+    view_name = "loan_export_resource"
+
+    def __init__(self, search_factory, *args, **kwargs):
+        """Constructor."""
+        super().__init__(*args, **kwargs)
+        self.search_factory = search_factory
+
+    @need_permissions("loan-export")
+    def get(self):
+        """Stream the loans matching the search, in the requested format.
+
+        The search is given with the query arguments of the loans search
+        endpoint. The ``format`` is ``ndjson`` or ``csv``, and ``fields`` is
+        the comma-separated list of the exported fields. The loans are not
+        paginated and the export is not limited by the result window.
+        """
+        serializers = current_app.config["CIRCULATION_LOAN_EXPORT_SERIALIZERS"]
+        export_format = request.args.get("format", "ndjson")
+        if export_format not in serializers:
+            raise InvalidLoanExportError(
+                description="The export format must be one of: {0}.".format(
+                    ", ".join(sorted(serializers))
+                )
+            )
+        fields = [
+            field.strip()
+            for field in request.args.get("fields", "").split(",")
+            if field.strip()
+        ] or current_app.config["CIRCULATION_LOAN_EXPORT_FIELDS"]
+
+        search, _ = self.search_factory(
+            self, current_circulation.loan_search_cls()
+        )
+        serializer = obj_or_import_string(serializers[export_format])
+        return serializer(scan_loans(search, fields), fields)
@@ -80,7 +80,7 @@ install_requires = [
     'invenio-access>=1.3.1',
     'invenio-logging>=1.2.1',
     'invenio-pidstore>=1.0.0',
-    'invenio-records-rest>=1.6.1',
+    'invenio-records-rest>=1.7.2',
     'invenio-jsonschemas>=1.0.0',
 ]
 
@@ -109,6 +109,9 @@ setup(
     platforms='any',
     python_requires='>=3',
     entry_points={
+        'flask.commands': [
+            'circulation = invenio_circulation.cli:circulation',
+        ],
         'invenio_base.apps': [
             'invenio_circulation = invenio_circulation:InvenioCirculation'
         ],
@@ -121,8 +124,22 @@ setup(
             'invenio_circulation_loan_for_item = '
             'invenio_circulation_loan_replace_item = '
             'invenio_circulation.views:create_loan_replace_item_blueprint',
+            'invenio_circulation_loan_search_stats = '
+            'invenio_circulation.views:create_loan_search_stats_blueprint',
+            'invenio_circulation_loan_batch_actions = '
+            'invenio_circulation.views:create_loan_batch_actions_blueprint',
+            'invenio_circulation_loan_checkin = '
+            'invenio_circulation.views:create_loan_checkin_blueprint',
+            'invenio_circulation_loan_export = '
+            'invenio_circulation.views:create_loan_export_blueprint',
 
         ],
+        'invenio_db.alembic': [
+            'invenio_circulation = invenio_circulation:alembic',
+        ],
+        'invenio_db.models': [
+            'invenio_circulation = invenio_circulation.models',
+        ],
         'invenio_i18n.translations': ['messages = invenio_circulation'],
         'invenio_pidstore.fetchers': [
             'loanid = invenio_circulation.pidstore.fetchers:loan_pid_fetcher'
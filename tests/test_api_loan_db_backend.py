@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Tests for the database backend of the circulation lookup helpers."""
+
+import pytest
+
+from invenio_circulation.api import get_active_loans_by_item_pids, \
+    get_loan_for_item, get_pending_loans_by_doc_pid, \
+    get_pending_loans_by_item_pid, is_item_available_for_checkout
+from invenio_circulation.errors import MultipleLoansOnItemError
+
+from .helpers import SwappedConfig, create_loan
+
+DB_BACKENDS = dict(
+    get_loan_for_item="db",
+    is_item_available_for_checkout="db",
+    get_pending_loans_by_item_pid="db",
+    get_pending_loans_by_doc_pid="db",
+    get_active_loans_by_item_pids="db",
+)
+
+
+def test_db_get_loan_for_item(app, test_loans):
+    """Test retrieving the active loan of an item from the database."""
+    with SwappedConfig("CIRCULATION_LOAN_LOOKUP_BACKENDS", DB_BACKENDS):
+        pending_item_pid = dict(type="itemid", value="item_pending_1")
+        assert get_loan_for_item(pending_item_pid) is None
+
+        item_pid = dict(type="itemid", value="item_multiple_pending_on_loan_7")
+        loan = get_loan_for_item(item_pid)
+        assert loan["state"] == "ITEM_ON_LOAN"
+        assert loan["item_pid"] == item_pid
+        assert loan.id
+
+
+def test_db_multiple_active_loans(app, db, test_loans):
+    """Test that raises if there are multiple active Loans for given Item."""
+    item_pid = dict(type="itemid", value="item_multiple_pending_on_loan_7")
+    create_loan({
+        "item_pid": item_pid,
+        "patron_pid": "2",
+        "state": "ITEM_ON_LOAN",
+        "transaction_date": "2018-06-26T09:00:00.442118+00:00",
+        "transaction_location_pid": "loc_pid",
+        "transaction_user_pid": "user_pid",
+        "start_date": "2018-07-24",
+        "end_date": "2018-08-23",
+    })
+    db.session.commit()
+
+    with SwappedConfig("CIRCULATION_LOAN_LOOKUP_BACKENDS", DB_BACKENDS):
+        with pytest.raises(MultipleLoansOnItemError):
+            get_loan_for_item(item_pid)
+
+
+def test_db_is_item_available_for_checkout(app, test_loans):
+    """Test item availability from the database."""
+    with SwappedConfig("CIRCULATION_LOAN_LOOKUP_BACKENDS", DB_BACKENDS):
+        assert is_item_available_for_checkout(
+            dict(type="itemid", value="item_pending_1")
+        )
+        assert not is_item_available_for_checkout(
+            dict(type="itemid", value="item_multiple_pending_on_loan_7")
+        )
+
+
+def test_db_get_pending_loans(app, test_loans):
+    """Test retrieving pending loans from the database."""
+    with SwappedConfig("CIRCULATION_LOAN_LOOKUP_BACKENDS", DB_BACKENDS):
+        item_pid = dict(type="itemid", value="item_pending_1")
+        loans = list(get_pending_loans_by_item_pid(item_pid))
+        assert len(loans) == 1
+        assert loans[0]["state"] == "PENDING"
+
+        loans = list(get_pending_loans_by_doc_pid("document_pid"))
+        assert loans
+        assert all(loan["state"] == "PENDING" for loan in loans)
+
+
+def test_db_get_active_loans_by_item_pids(app, test_loans):
+    """Test retrieving the active loans of several items at once."""
+    item_pids = [
+        dict(type="itemid", value="item_pending_1"),
+        dict(type="itemid", value="item_multiple_pending_on_loan_7"),
+    ]
+    with SwappedConfig("CIRCULATION_LOAN_LOOKUP_BACKENDS", DB_BACKENDS):
+        loans = get_active_loans_by_item_pids(item_pids)
+    assert set(loans) == set([
+        ("itemid", "item_multiple_pending_on_loan_7"),
+    ])
+    assert [
+        loan["state"]
+        for loan in loans[("itemid", "item_multiple_pending_on_loan_7")]
+    ] == ["ITEM_ON_LOAN"]
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Tests for the anonymization of the loans."""
+
+import json
+from datetime import datetime, timedelta
+
+from flask import current_app
+from invenio_search import current_search
+
+from invenio_circulation.anonymization import anonymize_loans
+from invenio_circulation.proxies import current_circulation
+
+from .helpers import SwappedConfig
+
+
+def test_anonymize_loans(app, db, indexed_loans, tmpdir):
+    """Test removing the patron of the returned loans."""
+    returned = [
+        loan for _, loan in indexed_loans
+        if loan["state"] == "ITEM_RETURNED"
+    ]
+    revisions = dict((loan.id, loan.revision_id) for loan in returned)
+    checkpoint = str(tmpdir.join("checkpoint.json"))
+    before = datetime.utcnow() + timedelta(minutes=1)
+
+    result = anonymize_loans(
+        before=before, checkpoint=checkpoint, chunk_size=2
+    )
+    assert result["anonymized"] == len(returned)
+    assert result["indexed"] == len(returned)
+    assert not result["errors"]
+    with open(checkpoint) as fp:
+        assert json.load(fp)["pending"] == []
+
+    record_cls = current_circulation.loan_record_cls
+    for loan in returned:
+        anonymized_loan = record_cls.get_record(loan.id)
+        assert "patron_pid" not in anonymized_loan
+        assert "patron" not in anonymized_loan
+        assert anonymized_loan.revision_id == revisions[loan.id] + 1
+        if current_app.config.get("DB_VERSIONING"):
+            # no version of the loan still holds the patron
+            for version in anonymized_loan.model.versions:
+                assert "patron_pid" not in json.dumps(version.json)
+
+    current_search.flush_and_refresh(index="loans")
+    search = current_circulation.loan_search_cls()
+    assert search.filter("term", state="ITEM_RETURNED") \
+        .filter("exists", field="patron_pid").count() == 0
+
+    # the anonymized loans are not selected again
+    assert anonymize_loans(before=before)["anonymized"] == 0
+
+
+def test_anonymize_loans_fields(app, db, indexed_loans):
+    """Test selecting the loans with the configured anonymized fields."""
+    returned = [
+        loan for _, loan in indexed_loans
+        if loan["state"] == "ITEM_RETURNED"
+    ]
+    before = datetime.utcnow() + timedelta(minutes=1)
+    with SwappedConfig(
+        "CIRCULATION_LOAN_ANONYMIZED_FIELDS", ["transaction_user_pid"]
+    ):
+        assert anonymize_loans(before=before)["anonymized"] == len(returned)
+        # the anonymized loans are not selected again
+        assert anonymize_loans(before=before)["anonymized"] == 0
+
+    record_cls = current_circulation.loan_record_cls
+    for loan in returned:
+        anonymized_loan = record_cls.get_record(loan.id)
+        assert "transaction_user_pid" not in anonymized_loan
+        assert "patron_pid" in anonymized_loan
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Tests for the archival of the loans."""
+
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from flask import url_for
+from invenio_pidstore.errors import PIDDoesNotExistError
+
+from invenio_circulation.api import ArchivedLoan, Loan
+from invenio_circulation.archive import archive_loans, \
+    count_archivable_loans, restore_loans
+from invenio_circulation.errors import LoanArchivedError, LoansArchiveError
+from invenio_circulation.models import LoanArchive
+from invenio_circulation.reindex import count_loans
+
+
+def test_archive_and_restore_loans(app, db, test_loans):
+    """Test archiving the returned loans, resolving and restoring them."""
+    returned = [
+        loan for _, loan in test_loans if loan["state"] == "ITEM_RETURNED"
+    ]
+    before = datetime.utcnow() + timedelta(minutes=1)
+    assert count_archivable_loans(before) == len(returned)
+    assert count_archivable_loans() == 0
+
+    result = archive_loans(before=before, chunk_size=2, index=False)
+    assert result["archived"] == len(returned)
+    assert LoanArchive.query.count() == len(returned)
+    assert count_loans() == len(test_loans) - len(returned)
+
+    pid_value = returned[0]["pid"]
+    archived_loan = Loan.get_record_by_pid(pid_value)
+    assert isinstance(archived_loan, ArchivedLoan)
+    assert archived_loan["state"] == "ITEM_RETURNED"
+    assert archived_loan.model is None
+    assert archived_loan.id == returned[0].id
+    assert archived_loan.revision_id == returned[0].revision_id
+    assert archived_loan.updated == returned[0].updated
+    with pytest.raises(LoanArchivedError):
+        archived_loan.commit()
+    with pytest.raises(PIDDoesNotExistError):
+        Loan.get_record_by_pid(pid_value, with_archived=False)
+
+    with pytest.raises(LoansArchiveError):
+        restore_loans([pid_value, "unknown"], index=False)
+
+    restore_loans([pid_value], index=False)
+    loan = Loan.get_record_by_pid(pid_value, with_archived=False)
+    assert loan.id == returned[0].id
+    assert loan.revision_id == returned[0].revision_id
+    assert LoanArchive.query.count() == len(returned) - 1
+
+
+def test_rest_get_archived_loan(app, db, json_headers, test_loans):
+    """Test reading an archived loan with the REST API."""
+    returned = [
+        loan for _, loan in test_loans if loan["state"] == "ITEM_RETURNED"
+    ]
+    before = datetime.utcnow() + timedelta(minutes=1)
+    archive_loans(before=before, index=False)
+
+    loan = returned[0]
+    url = url_for("invenio_records_rest.loanid_item", pid_value=loan["pid"])
+    with app.test_client() as client:
+        res = client.get(url, headers=json_headers)
+        assert res.status_code == 200
+        assert res.headers["ETag"].strip('"') == str(loan.revision_id)
+        data = json.loads(res.data.decode("utf-8"))
+        assert data["id"] == loan["pid"]
+        assert data["metadata"]["state"] == "ITEM_RETURNED"
+        assert data["links"]["actions"] == {}
+
+        res = client.get(url_for(
+            "invenio_records_rest.loanid_item", pid_value="unknown"
+        ), headers=json_headers)
+        assert res.status_code == 404
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Tests for the loans cache."""
+
+import copy
+
+import mock
+import pytest
+from flask import url_for
+
+from invenio_circulation.api import Loan
+from invenio_circulation.cache import get_cached_loan
+from invenio_circulation.proxies import current_circulation
+
+
+class DictCache(object):
+    """Cache storing copies of the values in a dict."""
+
+    def __init__(self):
+        """Constructor."""
+        self.values = {}
+
+    def get(self, key):
+        """Return a copy of the cached value."""
+        return copy.deepcopy(self.values.get(key))
+
+    def set(self, key, value, timeout=None):
+        """Cache a value."""
+        self.values[key] = copy.deepcopy(value)
+
+    def add(self, key, value, timeout=None):
+        """Cache a value, unless already cached."""
+        self.values.setdefault(key, copy.deepcopy(value))
+
+    def delete(self, key):
+        """Remove a cached value."""
+        self.values.pop(key, None)
+
+
+@pytest.fixture()
+def loan_cache(app):
+    """Enable the loans cache."""
+    cache = DictCache()
+    ext = current_circulation._get_current_object()
+    with mock.patch.dict(ext.__dict__, loan_cache=cache):
+        yield cache
+
+
+def test_loan_cache(app, db, loan_cache, loan_created):
+    """Test serving the loans from the cache and invalidating them."""
+    pid_value = loan_created["pid"]
+    Loan.get_record_by_pid(pid_value)
+    db.session.expunge_all()
+
+    with mock.patch.object(Loan.model_cls, "query") as query:
+        loan = Loan.get_record_by_pid(pid_value)
+        assert not query.called
+    assert loan.id == loan_created.id
+    assert loan.revision_id == loan_created.revision_id
+
+    loan["state"] = "PENDING"
+    loan.commit()
+    db.session.commit()
+    assert "circulation:loan:{0}".format(loan.id) not in loan_cache.values
+    db.session.expunge_all()
+    assert Loan.get_record_by_pid(pid_value)["state"] == "PENDING"
+
+
+def test_loan_cache_stale_revision(app, db, loan_cache, loan_created):
+    """Test that a stale cached loan is read again from the database."""
+    Loan.get_record(loan_created.id)
+    db.session.expunge_all()
+
+    # the loan is changed without invalidating the cache
+    loan = Loan.get_record(loan_created.id, with_deleted=True)
+    loan["state"] = "CANCELLED"
+    super(Loan, loan).commit()
+    db.session.commit()
+    db.session.expunge_all()
+
+    fresh_loan = Loan.get_record(loan_created.id)
+    assert fresh_loan["state"] == "CANCELLED"
+    assert fresh_loan.revision_id == loan.revision_id
+    # the fresh loan replaced the stale one in the cache
+    cached = loan_cache.values["circulation:loan:{0}".format(loan.id)]
+    assert cached["json"]["state"] == "CANCELLED"
+
+    db.session.expunge_all()
+    fresh_loan = Loan.get_record(loan_created.id)
+    fresh_loan["state"] = "PENDING"
+    fresh_loan.commit()
+    db.session.commit()
+    assert Loan.get_record(loan_created.id)["state"] == "PENDING"
+
+
+def test_rest_get_cached_loan(app, db, json_headers, loan_cache, loan_created):
+    """Test that the REST reads of the loans are served from the cache."""
+    Loan.get_record(loan_created.id)
+    db.session.expunge_all()
+
+    url = url_for(
+        "invenio_records_rest.loanid_item", pid_value=loan_created["pid"]
+    )
+    with mock.patch(
+        "invenio_circulation.api.get_cached_loan", wraps=get_cached_loan
+    ) as get_cached, mock.patch("invenio_circulation.api.cache_loan") as cache:
+        with app.test_client() as client:
+            res = client.get(url, headers=json_headers)
+    assert res.status_code == 200
+    assert get_cached.called
+    # the loan was not read again from the database
+    assert not cache.called
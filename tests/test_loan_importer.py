@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Tests for the bulk import of loans."""
+
+import json
+
+import mock
+from invenio_pidstore.models import PersistentIdentifier
+from invenio_search import current_search
+
+from invenio_circulation.importer import import_loans
+from invenio_circulation.pidstore.pids import CIRCULATION_LOAN_PID_TYPE
+from invenio_circulation.pidstore.providers import CirculationLoanIdProvider
+from invenio_circulation.proxies import current_circulation
+
+
+def _lines(loans):
+    """Return the NDJSON lines of the loans."""
+    return [json.dumps(loan) + "\n" for loan in loans]
+
+
+def test_import_loans(app, db, params):
+    """Test creating loans in bulk with the invalid ones reported."""
+    errors = {}
+    lines = _lines([
+        dict(params, state="ITEM_ON_LOAN"),
+        dict(params, unknown_field="value"),
+        dict(params, pid="1"),
+    ]) + ["\n", "{not json\n"]
+
+    with mock.patch.object(
+        CirculationLoanIdProvider, "reserve",
+        wraps=CirculationLoanIdProvider.reserve,
+    ) as reserve:
+        result = import_loans(
+            lines, chunk_size=2, index=False, on_error=errors.__setitem__
+        )
+    assert result == dict(created=1, invalid=3, indexed=0)
+    assert sorted(errors) == [2, 3, 5]
+    # the PIDs are reserved for the valid loans only
+    assert [call[0][0] for call in reserve.call_args_list] == [1]
+
+    pid = PersistentIdentifier.query.filter_by(
+        pid_type=CIRCULATION_LOAN_PID_TYPE
+    ).one()
+    loan = current_circulation.loan_record_cls.get_record(pid.object_uuid)
+    assert loan["pid"] == pid.pid_value
+    assert loan["state"] == "ITEM_ON_LOAN"
+    assert loan["document_pid"] == "document_pid"
+    assert loan["item"]
+    assert loan.revision_id == 0
+
+
+def test_import_loans_indexed(app, db, es, params):
+    """Test that the imported loans are indexed."""
+    result = import_loans(_lines([params] * 3))
+    assert result == dict(created=3, invalid=0, indexed=3)
+
+    current_search.flush_and_refresh(index="loans")
+    search = current_circulation.loan_search_cls()
+    assert search.filter("term", patron_pid="patron_pid").count() == 3
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Tests for the bulk indexing of loans."""
+
+import mock
+from invenio_db import db
+from invenio_indexer.signals import before_record_index
+from invenio_search import current_search
+
+from invenio_circulation.indexer import flush_loans_indexing, \
+    get_partial_update_fields, index_loan, index_loans, loans_indexing_batch, \
+    teardown_loans_indexing
+from invenio_circulation.proxies import current_circulation
+
+from .helpers import SwappedConfig
+
+BULK_PATH = "invenio_circulation.indexer.bulk"
+
+
+def _indexed_ids(mock_bulk):
+    """Return the ids of the loans sent in each bulk request."""
+    return [
+        [action["_id"] for action in call[0][1]]
+        for call in mock_bulk.call_args_list
+    ]
+
+
+def test_index_loans_collected_during_request(app, test_loans):
+    """Test that the loans are indexed once, in one bulk request."""
+    (_, loan1), (_, loan2) = test_loans[:2]
+    with app.test_request_context():
+        with mock.patch(BULK_PATH, return_value=(2, [])) as mock_bulk:
+            index_loan(loan1)
+            index_loans([loan2, loan1])
+            assert not mock_bulk.called
+
+            flush_loans_indexing()
+            assert _indexed_ids(mock_bulk) == [
+                [str(loan2.id), str(loan1.id)]
+            ]
+
+            # nothing left to index at teardown
+            teardown_loans_indexing()
+            assert mock_bulk.call_count == 1
+
+
+def test_index_loans_without_batching(app, test_loans):
+    """Test that the loans are indexed immediately when disabled."""
+    _, loan = test_loans[0]
+    with SwappedConfig("CIRCULATION_LOAN_INDEXER_BATCHING", False):
+        with app.test_request_context():
+            with mock.patch(BULK_PATH, return_value=(1, [])) as mock_bulk:
+                index_loan(loan)
+                assert _indexed_ids(mock_bulk) == [[str(loan.id)]]
+
+
+def test_loans_indexing_batch(app, es, test_loans):
+    """Test indexing in bulk outside of a request."""
+    loans = [loan for _, loan in test_loans[:3]]
+    with loans_indexing_batch():
+        for loan in loans:
+            index_loan(loan)
+        index_loan(loans[0])
+    current_search.flush_and_refresh(index="loans")
+
+    search = current_circulation.loan_search_cls()
+    ids = [str(loan.id) for loan in loans]
+    assert search.filter("ids", values=ids).count() == 3
+
+
+def test_get_partial_update_fields(app):
+    """Test the fields changed by a transition."""
+    prev_loan = dict(state="PENDING", item_pid=dict(type="itemid", value="1"))
+
+    loan = dict(prev_loan, state="ITEM_ON_LOAN", end_date="2020-01-01")
+    assert get_partial_update_fields(prev_loan, loan) == {"state", "end_date"}
+
+    loan = dict(prev_loan, item_pid=dict(type="itemid", value="2"))
+    assert get_partial_update_fields(prev_loan, loan) is None
+
+    loan = dict(state="ITEM_ON_LOAN")
+    assert get_partial_update_fields(prev_loan, loan) is None
+
+    assert get_partial_update_fields(prev_loan, dict(prev_loan)) is None
+
+
+def test_get_partial_update_fields_signal_receivers(app):
+    """Test that the loans are fully indexed for other signal receivers."""
+    prev_loan = dict(state="PENDING")
+    loan = dict(prev_loan, state="ITEM_ON_LOAN")
+
+    def receiver(sender, json=None, record=None, **kwargs):
+        json["custom"] = record["state"]
+
+    before_record_index.connect(receiver)
+    try:
+        assert get_partial_update_fields(prev_loan, loan) is None
+    finally:
+        before_record_index.disconnect(receiver)
+    assert get_partial_update_fields(prev_loan, loan) == {"state"}
+
+
+def _get_indexed_loan(loan):
+    """Return the indexed loan."""
+    current_search.flush_and_refresh(index="loans")
+    search = current_circulation.loan_search_cls()
+    hits = search.filter("ids", values=[str(loan.id)]).execute().hits
+    assert len(hits) == 1
+    return hits[0]
+
+
+def test_partial_update(app, indexed_loans):
+    """Test updating only the changed fields of an indexed loan."""
+    _, loan = indexed_loans[0]
+    loan["state"] = "CANCELLED"
+    loan.commit()
+    db.session.commit()
+
+    index_loan(loan, fields={"state"})
+    hit = _get_indexed_loan(loan)
+    assert hit.state == "CANCELLED"
+    assert hit.patron_pid == loan["patron_pid"]
+    assert hit.meta.version == loan.revision_id
+
+
+def test_partial_update_fallback(app, es, test_loans):
+    """Test that a missing or outdated loan is fully indexed."""
+    _, loan = test_loans[0]
+    loan["state"] = "CANCELLED"
+    loan.commit()
+    db.session.commit()
+
+    # missing from the index
+    index_loan(loan, fields={"state"})
+    assert _get_indexed_loan(loan).state == "CANCELLED"
+
+    # indexed revision is not the previous one
+    loan["state"] = "ITEM_RETURNED"
+    loan.commit()
+    loan["extension_count"] = 1
+    loan.commit()
+    db.session.commit()
+
+    index_loan(loan, fields={"extension_count"})
+    hit = _get_indexed_loan(loan)
+    assert hit.state == "ITEM_RETURNED"
+    assert hit.extension_count == 1
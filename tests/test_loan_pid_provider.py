@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Tests for the loan PID providers."""
+
+import uuid
+
+import mock
+from invenio_pidstore.models import PIDStatus
+
+from invenio_circulation.pidstore.minters import loan_pid_minter
+from invenio_circulation.pidstore.providers import \
+    CirculationLoanIdBlockProvider
+from invenio_circulation.proxies import current_circulation
+
+from .helpers import SwappedConfig
+
+
+def test_block_provider(app, db):
+    """Test minting loan PIDs from blocks of reserved identifiers."""
+    ext = current_circulation._get_current_object()
+    blocks = [[10, 11], [20, 21]]
+    with mock.patch.dict(
+        ext.__dict__, loan_pid_provider=CirculationLoanIdBlockProvider
+    ), mock.patch.object(
+        db.engine.dialect, "name", "postgresql"
+    ), mock.patch.object(
+        CirculationLoanIdBlockProvider, "reserve", side_effect=blocks
+    ) as reserve, SwappedConfig("CIRCULATION_LOAN_PID_BLOCK_SIZE", 2):
+        CirculationLoanIdBlockProvider._blocks = {}
+        pid_values = []
+        for _ in range(3):
+            data = {}
+            pid = loan_pid_minter(uuid.uuid4(), data)
+            assert pid.status == PIDStatus.REGISTERED
+            pid_values.append(data["pid"])
+
+        assert pid_values == ["10", "11", "20"]
+        reserve.assert_called_with(2)
+        assert reserve.call_count == 2
+
+
+def test_block_provider_without_postgresql(app, db):
+    """Test that the identifiers are allocated one by one."""
+    if db.engine.dialect.name == "postgresql":
+        return
+    with mock.patch.object(
+        CirculationLoanIdBlockProvider, "reserve"
+    ) as reserve:
+        first = int(CirculationLoanIdBlockProvider.create().pid.pid_value)
+        second = int(CirculationLoanIdBlockProvider.create().pid.pid_value)
+        assert second == first + 1
+        assert not reserve.called
@@ -10,6 +10,11 @@
 
 from copy import deepcopy
 
+import mock
+import pytest
+from jsonschema.exceptions import ValidationError
+
+from invenio_circulation.ext import InvenioCirculation
 from invenio_circulation.proxies import current_circulation
 
 
@@ -26,3 +31,36 @@ def test_state_checkout_with_loan_pid(
 def test_indexed_loans(indexed_loans):
     """Test mappings, index creation and loans indexing."""
     assert indexed_loans
+
+
+def test_loan_validator(loan_created):
+    """Test the validation of the loans with the cached validator."""
+    assert current_circulation.get_loan_validator() is \
+        current_circulation.get_loan_validator()
+    loan_created.validate()
+
+    loan_created["unknown_field"] = "value"
+    with pytest.raises(ValidationError):
+        loan_created.validate()
+    # only the fields changed by a trusted transition are validated
+    loan_created.validate(validate_fields=["state"])
+    assert current_circulation.get_loan_validator(["state"]) is \
+        current_circulation.get_loan_validator(["state"])
+
+    loan_created["state"] = 1
+    with pytest.raises(ValidationError):
+        loan_created.validate(validate_fields=["state"])
+
+
+def test_loan_fields_validator_types(app):
+    """Test that the fields validators use the records validation types."""
+    types = dict(number=(int, float))
+    state = InvenioCirculation()
+    with mock.patch.dict(app.config, RECORDS_VALIDATION_TYPES=types), \
+            mock.patch("invenio_circulation.ext.validator_for") as factory:
+        state.get_loan_validator()
+        state.get_loan_validator(["state"])
+    validator_cls = factory.return_value
+    assert validator_cls.call_count == 2
+    for call in validator_cls.call_args_list:
+        assert call[1]["types"] == types
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Tests for the batched resolution of the loans references."""
+
+import json
+from contextlib import contextmanager
+
+import mock
+from flask import url_for
+from invenio_db import db
+from invenio_indexer.api import RecordIndexer
+from invenio_search import current_search
+from jsonresolver import JSONResolver
+
+from invenio_circulation.pidstore.fetchers import loan_pid_fetcher
+from invenio_circulation.proxies import current_circulation
+from invenio_circulation.records.jsonresolver.batch import resolve_loans_refs
+from invenio_circulation.records.serializers import json_v1_search_refs
+
+from .helpers import SwappedConfig, create_loan
+
+
+def _ref(app, loan_pid):
+    """Return the item reference of a loan."""
+    return {"$ref": "https://{0}/loans/{1}/item".format(
+        app.config["JSONSCHEMAS_HOST"], loan_pid
+    )}
+
+
+def test_resolve_loans_refs(app):
+    """Test resolving the item references of the loans at once."""
+    loans = [dict(pid=pid, item=_ref(app, pid)) for pid in ("1", "2", "1")]
+    endpoint = mock.Mock(side_effect=lambda loan_pid: dict(pid=loan_pid))
+    bulk_resolver = mock.Mock(side_effect=lambda loans: [
+        dict(pid=loan["pid"], bulk=True) for loan in loans
+    ])
+    with SwappedConfig(
+        "CIRCULATION_ITEM_RESOLVING_PATH", "/loans/<loan_pid>/item"
+    ), SwappedConfig(
+        "CIRCULATION_ITEM_RESOLVER_ENDPOINT", endpoint
+    ), SwappedConfig(
+        "CIRCULATION_ITEMS_BULK_RESOLVER", bulk_resolver
+    ):
+        resolver = JSONResolver(
+            plugins=["invenio_circulation.records.jsonresolver.item"]
+        )
+        with app.test_request_context():
+            resolve_loans_refs(loans)
+            assert bulk_resolver.call_count == 1
+            assert [loan["pid"] for loan in bulk_resolver.call_args[0][0]] \
+                == ["1", "2"]
+
+            item = resolver.resolve(_ref(app, "2")["$ref"])
+            assert item == dict(pid="2", bulk=True)
+            # not resolved in bulk, resolved once for the request
+            resolver.resolve(_ref(app, "3")["$ref"])
+            assert resolver.resolve(_ref(app, "3")["$ref"]) == dict(pid="3")
+            assert endpoint.call_count == 1
+
+        # outside of a request, each reference is resolved
+        resolver.resolve(_ref(app, "2")["$ref"])
+        assert endpoint.call_count == 2
+
+
+@contextmanager
+def _indexed_loans_with_refs(app, test_data, endpoint, bulk_resolver):
+    """Index loans with resolvable item references."""
+    # the references are resolved with the configured item endpoints
+    resolver = app.extensions["invenio-records"].resolver
+    with SwappedConfig(
+        "CIRCULATION_ITEM_REF_BUILDER",
+        lambda loan_pid, loan: _ref(app, loan_pid),
+    ), SwappedConfig(
+        "CIRCULATION_ITEM_RESOLVING_PATH", "/loans/<loan_pid>/item"
+    ), SwappedConfig(
+        "CIRCULATION_ITEM_RESOLVER_ENDPOINT", endpoint
+    ), SwappedConfig(
+        "CIRCULATION_ITEMS_BULK_RESOLVER", bulk_resolver
+    ), mock.patch.object(resolver, "url_map", None):
+        loans = [create_loan(data)[1] for data in test_data[:3]]
+        db.session.commit()
+        indexer = RecordIndexer()
+        for loan in loans:
+            indexer.index(loan)
+        current_search.flush_and_refresh(index="loans")
+        yield loans
+
+
+def test_rest_search_loans_refs(app, es_clear, json_headers, test_data):
+    """Test that the default search serializer keeps the references."""
+    endpoint = mock.Mock(side_effect=lambda loan_pid: dict(pid=loan_pid))
+    bulk_resolver = mock.Mock()
+    with _indexed_loans_with_refs(
+        app, test_data, endpoint, bulk_resolver
+    ) as loans:
+        with app.test_client() as client:
+            res = client.get(
+                url_for("invenio_records_rest.loanid_list"),
+                headers=json_headers,
+            )
+        assert res.status_code == 200
+        hits = json.loads(res.data.decode("utf-8"))["hits"]["hits"]
+        assert len(hits) == len(loans)
+        for hit in hits:
+            assert hit["metadata"]["item"] == _ref(app, hit["metadata"]["pid"])
+        assert not bulk_resolver.called
+        assert not endpoint.called
+
+
+def test_search_serializer_loans_refs(app, es_clear, test_data):
+    """Test resolving the item references of a page of loans at once."""
+    endpoint = mock.Mock(side_effect=lambda loan_pid: dict(pid=loan_pid))
+    bulk_resolver = mock.Mock(side_effect=lambda loans: [
+        dict(pid=loan["pid"], bulk=True) for loan in loans
+    ])
+    with _indexed_loans_with_refs(
+        app, test_data, endpoint, bulk_resolver
+    ) as loans:
+        search = current_circulation.loan_search_cls().params(version=True)
+        with app.test_request_context():
+            res = json_v1_search_refs(
+                loan_pid_fetcher, search.execute().to_dict()
+            )
+        assert res.status_code == 200
+        hits = json.loads(res.get_data(as_text=True))["hits"]["hits"]
+        assert len(hits) == len(loans)
+        for hit in hits:
+            assert hit["metadata"]["item"] == dict(
+                pid=hit["metadata"]["pid"], bulk=True
+            )
+        assert bulk_resolver.call_count == 1
+        assert not endpoint.called
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Tests for the loans reindex."""
+
+import json
+from multiprocessing.pool import ThreadPool
+
+import mock
+from invenio_db import db
+from invenio_indexer.api import RecordIndexer
+from invenio_search import current_search, current_search_client
+from invenio_search.utils import build_alias_name
+
+from invenio_circulation.api import Loan
+from invenio_circulation.proxies import current_circulation
+from invenio_circulation.reindex import check_loans_index, count_loans, \
+    index_loans_by_id, iter_loan_ids, iter_loans_index_drift, reindex_loans, \
+    reindex_loans_of, reindex_loans_since
+
+from .helpers import SwappedConfig, create_loan
+
+
+def test_iter_loan_ids(app, test_loans):
+    """Test the keyset pagination of the loans ids."""
+    chunks = list(iter_loan_ids(chunk_size=3))
+    ids = [loan_id for chunk in chunks for loan_id in chunk]
+
+    assert all(len(chunk) <= 3 for chunk in chunks)
+    assert ids == sorted(ids)
+    assert set(ids) == set(str(loan.id) for _, loan in test_loans)
+    assert count_loans() == len(test_loans)
+
+
+def test_index_loans_by_id(app, es_clear, test_loans):
+    """Test indexing a chunk of loans."""
+    ids = [str(loan.id) for _, loan in test_loans[:5]]
+    indexed, errors = index_loans_by_id(ids)
+    assert indexed == 5
+    assert not errors
+
+    current_search.flush_and_refresh(index="loans")
+    search = current_circulation.loan_search_cls()
+    assert search.filter("ids", values=ids).count() == 5
+
+
+def test_index_loans_summaries(app, es_clear, test_loans):
+    """Test indexing the patrons summaries retrieved at once."""
+    loans = [loan for _, loan in test_loans if loan.get("patron_pid")]
+    retriever = mock.Mock(side_effect=lambda pids: [
+        dict(name="Patron {0}".format(pid)) for pid in pids
+    ])
+    with SwappedConfig("CIRCULATION_PATRONS_SUMMARY_RETRIEVER", retriever):
+        indexed, _ = index_loans_by_id([str(loan.id) for loan in loans])
+        assert indexed == len(loans)
+        assert retriever.call_count == 1
+        assert sorted(retriever.call_args[0][0]) == ["1", "2", "3"]
+
+        current_search.flush_and_refresh(index="loans")
+        search = current_circulation.loan_search_cls()
+        hits = search.filter("term", patron_pid="2").scan()
+        assert [hit.patron_summary.name for hit in hits] == ["Patron 2"] * 3
+
+        # the loans of the changed patron only are indexed again
+        retriever.side_effect = lambda pids: [dict(name="New name")]
+        indexed, errors = reindex_loans_of(patron_pid="2")
+        assert indexed == 3
+        assert not errors
+        assert retriever.call_args[0][0] == ["2"]
+
+
+def test_reindex_loans(app, es_clear, indexed_loans):
+    """Test rebuilding the loans index and swapping its aliases."""
+    alias = build_alias_name("loans")
+    old_indices = set(current_search_client.indices.get_alias(name=alias))
+    # the first loaded loan, the loans are loaded in the order of their id
+    deleted_loan = min(
+        (loan for _, loan in indexed_loans), key=lambda loan: str(loan.id)
+    )
+
+    def delete_loan(*args):
+        # the loan is deleted once loaded, while the others are loaded
+        if progress.call_count == 1:
+            Loan.get_record(deleted_loan.id).delete()
+            db.session.commit()
+
+    progress = mock.Mock(side_effect=delete_loan)
+
+    # the workers are threads, sharing the database connection of the test
+    context = mock.Mock(Pool=ThreadPool)
+    with mock.patch(
+        "invenio_circulation.reindex.multiprocessing.get_context",
+        return_value=context,
+    ):
+        result = reindex_loans(
+            chunk_size=4, processes=2, delete_old=True, progress=progress
+        )
+    try:
+        # the loans changed since the start are indexed again
+        assert result["indexed"] >= len(indexed_loans)
+        assert result["deleted"] == 1
+        assert not result["errors"]
+        assert progress.called
+
+        indices = set(current_search_client.indices.get_alias(name=alias))
+        assert indices == {result["index"]}
+        for old_index in old_indices:
+            assert not current_search_client.indices.exists(index=old_index)
+
+        current_search.flush_and_refresh(index="loans")
+        search = current_circulation.loan_search_cls()
+        ids = [str(loan.id) for _, loan in indexed_loans]
+        assert search.filter("ids", values=ids).count() == len(ids) - 1
+        assert not search.filter("ids", values=[str(deleted_loan.id)]).count()
+    finally:
+        current_search_client.indices.delete(
+            index=result["index"], ignore=[404]
+        )
+
+
+def test_reindex_loans_since(app, db, es_clear, test_loans, tmpdir):
+    """Test the incremental reindex resuming from its checkpoint."""
+    _, first_loan = test_loans[0]
+    since = first_loan.updated
+    checkpoint = str(tmpdir.join("checkpoint.json"))
+
+    result = reindex_loans_since(
+        since=since, checkpoint=checkpoint, chunk_size=4
+    )
+    assert result["indexed"] == len(test_loans)
+    assert not result["errors"]
+    current_search.flush_and_refresh(index="loans")
+    search = current_circulation.loan_search_cls()
+    ids = [str(loan.id) for _, loan in test_loans]
+    assert search.filter("ids", values=ids).count() == len(test_loans)
+
+    # only the loans updated after the checkpoint are indexed again
+    first_loan["state"] = "CANCELLED"
+    first_loan.commit()
+    db.session.commit()
+    result = reindex_loans_since(checkpoint=checkpoint)
+    assert result["indexed"] == 1
+
+    with open(checkpoint) as fp:
+        assert json.load(fp)["id"] == str(first_loan.id)
+
+
+def test_check_loans_index(app, db, es_clear, indexed_loans, test_data):
+    """Test finding and repairing the loans not up to date in the index."""
+    _, outdated_loan = indexed_loans[0]
+    outdated_loan["state"] = "CANCELLED"
+    outdated_loan.commit()
+    _, missing_loan = create_loan(test_data[0])
+    db.session.commit()
+
+    drift = sorted(iter_loans_index_drift(chunk_size=3))
+    assert drift == sorted([
+        (str(outdated_loan.id), outdated_loan.revision_id,
+         outdated_loan.revision_id - 1),
+        (str(missing_loan.id), missing_loan.revision_id, None),
+    ])
+
+    result = check_loans_index(chunk_size=3, repair=True)
+    assert result["outdated"] == 1
+    assert result["missing"] == 1
+    assert result["repaired"] == 2
+    assert not result["errors"]
+
+    current_search.flush_and_refresh(index="loans")
+    assert not list(iter_loans_index_drift())
+    RecordIndexer().delete(missing_loan)
+
+
+def test_check_loans_index_not_refreshed(
+    app, db, es_clear, indexed_loans, test_data
+):
+    """Test that the loans indexed since the last refresh are up to date."""
+    _, loan = create_loan(test_data[0])
+    db.session.commit()
+    # the index is not refreshed
+    RecordIndexer().index(loan)
+
+    assert not list(iter_loans_index_drift(chunk_size=3))
+    RecordIndexer().delete(loan)
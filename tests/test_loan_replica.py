@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Tests for the routing of the loans reads to a replica."""
+
+import mock
+import pytest
+from invenio_db import db
+from sqlalchemy.orm import object_session, scoped_session, sessionmaker
+
+from invenio_circulation.api import Loan
+from invenio_circulation.proxies import current_circulation
+from invenio_circulation.replica import primary_session, read_session
+
+
+@pytest.fixture()
+def replica_session(app, db):
+    """Use a session on the test connection as replica."""
+    session = scoped_session(sessionmaker(bind=db.session.connection()))
+    ext = current_circulation._get_current_object()
+    with mock.patch.dict(ext.__dict__, replica_session=session):
+        yield session
+    session.remove()
+
+
+def test_read_session(app, replica_session):
+    """Test that only the reading requests use the replica."""
+    assert read_session() is db.session
+    with app.test_request_context(method="GET"):
+        assert read_session() is replica_session
+        with primary_session():
+            assert read_session() is db.session
+        assert read_session() is replica_session
+    with app.test_request_context(method="POST"):
+        assert read_session() is db.session
+
+
+def test_get_loan_from_replica(app, replica_session, loan_created):
+    """Test resolving a loan from the replica in a reading request."""
+    pid_value = loan_created["pid"]
+    with app.test_request_context(method="GET"):
+        loan = Loan.get_record_by_pid(pid_value)
+        assert object_session(loan.model) is replica_session()
+        with primary_session():
+            primary_loan = Loan.get_record_by_pid(pid_value)
+            assert object_session(primary_loan.model) is db.session()
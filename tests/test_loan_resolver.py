@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Tests for the loans PID resolver."""
+
+import mock
+import pytest
+from invenio_pidstore.errors import PIDDoesNotExistError
+from invenio_pidstore.models import PersistentIdentifier
+
+from invenio_circulation.api import Loan
+from invenio_circulation.pidstore.resolver import LoanPIDConverter, \
+    LoanResolver
+
+
+def test_loan_resolver(app, loan_created):
+    """Test resolving the PID and the loan with one query."""
+    pid_value = loan_created["pid"]
+    with mock.patch.object(PersistentIdentifier, "get") as get_pid, \
+            mock.patch.object(Loan.model_cls, "query") as query:
+        pid, loan = LoanResolver(Loan).resolve(pid_value)
+        assert not get_pid.called
+        assert not query.called
+    assert pid.pid_value == pid_value
+    assert loan.id == loan_created.id
+
+    with pytest.raises(PIDDoesNotExistError):
+        LoanResolver(Loan).resolve("unknown")
+
+
+def test_loan_resolver_request_loans(app, loan_created):
+    """Test that the loans are resolved once per request."""
+    pid_value = loan_created["pid"]
+    with app.test_request_context():
+        _, loan = LoanResolver(Loan).resolve(pid_value)
+        assert LoanResolver(Loan).resolve(pid_value)[1] is loan
+        assert Loan.get_record_by_pid(pid_value) is loan
+
+    with app.test_request_context():
+        assert Loan.get_record_by_pid(pid_value) is not loan
+
+
+def test_loan_pid_converter(app):
+    """Test that the loans routes resolve the PIDs with the loan resolver."""
+    rule = next(
+        rule for rule in app.url_map.iter_rules()
+        if rule.endpoint == "invenio_records_rest.loanid_item"
+    )
+    converter = rule._converters["pid_value"]
+    assert isinstance(converter, LoanPIDConverter)
+    assert type(converter.resolver) is LoanResolver
+    assert converter.resolver.with_archived
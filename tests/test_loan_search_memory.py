@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Tests for the in-memory loan search."""
+
+import mock
+import pytest
+from elasticsearch import VERSION as ES_VERSION
+
+from invenio_circulation.api import get_loan_for_item, \
+    is_item_available_for_checkout
+from invenio_circulation.batch import checkin_items
+from invenio_circulation.proxies import current_circulation
+from invenio_circulation.search.api import search_by_item_pids, \
+    search_by_patron_pid, search_by_pid
+from invenio_circulation.search.memory import InMemoryLoansIndexer, \
+    InMemoryLoansSearch, get_store
+
+
+def _total(search_result):
+    """Return total hits (ES6 compatibility)."""
+    if ES_VERSION[0] >= 7:
+        return search_result.hits.total.value
+    return search_result.hits.total
+
+
+@pytest.fixture()
+def memory_loans(base_app, test_loans):
+    """Index the test loans in the in-memory store."""
+    ext = current_circulation._get_current_object()
+    classes = dict(
+        loan_search_cls=InMemoryLoansSearch,
+        loan_indexer=InMemoryLoansIndexer,
+    )
+    indexer = InMemoryLoansIndexer()
+    for pid, loan in test_loans:
+        indexer.index(loan)
+    with mock.patch.dict(ext.__dict__, classes):
+        yield test_loans
+    get_store().clear()
+
+
+def test_memory_search_by_pid(memory_loans):
+    """Test search by item and document."""
+    item_pid = dict(type="itemid", value="item_multiple_pending_on_loan_7")
+    search = search_by_pid(
+        item_pid=item_pid, filter_states=["PENDING", "ITEM_ON_LOAN"]
+    )
+    assert _total(search.execute()) == 3
+
+    search = search_by_pid(item_pid=item_pid, exclude_states=["ITEM_ON_LOAN"])
+    assert search.count() == 2
+    assert all(hit["state"] != "ITEM_ON_LOAN" for hit in search.scan())
+
+    assert search_by_patron_pid("1").count() == 8
+
+
+def test_memory_search_sort(memory_loans):
+    """Test sorting the search results."""
+    search = search_by_pid(
+        document_pid="document_pid",
+        sort_by_field="transaction_date",
+        sort_order="desc",
+    )
+    dates = [hit["transaction_date"] for hit in search.scan()]
+    assert dates == sorted(dates, reverse=True)
+
+
+def test_memory_search_api_helpers(memory_loans):
+    """Test the circulation API helpers on the in-memory search."""
+    item_pid = dict(type="itemid", value="item_multiple_pending_on_loan_7")
+    loan = get_loan_for_item(item_pid)
+    assert loan["state"] == "ITEM_ON_LOAN"
+    assert not is_item_available_for_checkout(item_pid)
+    assert is_item_available_for_checkout(
+        dict(type="itemid", value="item_not_loaned")
+    )
+
+
+def test_memory_search_by_item_pids(memory_loans):
+    """Test searching the loans of several items at once."""
+    search = search_by_item_pids(
+        [
+            dict(type="itemid", value="item_multiple_pending_on_loan_7"),
+            dict(type="itemid", value="item_pending_on_loan_6"),
+            dict(type="otherid", value="item_not_loaned"),
+        ],
+        filter_states=["ITEM_ON_LOAN"],
+    )
+    values = sorted(hit["item_pid"]["value"] for hit in search.scan())
+    assert values == ["item_multiple_pending_on_loan_7",
+                      "item_pending_on_loan_6"]
+    assert search.source(False).count() == 2
+
+
+def test_memory_checkin_items(app, memory_loans):
+    """Test checking in items with the in-memory search."""
+    item_pid = dict(type="itemid", value="item_pending_on_loan_6")
+    with app.test_request_context():
+        committed, results, loans = checkin_items(
+            [item_pid, dict(type="itemid", value="unknown")],
+            transaction_location_pid="loc_pid",
+            transaction_user_pid="user_pid",
+        )
+    assert committed
+    assert [result["status"] for result in results] == [202, 404]
+    assert loans[0]["item_pid"] == item_pid
+    assert loans[0]["state"] != "ITEM_ON_LOAN"
+
+
+def test_memory_indexer_versions(memory_loans):
+    """Test that older revisions do not replace newer ones."""
+    pid, loan = memory_loans[0]
+    loan["state"] = "CANCELLED"
+    loan.commit()
+    indexer = InMemoryLoansIndexer()
+    indexer.index(loan)
+
+    search = InMemoryLoansSearch().filter("ids", values=[str(loan.id)])
+    hits = list(search.scan())
+    assert hits[0]["state"] == "CANCELLED"
+    assert hits[0].meta.version == loan.revision_id
+
+    get_store().index(str(loan.id), loan.revision_id - 1, dict(state="OLD"))
+    assert list(search.scan())[0]["state"] == "CANCELLED"
+
+    indexer.delete(loan)
+    assert search.count() == 0
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Tests for loan search profiling."""
+
+from flask import url_for
+
+from invenio_circulation.proxies import current_circulation
+from invenio_circulation.search.api import search_by_patron_pid, search_by_pid
+from invenio_circulation.search.profiling import LatencyHistogram
+
+from .helpers import SwappedConfig
+
+
+def test_latency_histogram():
+    """Test latency histogram buckets."""
+    histogram = LatencyHistogram([10, 100])
+    for value in (1, 10, 50, 1000):
+        histogram.record(value)
+
+    stats = histogram.to_dict()
+    assert stats["count"] == 4
+    assert stats["max"] == 1000
+    assert stats["buckets"] == {"<=10": 2, "<=100": 1, ">100": 1}
+
+
+def test_search_profiling_disabled(indexed_loans):
+    """Test that searches are not recorded when profiling is disabled."""
+    profiler = current_circulation.search_profiler
+    profiler.reset()
+    search_by_patron_pid("1").execute()
+    assert profiler.dump() == {}
+
+
+def test_search_profiling_per_helper(indexed_loans):
+    """Test that searches are recorded per helper."""
+    profiler = current_circulation.search_profiler
+    profiler.reset()
+    with SwappedConfig("CIRCULATION_SEARCH_PROFILING_ENABLED", True):
+        search_by_patron_pid("1").execute()
+        item_pid = dict(type="itemid", value="item_pending_1")
+        assert len(list(search_by_pid(item_pid=item_pid).scan())) == 1
+
+    stats = profiler.dump()
+    assert stats["search_by_patron_pid"]["wall"]["count"] == 1
+    assert stats["search_by_patron_pid"]["took"]["count"] == 1
+    assert stats["search_by_patron_pid"]["hits"] == 8
+    assert stats["search_by_pid"]["wall"]["count"] == 1
+    assert stats["search_by_pid"]["hits"] == 1
+    assert "query" in stats["search_by_pid"]["slowest"]
+
+
+def test_search_profiling_slow_search(app, indexed_loans, caplog):
+    """Test that slow searches are logged with the profile output."""
+    current_circulation.search_profiler.reset()
+    with SwappedConfig("CIRCULATION_SEARCH_PROFILING_ENABLED", True):
+        with SwappedConfig("CIRCULATION_SEARCH_PROFILING_THRESHOLD", -1):
+            search_by_patron_pid("1").execute()
+            # profiled once per interval
+            search_by_patron_pid("2").execute()
+
+    slow = [
+        r for r in caplog.records if "Slow loans search" in r.getMessage()
+    ]
+    assert len(slow) == 1
+    assert "search_by_patron_pid" in slow[0].getMessage()
+    stats = current_circulation.search_profiler.dump()
+    assert stats["search_by_patron_pid"]["wall"]["count"] == 2
+
+
+def test_rest_search_stats_requires_permission(app, json_headers):
+    """Test that anonymous users cannot dump the search statistics."""
+    url = url_for(
+        "invenio_circulation_loan_search_stats.loan_search_stats_resource"
+    )
+    with app.test_client() as client:
+        res = client.get(url, headers=json_headers)
+        assert res.status_code == 401
+        res = client.delete(url, headers=json_headers)
+        assert res.status_code == 401
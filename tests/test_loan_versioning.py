@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Tests for the versioning policy of the loans."""
+
+from datetime import datetime, timedelta
+
+import pytest
+from flask import current_app
+from invenio_db import db
+
+from invenio_circulation.versioning import compact_loan_versions, is_delta, \
+    iter_loan_versions
+
+from .helpers import SwappedConfig
+
+STATES = ["PENDING", "ITEM_AT_DESK", "ITEM_ON_LOAN", "ITEM_RETURNED"]
+
+
+@pytest.fixture()
+def versioning(app):
+    """Skip the tests when the records are not versioned."""
+    if not current_app.config.get("DB_VERSIONING"):
+        pytest.skip("Records versioning is disabled.")
+
+
+def _change_states(loan):
+    """Commit each state of the loan."""
+    for state in STATES:
+        loan["state"] = state
+        loan.commit()
+        db.session.commit()
+
+
+def _stored_versions(loan):
+    """Return the versions of the loan as stored."""
+    return [version.json for version in loan.model.versions]
+
+
+def test_loan_versioning_off(versioning, loan_created):
+    """Test that no version of the loans is written."""
+    with SwappedConfig("CIRCULATION_LOAN_VERSIONING", "off"):
+        _change_states(loan_created)
+        # the versioning is disabled for the flush only
+        assert "__versioned__" not in vars(loan_created.model)
+    assert len(_stored_versions(loan_created)) == 1
+
+    _change_states(loan_created)
+    assert len(_stored_versions(loan_created)) == len(STATES) + 1
+
+
+def test_loan_versioning_keep(versioning, loan_created):
+    """Test that the last versions of the loans are kept."""
+    since = datetime.utcnow() - timedelta(minutes=1)
+    with SwappedConfig("CIRCULATION_LOAN_VERSIONING", "keep"), \
+            SwappedConfig("CIRCULATION_LOAN_VERSIONS_KEPT", 2):
+        _change_states(loan_created)
+        # the versions are pruned periodically, not by the flushes
+        assert len(_stored_versions(loan_created)) == len(STATES) + 1
+
+        result = compact_loan_versions(updated_since=since)
+        assert result == dict(deleted=len(STATES) - 1, compacted=0)
+    db.session.expire_all()
+    versions = _stored_versions(loan_created)
+    assert [version["state"] for version in versions] == STATES[-2:]
+
+
+def test_loan_versioning_delta(versioning, loan_created):
+    """Test storing the previous versions of the loans as deltas."""
+    initial_state = loan_created["state"]
+    with SwappedConfig("CIRCULATION_LOAN_VERSIONING", "delta"):
+        _change_states(loan_created)
+        compact_loan_versions()
+        db.session.expire_all()
+        versions = _stored_versions(loan_created)
+        assert all(is_delta(version) for version in versions[:-1])
+        assert not is_delta(versions[-1])
+
+        rebuilt = [
+            data["state"]
+            for _, data in iter_loan_versions(loan_created.id)
+        ]
+        assert rebuilt == list(reversed([initial_state] + STATES))
+
+
+def test_loan_revisions_delta(versioning, loan_created):
+    """Test reading and reverting the revisions stored as deltas."""
+    initial_state = loan_created["state"]
+    with SwappedConfig("CIRCULATION_LOAN_VERSIONING", "delta"):
+        _change_states(loan_created)
+        compact_loan_versions()
+        db.session.expire_all()
+
+        revisions = loan_created.revisions
+        assert [revision["state"] for revision in revisions] == \
+            [initial_state] + STATES
+        assert not any(is_delta(revision) for revision in revisions)
+        assert revisions[1]["state"] == STATES[0]
+        assert revisions[1]["pid"] == loan_created["pid"]
+
+        loan = loan_created.revert(1)
+        db.session.commit()
+        assert loan["state"] == STATES[0]
+        assert loan["pid"] == loan_created["pid"]
+        assert not is_delta(loan.model.json)
+
+
+def test_compact_loan_versions(versioning, loan_created):
+    """Test applying a new policy to the existing versions."""
+    _change_states(loan_created)
+    assert len(_stored_versions(loan_created)) == len(STATES) + 1
+
+    with SwappedConfig("CIRCULATION_LOAN_VERSIONING", "keep"), \
+            SwappedConfig("CIRCULATION_LOAN_VERSIONS_KEPT", 1):
+        result = compact_loan_versions(chunk_size=1)
+    assert result == dict(deleted=len(STATES), compacted=0)
+    db.session.expire_all()
+    assert len(_stored_versions(loan_created)) == 1
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Tests for the batch loan actions REST endpoint."""
+
+import json
+
+import mock
+from flask import url_for
+from invenio_db import db
+
+from invenio_circulation.batch import run_loan_actions
+from invenio_circulation.indexer import flush_loans_indexing, index_loan
+from invenio_circulation.proxies import current_circulation
+
+from .helpers import SwappedConfig, create_loan
+
+
+def _post(client, json_headers, actions, atomic=False):
+    """Post the batch of actions and return the status and the body."""
+    url = url_for(
+        "invenio_circulation_loan_batch_actions.loan_batch_actions_resource"
+    )
+    res = client.post(
+        url,
+        headers=json_headers,
+        data=json.dumps(dict(actions=actions, atomic=atomic)),
+    )
+    return res.status_code, json.loads(res.data.decode("utf-8"))
+
+
+def _get_state(loan):
+    """Return the state of the loan stored in the database."""
+    record_cls = current_circulation.loan_record_cls
+    return record_cls.get_record(loan.id)["state"]
+
+
+def test_rest_batch_actions_partial(app, json_headers, params):
+    """Test that the failed actions are rolled back alone."""
+    loans = [create_loan({})[1], create_loan({})[1]]
+    db.session.commit()
+    actions = [
+        dict(pid=loans[0]["pid"], action="checkout", params=params),
+        dict(pid="unknown", action="checkout", params=params),
+        dict(pid=loans[1]["pid"], action="checkout", params=params),
+    ]
+    with app.test_client() as client:
+        status, body = _post(client, json_headers, actions)
+    assert status == 202
+    assert body["committed"]
+    assert [result["status"] for result in body["results"]] == \
+        [202, 404, 202]
+    assert body["results"][0]["state"] == "ITEM_ON_LOAN"
+    assert [_get_state(loan) for loan in loans] == ["ITEM_ON_LOAN"] * 2
+
+
+def test_rest_batch_actions_atomic(app, json_headers, params):
+    """Test that no action is committed when one fails."""
+    _, loan = create_loan({})
+    db.session.commit()
+    actions = [
+        dict(pid=loan["pid"], action="checkout", params=params),
+        dict(pid=loan["pid"], action="checkout", params=params),
+    ]
+    with app.test_client() as client:
+        status, body = _post(client, json_headers, actions, atomic=True)
+    assert status == 400
+    assert not body["committed"]
+    assert [result["status"] for result in body["results"]] == [202, 400]
+    assert _get_state(loan) == "CREATED"
+
+
+def test_rest_batch_actions_invalid(app, json_headers, params):
+    """Test that the batches too large or malformed are rejected."""
+    _, loan = create_loan({})
+    db.session.commit()
+    with app.test_client() as client:
+        status, _ = _post(client, json_headers, [dict(pid=loan["pid"])])
+        assert status == 400
+
+        actions = [dict(pid=loan["pid"], action="checkout", params=params)]
+        with SwappedConfig("CIRCULATION_LOAN_BATCH_MAX_ACTIONS", 0):
+            status, _ = _post(client, json_headers, actions)
+        assert status == 400
+    assert _get_state(loan) == "CREATED"
+
+
+def test_batch_actions_failed_action_forgotten(app, params):
+    """Test that the next actions do not see the changes of a failed one."""
+    _, loan = create_loan({})
+    db.session.commit()
+    actions = [
+        # the loan fails the validation once checked out
+        dict(pid=loan["pid"], action="checkout",
+             params=dict(params, cancel_reason=123)),
+        dict(pid=loan["pid"], action="checkout", params=params),
+    ]
+    with app.test_request_context():
+        committed, results, _ = run_loan_actions(actions)
+    assert committed
+    assert [result["status"] for result in results] == [400, 202]
+
+    record_cls = current_circulation.loan_record_cls
+    record = record_cls.get_record(loan.id)
+    assert record["state"] == "ITEM_ON_LOAN"
+    assert "cancel_reason" not in record
+
+
+def test_batch_actions_rollback_keeps_queue(app, params):
+    """Test that the loans queued before a failed batch are still indexed."""
+    _, queued_loan = create_loan({})
+    _, loan = create_loan({})
+    db.session.commit()
+    actions = [
+        dict(pid=loan["pid"], action="checkout", params=params),
+        dict(pid="unknown", action="checkout", params=params),
+    ]
+    with app.test_request_context():
+        index_loan(queued_loan)
+        committed, _, _ = run_loan_actions(actions, atomic=True)
+        assert not committed
+        with mock.patch("invenio_circulation.indexer._bulk_index") as index:
+            flush_loans_indexing()
+    assert [entry[0].id for entry in index.call_args[0][0]] == \
+        [queued_loan.id]
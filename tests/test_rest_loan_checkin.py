@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Tests for the bulk check-in REST endpoint."""
+
+import json
+import uuid
+
+import mock
+from flask import url_for
+from invenio_db import db
+from invenio_indexer.api import RecordIndexer
+from invenio_search import current_search
+
+from invenio_circulation.api import Loan
+from invenio_circulation.errors import MissingRequiredParameterError
+from invenio_circulation.pidstore.minters import loan_pid_minter
+from invenio_circulation.proxies import current_circulation
+
+from .helpers import create_loan
+
+
+def _index(*loans):
+    """Index the loans and make them searchable."""
+    indexer = RecordIndexer()
+    for loan in loans:
+        indexer.index(loan)
+    current_search.flush_and_refresh(index="loans")
+
+
+def _checkout_loan(params, item_value):
+    """Create a new loan on the item and check it out."""
+    record_uuid = uuid.uuid4()
+    data = {}
+    loan_pid_minter(record_uuid, data=data)
+    loan = Loan.create(data=data, id_=record_uuid)
+    db.session.commit()
+    item_pid = dict(type="itemid", value=item_value)
+    loan = current_circulation.circulation.trigger(
+        loan, **dict(params, item_pid=item_pid, trigger="checkout")
+    )
+    _index(loan)
+    return loan
+
+
+def _create_pending_loan():
+    """Create a pending loan on the document of the items, with no item."""
+    _, loan = create_loan(dict(
+        document_pid="document_pid",
+        patron_pid="2",
+        state="PENDING",
+        transaction_date="2018-07-24T09:00:00.442118+00:00",
+        transaction_location_pid="loc_pid",
+        transaction_user_pid="user_pid",
+        pickup_location_pid="pickup_location_pid",
+        request_start_date="2018-08-15",
+        request_expire_date="2018-08-23",
+    ))
+    db.session.commit()
+    _index(loan)
+    return loan
+
+
+def _post(client, json_headers, item_values, atomic=False):
+    """Post the items to check in and return the status and the body."""
+    url = url_for("invenio_circulation_loan_checkin.loan_checkin_resource")
+    data = dict(
+        item_pids=[dict(type="itemid", value=value) for value in item_values],
+        transaction_location_pid="loc_pid",
+        transaction_user_pid="user_pid",
+        atomic=atomic,
+    )
+    res = client.post(url, headers=json_headers, data=json.dumps(data))
+    return res.status_code, json.loads(res.data.decode("utf-8"))
+
+
+def _get_state(loan):
+    """Return the state of the loan stored in the database."""
+    record_cls = current_circulation.loan_record_cls
+    return record_cls.get_record(loan.id)["state"]
+
+
+@mock.patch(
+    "invenio_circulation.transitions.transitions"
+    ".get_pending_loans_by_doc_pids"
+)
+def test_rest_checkin_items(
+    mock_pending_loans, app, es_clear, json_headers, params
+):
+    """Test checking in a list of items at once."""
+    mock_pending_loans.return_value = []
+    loans = [
+        _checkout_loan(params, "item_1"),
+        _checkout_loan(params, "item_2"),
+    ]
+    with app.test_client() as client:
+        status, body = _post(
+            client, json_headers, ["item_1", "unknown", "item_2"]
+        )
+    assert status == 202
+    assert body["committed"]
+    assert [result["status"] for result in body["results"]] == \
+        [202, 404, 202]
+    assert body["results"][0]["pid"] == loans[0]["pid"]
+    assert body["results"][0]["state"] == "ITEM_RETURNED"
+    assert [_get_state(loan) for loan in loans] == ["ITEM_RETURNED"] * 2
+    # the pending requests of the returned items are updated at once
+    assert mock_pending_loans.call_count == 1
+
+
+@mock.patch(
+    "invenio_circulation.transitions.transitions"
+    ".get_pending_loans_by_doc_pids"
+)
+def test_rest_checkin_items_atomic(
+    mock_pending_loans, app, es_clear, json_headers, params
+):
+    """Test that no item is checked in when one fails."""
+    loan = _checkout_loan(params, "item_1")
+    with app.test_client() as client:
+        status, body = _post(
+            client, json_headers, ["item_1", "unknown"], atomic=True
+        )
+        assert status == 400
+        assert not body["committed"]
+        assert [result["status"] for result in body["results"]] == \
+            [202, 404]
+        assert _get_state(loan) == "ITEM_ON_LOAN"
+        assert not mock_pending_loans.called
+
+        status, _ = _post(client, json_headers, [])
+        assert status == 400
+
+
+def test_rest_checkin_items_pending_requests(
+    app, es_clear, json_headers, params
+):
+    """Test that the returned items are attached to the pending requests."""
+    loans = [
+        _checkout_loan(params, "item_1"),
+        _checkout_loan(params, "item_2"),
+    ]
+    pending_loan = _create_pending_loan()
+    with app.test_client() as client:
+        status, body = _post(client, json_headers, ["item_1", "item_2"])
+    assert status == 202
+    assert body["committed"]
+    assert [_get_state(loan) for loan in loans] == ["ITEM_RETURNED"] * 2
+
+    record_cls = current_circulation.loan_record_cls
+    pending_loan = record_cls.get_record(pending_loan.id)
+    assert pending_loan["state"] == "PENDING"
+    # the last returned item of the document
+    assert pending_loan["item_pid"] == dict(type="itemid", value="item_2")
+
+
+@mock.patch(
+    "invenio_circulation.transitions.transitions"
+    ".get_pending_loans_by_doc_pids"
+)
+def test_rest_checkin_items_pending_requests_error(
+    mock_pending_loans, app, es_clear, json_headers, params
+):
+    """Test that no item is checked in when the requests update fails."""
+    mock_pending_loans.side_effect = MissingRequiredParameterError(
+        description="Unknown document."
+    )
+    loan = _checkout_loan(params, "item_1")
+    with app.test_client() as client:
+        status, body = _post(client, json_headers, ["item_1", "unknown"])
+    assert status == 400
+    assert not body["committed"]
+    assert [result["status"] for result in body["results"]] == [400, 404]
+    assert _get_state(loan) == "ITEM_ON_LOAN"
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Tests for read-your-writes consistency tokens."""
+
+import json
+
+import mock
+from flask import url_for
+from invenio_search import current_search
+
+from invenio_circulation.pidstore.fetchers import loan_pid_fetcher
+
+from .helpers import SwappedConfig
+
+TOKEN_HEADER = "X-Consistency-Token"
+
+
+def _checkout(client, json_headers, params, loan):
+    """Checkout the loan and return the response."""
+    loan_pid = loan_pid_fetcher(loan.id, loan)
+    url = url_for(
+        "invenio_circulation_loan_actions.loanid_actions",
+        pid_value=loan_pid.pid_value,
+        action="checkout",
+    )
+    return client.post(url, headers=json_headers, data=json.dumps(params))
+
+
+def _search(client, json_headers, loan, token=None):
+    """Search the loan and return the list of hits."""
+    url = url_for(
+        "invenio_records_rest.loanid_list", q="pid:{}".format(loan["pid"])
+    )
+    headers = list(json_headers)
+    if token:
+        headers.append((TOKEN_HEADER, token))
+    res = client.get(url, headers=headers)
+    assert res.status_code == 200
+    return json.loads(res.data.decode("utf-8"))["hits"]["hits"]
+
+
+def test_rest_action_returns_consistency_token(
+    app, json_headers, params, loan_created
+):
+    """Test that a search presenting the token sees the action result."""
+    with app.test_client() as client:
+        res = _checkout(client, json_headers, params, loan_created)
+        assert res.status_code == 202
+        token = res.headers[TOKEN_HEADER]
+
+        hits = _search(client, json_headers, loan_created, token=token)
+        assert len(hits) == 1
+        assert hits[0]["metadata"]["state"] == "ITEM_ON_LOAN"
+
+
+def test_rest_consistency_token_wait_strategy(
+    app, json_headers, params, loan_created
+):
+    """Test the wait strategy falling back to an index refresh."""
+    with SwappedConfig("CIRCULATION_CONSISTENCY_STRATEGY", "wait"):
+        with SwappedConfig("CIRCULATION_CONSISTENCY_WAIT_TIMEOUT", 0):
+            with app.test_client() as client:
+                res = _checkout(client, json_headers, params, loan_created)
+                token = res.headers[TOKEN_HEADER]
+
+                hits = _search(client, json_headers, loan_created, token)
+                assert hits[0]["metadata"]["state"] == "ITEM_ON_LOAN"
+
+
+def test_rest_consistency_token_visible(
+    app, json_headers, params, loan_created
+):
+    """Test that the index is not refreshed when the loan is visible."""
+    with app.test_client() as client:
+        res = _checkout(client, json_headers, params, loan_created)
+        token = res.headers[TOKEN_HEADER]
+        current_search.flush_and_refresh(index="loans")
+
+        with mock.patch(
+            "invenio_circulation.search.consistency._refresh"
+        ) as refresh:
+            hits = _search(client, json_headers, loan_created, token)
+        assert hits[0]["metadata"]["state"] == "ITEM_ON_LOAN"
+        assert not refresh.called
+
+
+def test_rest_invalid_consistency_token(app, json_headers):
+    """Test that an invalid token is rejected."""
+    url = url_for("invenio_records_rest.loanid_list")
+    headers = json_headers + [(TOKEN_HEADER, "invalid")]
+    with app.test_client() as client:
+        res = client.get(url, headers=headers)
+        assert res.status_code == 400
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Tests for the ETags and the conditional requests on the loans."""
+
+import json
+
+import mock
+from flask import url_for
+from invenio_records_rest.utils import allow_all
+
+from invenio_circulation.pidstore.fetchers import loan_pid_fetcher
+from invenio_circulation.pidstore.resolver import LoanResolver
+from invenio_circulation.proxies import current_circulation
+
+
+def _headers(json_headers, name, etag):
+    """Return the JSON headers with the ETag condition."""
+    return list(json_headers) + [(name, '"{0}"'.format(etag))]
+
+
+def test_rest_get_loan_not_modified(app, json_headers, loan_created):
+    """Test that an unchanged loan is not loaded again."""
+    loan_pid = loan_pid_fetcher(loan_created.id, loan_created)
+    url = url_for(
+        "invenio_records_rest.loanid_item", pid_value=loan_pid.pid_value
+    )
+    with app.test_client() as client:
+        res = client.get(url, headers=json_headers)
+        assert res.status_code == 200
+        etag = res.headers["ETag"].strip('"')
+        assert etag == str(loan_created.revision_id)
+
+        with mock.patch.object(LoanResolver, "_resolve") as resolve:
+            res = client.get(
+                url, headers=_headers(json_headers, "If-None-Match", etag)
+            )
+            assert res.status_code == 304
+            assert not resolve.called
+
+        res = client.get(
+            url, headers=_headers(json_headers, "If-None-Match", "stale")
+        )
+        assert res.status_code == 200
+
+
+def test_rest_get_loan_record_permission(app, json_headers, loan_created):
+    """Test that the loan is loaded when its read permission needs it."""
+    loan_pid = loan_pid_fetcher(loan_created.id, loan_created)
+    url = url_for(
+        "invenio_records_rest.loanid_item", pid_value=loan_pid.pid_value
+    )
+    etag = str(loan_created.revision_id)
+    options = app.config["RECORDS_REST_ENDPOINTS"]["loanid"]
+    with mock.patch.dict(
+        options, read_permission_factory_imp=lambda record: allow_all()
+    ), mock.patch.object(
+        LoanResolver, "_resolve", autospec=True,
+        side_effect=LoanResolver._resolve,
+    ) as resolve:
+        with app.test_client() as client:
+            res = client.get(
+                url, headers=_headers(json_headers, "If-None-Match", etag)
+            )
+        assert res.status_code == 304
+        assert resolve.called
+
+
+def test_rest_action_precondition(app, json_headers, params, loan_created):
+    """Test that an action on a changed loan is rejected."""
+    loan_pid = loan_pid_fetcher(loan_created.id, loan_created)
+    url = url_for(
+        "invenio_circulation_loan_actions.loanid_actions",
+        pid_value=loan_pid.pid_value,
+        action="checkout",
+    )
+    stale_etag = str(loan_created.revision_id + 1)
+    with app.test_client() as client:
+        res = client.post(
+            url,
+            headers=_headers(json_headers, "If-Match", stale_etag),
+            data=json.dumps(params),
+        )
+        assert res.status_code == 412
+        record_cls = current_circulation.loan_record_cls
+        assert record_cls.get_record(loan_created.id)["state"] == "CREATED"
+
+        res = client.post(
+            url,
+            headers=_headers(
+                json_headers, "If-Match", loan_created.revision_id
+            ),
+            data=json.dumps(params),
+        )
+        assert res.status_code == 202
+        assert res.headers["ETag"].strip('"') != str(
+            loan_created.revision_id
+        )
+
+
+def test_rest_search_not_modified(app, json_headers):
+    """Test that an unchanged page of search results is not serialized."""
+    url = url_for("invenio_records_rest.loanid_list", q="pid:unknown")
+    with app.test_client() as client:
+        res = client.get(url, headers=json_headers)
+        assert res.status_code == 200
+        etag = res.headers["ETag"].strip('"')
+
+        res = client.get(
+            url, headers=_headers(json_headers, "If-None-Match", etag)
+        )
+        assert res.status_code == 304
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 CERN.
+# Copyright (C) 2018-2020 RERO.
+#
+# Invenio-Circulation is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License; see LICENSE file for more details.
+
+"""Tests for the streaming export of the loans searches."""
+
+import csv
+import json
+
+from flask import url_for
+from invenio_records_rest.utils import allow_all
+
+from invenio_circulation.records.serializers.export import csv_export, \
+    ndjson_export
+
+from .helpers import SwappedConfig
+
+
+def test_export_serializers():
+    """Test serializing the projected fields of the loans."""
+    hits = [
+        dict(pid="1", state="PENDING"),
+        dict(pid="2", item_pid=dict(type="itemid", value="item_pid")),
+    ]
+    fields = ["pid", "item_pid.value"]
+
+    rows = [json.loads(row) for row in ndjson_export(hits, fields)]
+    assert rows == [{"pid": "1"}, {"pid": "2", "item_pid.value": "item_pid"}]
+
+    rows = list(csv.reader("".join(csv_export(hits, fields)).splitlines()))
+    assert rows == [fields, ["1", ""], ["2", "item_pid"]]
+
+
+def test_rest_export_loans(app, indexed_loans):
+    """Test streaming the loans of a search."""
+    with SwappedConfig(
+        "CIRCULATION_VIEWS_PERMISSIONS_FACTORY", lambda action: allow_all()
+    ), SwappedConfig("CIRCULATION_LOAN_EXPORT_SCROLL_SIZE", 2):
+        with app.test_client() as client:
+            url = url_for(
+                "invenio_circulation_loan_export.loan_export_resource",
+                q="state:PENDING",
+                fields="pid,state",
+            )
+            res = client.get(url)
+            assert res.status_code == 200
+            assert res.mimetype == "application/x-ndjson"
+            rows = [json.loads(row) for row in res.data.splitlines()]
+            assert len(rows) == 4
+            assert all(set(row) == {"pid", "state"} for row in rows)
+
+            res = client.get(url_for(
+                "invenio_circulation_loan_export.loan_export_resource",
+                format="csv",
+            ))
+            assert res.status_code == 200
+            assert res.mimetype == "text/csv"
+            assert len(res.data.decode("utf-8").splitlines()) == 14
+
+            res = client.get(url_for(
+                "invenio_circulation_loan_export.loan_export_resource",
+                format="xml",
+            ))
+            assert res.status_code == 400
+
+
+def test_rest_export_loans_requires_permission(app):
+    """Test that anonymous users cannot export the loans."""
+    url = url_for("invenio_circulation_loan_export.loan_export_resource")
+    with app.test_client() as client:
+        res = client.get(url)
+        assert res.status_code == 401
@@ -100,3 +100,22 @@ def test_rest_loan_invalid_action(
                          pid_value=loan_pid.pid_value, action='extend')
     assert res.status_code == 400
     assert 'message' in payload
+
+
+def test_rest_loan_action_minimal_response(
+    app, json_headers, params, loan_created
+):
+    """Test API action on loan returning a minimal response."""
+    loan_pid = loan_pid_fetcher(loan_created.id, loan_created)
+    headers = json_headers + [('Prefer', 'return=minimal')]
+
+    res, payload = _post(app, headers, params,
+                         pid_value=loan_pid.pid_value, action='checkout')
+    assert res.status_code == 202
+    assert res.headers['Preference-Applied'] == 'return=minimal'
+    assert payload['pid'] == loan_pid.pid_value
+    assert payload['state'] == 'ITEM_ON_LOAN'
+    assert payload['revision'] == loan_created.revision_id + 1
+    assert 'end_date' in payload
+    assert 'links' not in payload
+    assert 'metadata' not in payload